@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+app_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask_app')
+
+# Modules run as entry points (web app, cronjob, resident scheduler, CLI, drift scan, webhook test sender)
+ENTRY_POINTS = ('app', 'periodic_enforcement', 'scheduler', 'cli', 'drift_scan', 'webhook_sender')
+
+# Imported in a fresh interpreter: import time, and what the import left behind (Dashboard sessions, log handlers,
+# threads)
+PROBE = """
+import json, logging, sys, threading, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'seconds': elapsed, 'meraki_loaded': 'meraki' in sys.modules,
+                  'log_handlers': len(logging.getLogger('my_logger').handlers),
+                  'threads': threading.active_count()}}))
+"""
+
+
+def measure(module, repeat):
+    """
+    Import a module in fresh interpreters (without a Meraki API key in the environment)
+    :param module: Module name
+    :param repeat: Number of interpreters started
+    :return: Dictionary of results, or the import error
+    """
+    env = {key: value for key, value in os.environ.items() if key != 'MERAKI_API_KEY'}
+
+    samples = []
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, '-c', PROBE.format(module=module)], cwd=app_folder, env=env,
+                                 capture_output=True, text=True)
+        if process.returncode != 0:
+            return {'module': module, 'error': process.stderr.strip().splitlines()[-1]}
+        samples.append(json.loads(process.stdout.strip().splitlines()[-1]))
+
+    times = sorted(sample['seconds'] * 1000 for sample in samples)
+    return dict(samples[-1], module=module, median_ms=round(statistics.median(times), 1),
+                min_ms=round(times[0], 1), max_ms=round(times[-1], 1))
+
+
+def main():
+    """
+    Measure the cold import time of every entry point (each import runs in its own interpreter)
+    """
+    parser = argparse.ArgumentParser(description='Entry point import time benchmark')
+    parser.add_argument('--repeat', type=int, default=10, help='Imports per entry point')
+    parser.add_argument('--json', action='store_true', help='Print JSON results (ex: to compare commits)')
+    args = parser.parse_args()
+
+    results = [measure(module, args.repeat) for module in ENTRY_POINTS]
+
+    if args.json:
+        print(json.dumps(results))
+        return
+
+    print(f"{'entry point':<22}{'median ms':>10}{'min ms':>9}{'max ms':>9}{'meraki':>8}{'handlers':>10}{'threads':>9}")
+    for result in results:
+        if 'error' in result:
+            print(f"{result['module']:<22} import failed: {result['error']}")
+            continue
+        print(f"{result['module']:<22}{result['median_ms']:>10}{result['min_ms']:>9}{result['max_ms']:>9}"
+              f"{'yes' if result['meraki_loaded'] else 'no':>8}{result['log_handlers']:>10}{result['threads']:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+app_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask_app')
+
+# Server side statistics endpoint (answered by the metrics middleware, never reaches the app)
+STATS_PATH = '/__load_test/stats'
+
+# Header naming the operation of a request (server side statistics are grouped by it)
+OPERATION_HEADER = 'X-Load-Test-Operation'
+
+# Template files written to the seeded mx_configs folder
+BASELINES = ('baseline_a.json', 'baseline_b.json')
+EXCEPTIONS = ('exception_a.json', 'exception_b.json', 'exception_c.json')
+
+# Operation -> weight, per route mix (operations are defined in operation_request())
+MIXES = {
+    # Operators looking at assignments (overview page and paginated/searched network tables)
+    'browse': {'index': 30, 'networks_page': 50, 'networks_search': 20},
+    # Operators editing exception assignments
+    'assign': {'assign_exception_page': 20, 'networks_page': 40, 'networks_search': 10, 'assign_exception_save': 30},
+    # Operators deploying templates
+    'deploy': {'deploy_page': 30, 'networks_page': 40, 'deploy': 30},
+    # Everything at once
+    'mixed': {'index': 15, 'networks_page': 30, 'networks_search': 10, 'assign_exception_page': 10,
+              'assign_exception_save': 10, 'deploy_page': 10, 'deploy': 5, 'run_stats': 10},
+}
+
+
+# Inventory
+def org_id(i):
+    return f'O{i}'
+
+
+def net_id(i, j):
+    return f'O{i}N{j}'
+
+
+def inventory(orgs, networks):
+    """
+    Deterministic org and network inventory (the same in the server and the operator processes)
+    :param orgs: Number of organizations
+    :param networks: Total number of networks (spread across organizations)
+    :return: Dictionary of org id -> (org name, list of network ids)
+    """
+    per_org = [networks // orgs + (1 if i < networks % orgs else 0) for i in range(orgs)]
+    return {org_id(i): (f'org-{i:03d}', [net_id(i, j) for j in range(count)]) for i, count in enumerate(per_org)}
+
+
+class StubDashboard:
+    """
+    Local Meraki Dashboard stand-in: serves the seeded inventory and accepts L3, L7 and content filtering reads and
+    updates, each call taking a fixed latency (no network access, no API key)
+    """
+
+    def __init__(self, orgs, networks, latency):
+        self.inventory = inventory(orgs, networks)
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.calls = 0
+
+        self.organizations = self
+        self.networks = self
+        self.appliance = self
+
+    def call(self, result):
+        with self.lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        return result
+
+    def getOrganizations(self):
+        return self.call([{'id': oid, 'name': name} for oid, (name, _) in self.inventory.items()])
+
+    def getOrganizationNetworks(self, organization_id, **kwargs):
+        name, net_ids = self.inventory[organization_id]
+        return self.call([{'id': nid, 'name': f'{name}-{nid}', 'organizationId': organization_id,
+                           'productTypes': ['appliance']} for nid in net_ids])
+
+    def getNetwork(self, network_id):
+        oid = network_id.split('N')[0]
+        return self.call({'id': network_id, 'name': f'{self.inventory[oid][0]}-{network_id}', 'organizationId': oid})
+
+    def getNetworkApplianceFirewallL3FirewallRules(self, network_id):
+        return self.call({'rules': [{'comment': 'Default rule', 'policy': 'allow', 'protocol': 'Any'}]})
+
+    def getNetworkApplianceFirewallL7FirewallRules(self, network_id):
+        return self.call({'rules': []})
+
+    def getNetworkApplianceContentFiltering(self, network_id):
+        return self.call({'allowedUrlPatterns': [], 'blockedUrlPatterns': [], 'blockedUrlCategories': []})
+
+    def getNetworkApplianceFirewallInboundFirewallRules(self, network_id):
+        return self.call({'rules': []})
+
+    def updateNetworkApplianceFirewallL3FirewallRules(self, network_id, **payload):
+        return self.call(payload)
+
+    def updateNetworkApplianceFirewallL7FirewallRules(self, network_id, **payload):
+        return self.call(payload)
+
+    def updateNetworkApplianceContentFiltering(self, network_id, **payload):
+        return self.call(payload)
+
+    def updateNetworkApplianceFirewallInboundFirewallRules(self, network_id, **payload):
+        return self.call(payload)
+
+
+def write_templates(folder):
+    """
+    Write small valid baseline and exception templates
+    :param folder: Destination (mx_configs) folder
+    """
+    for i, name in enumerate(BASELINES + EXCEPTIONS):
+        template = {
+            'mx_l3_outbound_firewall': {'rules': [
+                {'comment': f'{name} rule {j}', 'policy': 'deny', 'protocol': 'tcp', 'srcPort': 'Any',
+                 'srcCidr': 'Any', 'destPort': str(1000 + j), 'destCidr': f'10.{i}.{j}.0/24', 'syslogEnabled': False}
+                for j in range(20)]},
+            'mx_l7_firewall': {'rules': [{'policy': 'deny', 'type': 'host', 'value': f'{i}-{j}.example.com'}
+                                         for j in range(10)]},
+            'mx_content_rules': {'allowedUrlPatterns': [], 'blockedUrlPatterns': [f'{i}-{j}.example.com'
+                                                                                  for j in range(50)],
+                                 'blockedUrlCategories': []}
+        }
+        with open(os.path.join(folder, name), 'w') as fp:
+            json.dump(template, fp)
+
+
+def seed_database(db_file, orgs, networks, exception_share):
+    """
+    Create the DB with the inventory and template assignments: every organization but the last has a baseline, and a
+    share of the networks have an exception
+    :param db_file: SQLite file
+    :param orgs: Number of organizations
+    :param networks: Total number of networks
+    :param exception_share: Share of networks with an exception template (0 - 1)
+    """
+    import db
+
+    rng = random.Random(0)
+    conn = db.create_connection(db_file)
+    db.create_tables(conn)
+
+    organizations = []
+    network_rows = []
+    with db.transaction(conn):
+        for i, (oid, (name, net_ids)) in enumerate(inventory(orgs, networks).items()):
+            organizations.append((oid, name))
+            network_rows += [(nid, f'{name}-{nid}', oid) for nid in net_ids]
+
+            db.add_templates(conn, 'base', [oid], BASELINES[i % len(BASELINES)] if i < orgs - 1 else None)
+            for nid in net_ids:
+                exception = rng.choice(EXCEPTIONS) if rng.random() < exception_share else None
+                db.add_templates(conn, 'exception', [nid], exception)
+
+        db.replace_inventory(conn, organizations, network_rows)
+
+    db.close_connection(conn)
+
+
+class WorkerPoolServer:
+    """
+    Threaded WSGI server with a fixed number of workers (like a gthread/sync worker pool): accepted connections wait
+    in a queue until a worker is free, so saturation shows up as queueing instead of unbounded threads
+    """
+
+    def __init__(self, port, wsgi_app, workers):
+        from werkzeug.serving import BaseWSGIServer
+
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+        queued_at = threading.local()
+
+        class Server(BaseWSGIServer):
+            def process_request(self, request, client_address):
+                pool.submit(self.process_request_thread, request, client_address, time.perf_counter())
+
+            def process_request_thread(self, request, client_address, accepted):
+                queued_at.value = accepted
+                try:
+                    self.finish_request(request, client_address)
+                except Exception:
+                    self.handle_error(request, client_address)
+                finally:
+                    self.shutdown_request(request)
+
+        self.queued_at = queued_at
+        self.server = Server('127.0.0.1', port, wsgi_app)
+        self.port = self.server.server_address[1]
+
+
+class RouteMetrics:
+    """
+    WSGI middleware recording, per operation: service time, time spent queued for a worker, and worker time used
+    (worker saturation). Also samples the number of busy workers.
+    """
+
+    def __init__(self, wsgi_app, workers):
+        self.wsgi_app = wsgi_app
+        self.workers = workers
+        self.server = None
+        self.lock = threading.Lock()
+        self.busy = 0
+        self.reset()
+
+        threading.Thread(target=self.sample, daemon=True).start()
+
+    def reset(self):
+        with self.lock:
+            self.started = time.perf_counter()
+            self.operations = {}
+            self.samples = []
+
+    def sample(self):
+        while True:
+            time.sleep(0.05)
+            with self.lock:
+                self.samples.append(self.busy)
+
+    def stats(self):
+        """
+        Server side statistics since the last reset
+        """
+        with self.lock:
+            elapsed = time.perf_counter() - self.started
+            samples = self.samples or [0]
+            operations = {}
+            for operation, (service, waits) in self.operations.items():
+                service.sort()
+                waits.sort()
+                operations[operation] = {
+                    'service_p50_ms': ms(percentile(service, 50)), 'service_p95_ms': ms(percentile(service, 95)),
+                    'queue_wait_p95_ms': ms(percentile(waits, 95)),
+                    # Share of the whole worker pool's time spent on this operation
+                    'worker_share': round(sum(service) / (self.workers * elapsed), 3)}
+
+            return {'elapsed': elapsed, 'workers': self.workers, 'operations': operations,
+                    'mean_busy_workers': round(sum(samples) / len(samples), 1), 'peak_busy_workers': max(samples),
+                    'saturated_share': round(sum(1 for busy in samples if busy >= self.workers) / len(samples), 3)}
+
+    def __call__(self, environ, start_response):
+        if environ['PATH_INFO'] == STATS_PATH:
+            if environ['REQUEST_METHOD'] == 'POST':
+                self.reset()
+            body = json.dumps(self.stats()).encode()
+            start_response('200 OK', [('Content-Type', 'application/json'), ('Content-Length', str(len(body)))])
+            return [body]
+
+        operation = environ.get('HTTP_' + OPERATION_HEADER.upper().replace('-', '_')) or \
+            f"{environ['REQUEST_METHOD']} {environ['PATH_INFO']}"
+        wait = time.perf_counter() - getattr(self.server.queued_at, 'value', time.perf_counter())
+
+        with self.lock:
+            self.busy += 1
+        start = time.perf_counter()
+        try:
+            # Consume the body here, so rendering is part of the service time
+            return list(self.wsgi_app(environ, start_response))
+        finally:
+            service = time.perf_counter() - start
+            with self.lock:
+                self.busy -= 1
+                times = self.operations.setdefault(operation, ([], []))
+                times[0].append(service)
+                times[1].append(wait)
+
+
+def serve(args):
+    """
+    Boot the app against the Dashboard stub and a seeded DB in a temporary folder, then serve until killed (prints
+    the port once ready)
+    :param args: Command line arguments
+    """
+    sys.path.insert(0, app_folder)
+
+    import app as web_app
+    import dashboard_client
+    import mx_config
+
+    folder = tempfile.mkdtemp(prefix='load_test_')
+    configs_folder = os.path.join(folder, 'mx_configs')
+    os.makedirs(configs_folder)
+    write_templates(configs_folder)
+
+    db_file = os.path.join(folder, 'sqlite.db')
+    seed_database(db_file, args.orgs, args.networks, args.exception_share)
+
+    # Point the app at the seeded DB, templates and a private cache
+    for module in list(sys.modules.values()):
+        if getattr(module, 'folder_path', None) == mx_config.folder_path and module is not mx_config:
+            module.folder_path = configs_folder
+    mx_config.folder_path = configs_folder
+    web_app.configs_path = configs_folder
+    web_app.app.config['DATABASE'] = db_file
+    web_app.job_runner.db_file = db_file
+    web_app.webhook_deduplicator.db_file = db_file
+    web_app.drift_scanner.db_file = db_file
+    web_app.drift_scanner.interval = 0
+    web_app.cache.config['CACHE_DIR'] = os.path.join(folder, 'cache')
+
+    # The page footer calls an external geolocation service, not part of the app's latency
+    web_app.getSystemTimeAndLocation = lambda: 'System Information: load test'
+
+    dashboard_client.set_dashboard(StubDashboard(args.orgs, args.networks, args.api_latency))
+
+    web_app.setup_app()
+    logger = logging.getLogger('my_logger')
+    for handler in logger.handlers:
+        handler.setLevel(logging.WARNING)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+
+    # Build the cached inventory before operators arrive
+    with web_app.app.app_context():
+        web_app.refresh_inventory()
+
+    metrics = RouteMetrics(web_app.app.wsgi_app, args.server_workers)
+    web_app.app.wsgi_app = metrics
+    server = WorkerPoolServer(args.port, web_app.app, args.server_workers)
+    metrics.server = server
+
+    print(f'READY {server.port}', flush=True)
+    server.server.serve_forever()
+
+
+def operation_request(operation, rng, universe, deploy_networks):
+    """
+    Build the HTTP request of an operation, as the pages' JavaScript sends it
+    :param operation: Operation name (see MIXES)
+    :param rng: Random generator of the operator
+    :param universe: Inventory (see inventory())
+    :param deploy_networks: Networks selected by a deploy
+    :return: Tuple of (method, path, params, form data)
+    """
+    oid = rng.choice(list(universe))
+    org_name, net_ids = universe[oid]
+
+    if operation == 'index':
+        return 'GET', '/', None, None
+    if operation in ('networks_page', 'networks_search'):
+        params = {'draw': 1, 'start': rng.randrange(0, max(len(net_ids) - 10, 1), 10), 'length': 10,
+                  'org': org_name, 'order[0][column]': 1, 'order[0][dir]': rng.choice(('asc', 'desc')),
+                  'columns[1][data]': 'net_name'}
+        if operation == 'networks_search':
+            params.update({'org': '', 'start': 0, 'search[value]': f'N{rng.randrange(1000)}'})
+        return 'GET', '/api/networks', params, None
+    if operation == 'assign_exception_page':
+        return 'GET', '/assign_exception', None, None
+    if operation == 'assign_exception_save':
+        selections = [{'netId': nid, 'exceptionTemplateValue': rng.choice(EXCEPTIONS + ('None',))}
+                      for nid in rng.sample(net_ids, min(5, len(net_ids)))]
+        return 'POST', '/assign_exception', None, {'data': json.dumps(selections)}
+    if operation == 'deploy_page':
+        return 'GET', '/deploy_templates', None, None
+    if operation == 'deploy':
+        selection = rng.sample(net_ids, min(deploy_networks, len(net_ids)))
+        return 'POST', '/deploy_templates', None, {'data': json.dumps({'networkIds': selection})}
+    if operation == 'run_stats':
+        return 'GET', '/api/run_stats', {'hours': 1, 'bucket': 60}, None
+
+    raise ValueError(f'Unknown operation {operation}')
+
+
+def operator(index, base_url, mix, universe, args, deadline, results):
+    """
+    One operator: sends a request of the mix, waits for the response, thinks, repeats until the deadline
+    :param index: Operator number (random seed)
+    :param base_url: App URL
+    :param mix: Dictionary of operation -> weight
+    :param universe: Inventory (see inventory())
+    :param args: Command line arguments (deploy selection size, think time)
+    :param deadline: perf_counter() value to stop at
+    :param results: List of (operation, latency, ok) tuples, shared by every operator
+    """
+    rng = random.Random(index)
+    operations, weights = list(mix), list(mix.values())
+    session = requests.Session()
+
+    while time.perf_counter() < deadline:
+        operation = rng.choices(operations, weights)[0]
+        method, path, params, data = operation_request(operation, rng, universe, args.deploy_networks)
+
+        start = time.perf_counter()
+        try:
+            # One connection per request, so an idle keep-alive connection never holds a worker
+            response = session.request(method, base_url + path, params=params, data=data, timeout=300,
+                                       headers={OPERATION_HEADER: operation, 'Connection': 'close'})
+            ok = response.status_code < 400
+        except requests.RequestException:
+            ok = False
+        results.append((operation, time.perf_counter() - start, ok))
+
+        if args.think_time:
+            time.sleep(rng.expovariate(1 / args.think_time))
+
+
+def percentile(values, pct):
+    """
+    Nearest rank percentile of a sorted list
+    """
+    if not values:
+        return None
+    return values[max(int(-(-pct * len(values) // 100)), 1) - 1]
+
+
+def ms(seconds):
+    return round(seconds * 1000, 1) if seconds is not None else None
+
+
+def git_revision():
+    """
+    Current commit (with a marker if the tree has local changes), so result files can be compared across commits
+    """
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=app_folder, capture_output=True,
+                                  text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=app_folder,
+                               capture_output=True, text=True).stdout.strip()
+        return revision + ('-dirty' if dirty else '')
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args, mix):
+    """
+    Start the server process, warm it up, run the operators and collect client and server side statistics
+    :param args: Command line arguments
+    :param mix: Dictionary of operation -> weight
+    :return: Dictionary of results
+    """
+    command = [sys.executable, os.path.abspath(__file__), '--serve', '--port', str(args.port),
+               '--orgs', str(args.orgs), '--networks', str(args.networks), '--server-workers',
+               str(args.server_workers), '--api-latency', str(args.api_latency), '--exception-share',
+               str(args.exception_share)]
+    server = subprocess.Popen(command, cwd=app_folder, stdout=subprocess.PIPE, text=True)
+
+    try:
+        line = server.stdout.readline()
+        if not line.startswith('READY'):
+            raise RuntimeError('Load test server failed to start')
+        base_url = f'http://127.0.0.1:{line.split()[1]}'
+
+        universe = inventory(args.orgs, args.networks)
+
+        def operate(deadline, results):
+            with ThreadPoolExecutor(max_workers=args.operators) as executor:
+                for i in range(args.operators):
+                    executor.submit(operator, i, base_url, mix, universe, args, deadline, results)
+
+        # Warm up (first renders, template loads, SQLite page cache), then measure from a clean slate
+        operate(time.perf_counter() + args.warmup, [])
+        requests.post(base_url + STATS_PATH)
+
+        results = []
+        start = time.perf_counter()
+        operate(start + args.duration, results)
+        elapsed = time.perf_counter() - start
+        server_stats = requests.get(base_url + STATS_PATH).json()
+    finally:
+        server.terminate()
+        server.wait()
+
+    routes = {}
+    for operation in mix:
+        latencies = sorted(latency for name, latency, _ in results if name == operation)
+        errors = sum(1 for name, _, ok in results if name == operation and not ok)
+        routes[operation] = dict({
+            'requests': len(latencies), 'errors': errors, 'throughput_rps': round(len(latencies) / elapsed, 2),
+            'p50_ms': ms(percentile(latencies, 50)), 'p95_ms': ms(percentile(latencies, 95)),
+            'p99_ms': ms(percentile(latencies, 99))}, **server_stats['operations'].get(operation, {}))
+
+    return {
+        'revision': git_revision(), 'mix': args.mix,
+        'parameters': {'orgs': args.orgs, 'networks': args.networks, 'operators': args.operators,
+                       'server_workers': args.server_workers, 'api_latency': args.api_latency,
+                       'duration': args.duration, 'think_time': args.think_time,
+                       'deploy_networks': args.deploy_networks, 'exception_share': args.exception_share},
+        'total': {'requests': len(results), 'errors': sum(1 for _, _, ok in results if not ok),
+                  'throughput_rps': round(len(results) / elapsed, 2),
+                  'mean_busy_workers': server_stats['mean_busy_workers'],
+                  'peak_busy_workers': server_stats['peak_busy_workers'],
+                  'saturated_share': server_stats['saturated_share']},
+        'routes': routes}
+
+
+def print_report(result, baseline=None):
+    """
+    Print per route statistics (and the change against a previous result file)
+    :param result: Dictionary of results (see run())
+    :param baseline: Previous results of the same mix, or None
+    """
+    print(f"Revision {result['revision']}, mix '{result['mix']}': {result['parameters']}")
+    print(f"{'operation':<24}{'reqs':>7}{'err':>5}{'rps':>8}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+          f"{'svc p95':>9}{'queue p95':>11}{'workers':>9}" + (f"{'p95 vs base':>13}" if baseline else ''))
+
+    for operation, route in result['routes'].items():
+        line = (f"{operation:<24}{route['requests']:>7}{route['errors']:>5}{route['throughput_rps']:>8}"
+                f"{str(route['p50_ms']):>9}{str(route['p95_ms']):>9}{str(route['p99_ms']):>9}"
+                f"{str(route.get('service_p95_ms')):>9}{str(route.get('queue_wait_p95_ms')):>11}"
+                f"{route.get('worker_share', 0):>9.1%}")
+        if baseline:
+            before = baseline['routes'].get(operation, {}).get('p95_ms')
+            change = f"{(route['p95_ms'] - before) / before:+.0%}" if before and route['p95_ms'] else 'n/a'
+            line += f"{change:>13}"
+        print(line)
+
+    total = result['total']
+    print(f"Total: {total['requests']} requests, {total['errors']} errors, {total['throughput_rps']} req/s, "
+          f"{total['mean_busy_workers']} busy workers on average (peak {total['peak_busy_workers']}), "
+          f"all workers busy {total['saturated_share']:.0%} of the time")
+    if baseline:
+        print(f"Baseline {baseline['revision']}: {baseline['total']['throughput_rps']} req/s")
+
+
+def main():
+    """
+    Load test the web app with concurrent operators against a Dashboard stub and a seeded DB
+    """
+    parser = argparse.ArgumentParser(description='Web app load test')
+    parser.add_argument('--mix', default='mixed',
+                        help=f"Route mix: {', '.join(MIXES)}, or operation=weight pairs separated by commas "
+                             f"(operations: {', '.join(sorted({op for mix in MIXES.values() for op in mix}))})")
+    parser.add_argument('--operators', type=int, default=50, help='Concurrent operators')
+    parser.add_argument('--duration', type=float, default=30, help='Measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='Warm up seconds (not measured)')
+    parser.add_argument('--think-time', type=float, default=0.5, help='Mean operator pause between requests (seconds)')
+    parser.add_argument('--orgs', type=int, default=20, help='Organizations in the seeded inventory')
+    parser.add_argument('--networks', type=int, default=10000, help='Networks in the seeded inventory')
+    parser.add_argument('--exception-share', type=float, default=0.1, help='Share of networks with an exception')
+    parser.add_argument('--deploy-networks', type=int, default=10, help='Networks selected by each deploy')
+    parser.add_argument('--server-workers', type=int, default=16, help='Web server worker threads')
+    parser.add_argument('--api-latency', type=float, default=0.1, help='Dashboard stub latency per call (seconds)')
+    parser.add_argument('--port', type=int, default=0, help='Server port (default: any free port)')
+    parser.add_argument('--output', help='Write the results to a JSON file')
+    parser.add_argument('--compare', help='Previous JSON results file to compare with')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    if args.mix in MIXES:
+        mix = MIXES[args.mix]
+    else:
+        mix = {operation: float(weight) for operation, weight in
+               (pair.split('=') for pair in args.mix.split(','))}
+
+    result = run(args, mix)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as fp:
+            baseline = json.load(fp)
+        if baseline.get('parameters') != result['parameters'] or baseline.get('mix') != result['mix']:
+            print('Warning: the baseline was run with different parameters or mix', file=sys.stderr)
+
+    print_report(result, baseline)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(result, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
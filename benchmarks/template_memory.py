@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import json
+import logging
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+# Run against the app modules (with a stub Dashboard, no API key needed and no API call is made)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask_app'))
+
+import dashboard_client  # noqa: E402
+import mx_config  # noqa: E402
+
+
+def write_templates(folder, url_patterns, rules):
+    """
+    Write a synthetic baseline and exception template pair (large URL pattern lists and rule sets)
+    :param folder: Destination folder
+    :param url_patterns: Number of blocked URL patterns in each template
+    :param rules: Number of L3 and L7 rules in each template
+    """
+    def template(prefix):
+        return {
+            'mx_l3_outbound_firewall': {'rules': [
+                {'comment': f'{prefix} rule {i}', 'policy': 'deny', 'protocol': 'tcp', 'srcPort': 'Any',
+                 'srcCidr': 'Any', 'destPort': str(1000 + i), 'destCidr': f'10.{i // 256 % 256}.{i % 256}.0/24',
+                 'syslogEnabled': False} for i in range(rules)]},
+            'mx_l7_firewall': {'rules': [{'policy': 'deny', 'type': 'host', 'value': f'{prefix}-{i}.example.com'}
+                                         for i in range(rules)]},
+            'mx_content_rules': {
+                'allowedUrlPatterns': [f'allowed-{i}.example.com' for i in range(url_patterns // 10)],
+                'blockedUrlPatterns': [f'{prefix}-blocked-{i}.example.com/path/{i}' for i in range(url_patterns)],
+                'blockedUrlCategories': [{'id': f'meraki:contentFiltering/category/C{i}', 'name': f'Category {i}'}
+                                         for i in range(50)]}
+        }
+
+    for name, prefix in (('baseline.json', 'base'), ('exception.json', 'exc')):
+        with open(os.path.join(folder, name), 'w') as fp:
+            json.dump(template(prefix), fp)
+
+
+def use_legacy_loading():
+    """
+    Load and combine templates the way upload() used to: a private copy per network, no sharing
+    """
+    mx_config.load_template = mx_config.load_config_from_file
+    mx_config.load_combined_template = lambda baseline, exception: mx_config.combine_configs(
+        mx_config.load_config_from_file(baseline), mx_config.load_config_from_file(exception))
+
+
+def run(mode, networks, workers):
+    """
+    Upload the template pair to a fleet of stub networks concurrently, keeping every MX config object alive (as a
+    periodic run does until its org is finished)
+    :param mode: 'shared' (frozen shared templates) or 'legacy' (private copies)
+    :param networks: Number of networks
+    :param workers: Number of upload threads
+    :return: Dictionary of results
+    """
+    if mode == 'legacy':
+        use_legacy_loading()
+
+    # Stub Dashboard (uploads return immediately)
+    noop = lambda *args, **kwargs: None  # noqa: E731
+    dashboard_client.set_dashboard(SimpleNamespace(appliance=SimpleNamespace(
+        updateNetworkApplianceFirewallL3FirewallRules=noop, updateNetworkApplianceFirewallL7FirewallRules=noop,
+        updateNetworkApplianceContentFiltering=noop)))
+
+    logger = logging.getLogger('benchmark')
+    logger.disabled = True
+
+    configs = [mx_config.MerakiMXConfig('O1', f'N{i}', logger, net_name=f'net-{i}') for i in range(networks)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(lambda current_config: current_config.upload('baseline.json', 'exception.json'), configs))
+
+    elapsed = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'mode': mode, 'networks': networks, 'workers': workers, 'seconds': round(elapsed, 2),
+            'retained_mb': round(current / 2 ** 20, 1), 'peak_mb': round(peak / 2 ** 20, 1),
+            'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)}
+
+
+def main():
+    """
+    Compare peak memory of legacy and shared template loading (each mode runs in its own process)
+    """
+    parser = argparse.ArgumentParser(description='Template memory benchmark')
+    parser.add_argument('--networks', type=int, default=500, help='Number of networks uploaded')
+    parser.add_argument('--workers', type=int, default=50, help='Number of upload threads')
+    parser.add_argument('--url-patterns', type=int, default=5000, help='Blocked URL patterns per template')
+    parser.add_argument('--rules', type=int, default=500, help='L3/L7 rules per template')
+    parser.add_argument('--mode', choices=['legacy', 'shared'], help='Run a single mode (prints JSON)')
+    parser.add_argument('--folder', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.mode:
+        mx_config.folder_path = args.folder
+        print(json.dumps(run(args.mode, args.networks, args.workers)))
+        return
+
+    with tempfile.TemporaryDirectory() as folder:
+        write_templates(folder, args.url_patterns, args.rules)
+
+        print(f"{'mode':<8}{'networks':>10}{'workers':>9}{'seconds':>9}{'peak MB':>10}{'retained MB':>13}"
+              f"{'max RSS MB':>12}")
+        for mode in ('legacy', 'shared'):
+            output = subprocess.run([sys.executable, __file__, '--mode', mode, '--folder', folder,
+                                     '--networks', str(args.networks), '--workers', str(args.workers)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{result['mode']:<8}{result['networks']:>10}{result['workers']:>9}{result['seconds']:>9}"
+                  f"{result['peak_mb']:>10}{result['retained_mb']:>13}{result['max_rss_mb']:>12}")
+
+
+if __name__ == "__main__":
+    main()
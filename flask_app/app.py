@@ -19,20 +19,30 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 
 # Import Section
 import datetime
+import hashlib
 import json
 import logging
 import os
 import threading
+import time
 from logging.handlers import TimedRotatingFileHandler
 
-import meraki
 import requests
 from dotenv import load_dotenv
 from flask import Flask, render_template, request, jsonify, url_for, redirect, g
 from flask_caching import Cache
 
+import circuit_breaker
 import config
+import dashboard_cache
 import db
+import drift_scan
+import job_queue
+import run_ledger
+import setting_handlers
+import template_validation
+import webhook
+from dashboard_client import get_dashboard
 from mx_config import MerakiMXConfig
 
 # Absolute Paths
@@ -40,60 +50,120 @@ script_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(script_dir, 'db/sqlite.db')
 configs_path = os.path.join(script_dir, 'mx_configs')
 logs_path = os.path.join(script_dir, 'logs')
+cache_path = os.path.join(script_dir, 'cache')
 
 # Global variables
 app = Flask(__name__)
 app.config['DATABASE'] = db_path
 
-# Configuring Flask-Caching
-cache = Cache(app, config={'CACHE_TYPE': 'simple'})
+# Configuring Flask-Caching (file backed, so every web worker process shares the same cached inventory and configs),
+# attached to the app by setup_app()
+cache = Cache(config={'CACHE_TYPE': 'FileSystemCache', 'CACHE_DIR': cache_path,
+                      'CACHE_THRESHOLD': getattr(config, 'cache_threshold', 5000)})
 
-# Load in Environment Variables
-load_dotenv()
-MERAKI_API_KEY = os.getenv('MERAKI_API_KEY')
-
-# Meraki Dashboard Instance
-dashboard = meraki.DashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True)
+# Webhook shared secret (loaded from .env by setup_app())
+MERAKI_WEBHOOK_SECRET = None
 
 # Global progress variable
 progress = 0
 upload_errors = {}
 
-# Set up logging
+# Logger (handlers are added by setup_app())
 logger = logging.getLogger('my_logger')
-logger.setLevel(logging.INFO)
 
-formatter = logging.Formatter('%(asctime)s %(levelname)s: %(funcName)s:%(lineno)d - %(message)s')
+# One-time process setup, see setup_app()
+setup_done = False
+setup_lock = threading.Lock()
+
+# Inventory (drop down content) cache: served stale after the soft TTL while refreshed in the background, rebuilt
+# synchronously after the hard TTL
+INVENTORY_CACHE_KEY = 'inventory'
+INVENTORY_REFRESH_LOCK_KEY = 'inventory_refresh_lock'
+INVENTORY_SOFT_TTL = getattr(config, 'inventory_soft_ttl_seconds', 300)
+INVENTORY_HARD_TTL = getattr(config, 'inventory_hard_ttl_seconds', 60 * 60)
+INVENTORY_REFRESH_LOCK_TIMEOUT = 10 * 60
+inventory_refresh_lock = threading.Lock()
+
+# Cached MX config objects (download page) are refreshed by uploads, so they can live longer
+MX_CONFIG_CACHE_TTL = getattr(config, 'mx_config_cache_seconds', 15 * 60)
+
+# Cached /api/networks pages, invalidated by assignment and inventory changes
+ASSIGNMENT_VIEWS_VERSION_KEY = 'assignment_views_version'
+ASSIGNMENT_VIEW_CACHE_TTL = getattr(config, 'assignment_view_cache_seconds', 15 * 60)
 
-# log to stdout
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(formatter)
+# Largest page of network rows returned by /api/networks
+MAX_PAGE_LENGTH = 500
 
-# log to files (last 7 days, rotated at midnight local time each day)
-log_file = os.path.join(logs_path, 'portal_logs.log')
-file_handler = TimedRotatingFileHandler(log_file, when="midnight", interval=1, backupCount=7)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
+# Configuration change webhooks (duplicate alert filter, single network enforcement through the job queue)
+webhook_deduplicator = webhook.AlertDeduplicator(db_path, getattr(config, 'webhook_dedup_seconds', 3600))
 
-logger.addHandler(file_handler)
-logger.addHandler(stream_handler)
+# Network upload queue shared with periodic/scheduled enforcement and webhooks (this process drains it while holding
+# its lease)
+job_runner = job_queue.JobQueue(db_path, on_upload=lambda current_config: upload_done(current_config))
 
-org_to_id = {}
-network_to_id = {}
+webhook_enforcer = webhook.WebhookEnforcer(job_runner, logger,
+                                           getattr(config, 'webhook_enforcement_cooldown_seconds', 120))
+
+# Background drift scan (results stored in the DB, read by the compliance page)
+drift_scanner = drift_scan.DriftScanner(db_path)
 
 
 # Methods
-@cache.memoize(timeout=300)  # Cache the result for 5 minutes
-def dropdown():
+def setup_logging():
     """
-    Return Drop Down Content (wrapped in method to support new networks and organizations) - cached
+    Log to stdout and to files in the logs folder
+    """
+    logger.setLevel(logging.INFO)
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(funcName)s:%(lineno)d - %(message)s')
+
+    # log to stdout
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(formatter)
+
+    # log to files (last 7 days, rotated at midnight local time each day)
+    log_file = os.path.join(logs_path, 'portal_logs.log')
+    file_handler = TimedRotatingFileHandler(log_file, when="midnight", interval=1, backupCount=7)
+    file_handler.setLevel(logging.INFO)
+    file_handler.setFormatter(formatter)
+
+    logger.addHandler(file_handler)
+    logger.addHandler(stream_handler)
+
+
+def setup_app():
+    """
+    One-time process setup: environment variables, logging and the shared cache (done on first request or at startup,
+    not on import, so the module imports quickly and without side effects)
+    """
+    global setup_done, MERAKI_WEBHOOK_SECRET
+
+    if setup_done:
+        return
+
+    with setup_lock:
+        if setup_done:
+            return
+
+        load_dotenv()
+        MERAKI_WEBHOOK_SECRET = os.getenv('MERAKI_WEBHOOK_SECRET')
+
+        setup_logging()
+        cache.init_app(app)
+
+        setup_done = True
+
+
+def build_dropdown():
+    """
+    Build Drop Down Content by walking every org and network (slow, see dropdown() for the cached version)
     :return: A list of orgs and the corresponding networks
     """
     dropdown_content = []
 
     # Build drop down menus for organization and network selection, mapping or orgs/networks to id
-    organizations = dashboard.organizations.getOrganizations()
+    organizations = get_dashboard().organizations.getOrganizations()
     sorted_organizations = sorted(organizations, key=lambda x: x['name'])
 
     # Connection to DB (one-time)
@@ -106,59 +176,52 @@ def dropdown():
     exception_templates = db.query_all_exception_templates(conn)
     exception_templates = {item[0]: item[1] for item in exception_templates}
 
-    # Track all the current orgs and networks (used to remove stale data in DB)
+    # Track all the current orgs and networks (used to add new rows and remove stale data in DB)
     current_org_ids = []
     current_network_ids = []
+
+    # Inventory rows persisted to the DB (queried by the paginated network tables)
+    inventory_orgs = []
+    inventory_networks = []
     for organization in sorted_organizations:
-        # Add Org to Base Templates DB Table (if not present already)
-        db.add_template(conn, 'base', organization['id'], None)
         org_data = {'orgaid': organization['id'], 'organame': organization['name']}
         current_org_ids.append(organization['id'])
+        inventory_orgs.append((organization['id'], organization['name']))
 
         try:
-            networks = dashboard.organizations.getOrganizationNetworks(organization['id'], total_pages='all')
+            networks = get_dashboard().organizations.getOrganizationNetworks(organization['id'], total_pages='all')
 
             network_data = []
             network_ids = []
             for network in networks:
                 # Filter for networks with appliance (MX) only
                 if 'appliance' in network['productTypes']:
-                    # Add Network to Exception Template DB Table (if not present already)
-                    db.add_template(conn, 'exception', network['id'], None)
-
                     network_data.append({'networkid': network['id'], 'networkname': network['name']})
                     network_ids.append(network['id'])
                     current_network_ids.append(network['id'])
-
-                    # Add new entries to data structures
-                    network_to_id[network['name']] = network['id']
+                    inventory_networks.append((network['id'], network['name'], organization['id']))
 
             # Associate networks with their org
             org_data['networks'] = network_data
 
             # Add new entries to data structures
             dropdown_content.append(org_data)
-            org_to_id[organization['name']] = {'id': organization['id'], 'network_ids': network_ids}
 
         except Exception as e:
             logger.error(f"Error retrieving networks for organization ID {organization['id']}: {e}")
 
-    # Clean up any orgs or networks still in db but not in the current list
-    for org_id in base_templates:
-        if org_id not in current_org_ids:
-            db.delete_template(conn, 'base', org_id)
+    # Apply every DB change in a single transaction
+    with db.transaction(conn):
+        # Add orgs/networks to the Base/Exception Template DB Tables (if not present already)
+        db.add_templates(conn, 'base', current_org_ids)
+        db.add_templates(conn, 'exception', current_network_ids)
 
-            # Remove from other dicts as well
-            if org_id in org_to_id:
-                del org_to_id[org_id]
+        # Clean up any orgs or networks still in db but not in the current list
+        db.delete_templates(conn, 'base', set(base_templates) - set(current_org_ids))
+        db.delete_templates(conn, 'exception', set(exception_templates) - set(current_network_ids))
 
-    for net_id in exception_templates:
-        if net_id not in current_network_ids:
-            db.delete_template(conn, 'exception', net_id)
-
-            # Remove from other dicts as well
-            if net_id in network_to_id:
-                del network_to_id[net_id]
+        # Persist the current inventory
+        db.replace_inventory(conn, inventory_orgs, inventory_networks)
 
     # Close DB connection (one-time)
     db.close_connection(conn)
@@ -166,6 +229,92 @@ def dropdown():
     return dropdown_content
 
 
+def refresh_inventory():
+    """
+    Rebuild the drop down content and the org/network ID maps, store them in the shared cache
+    :return: Cached inventory entry
+    """
+    dropdown_content = build_dropdown()
+
+    # Org name -> {id, network ids} and network name -> id mappings
+    org_to_id = {}
+    network_to_id = {}
+    for org in dropdown_content:
+        org_to_id[org['organame']] = {'id': org['orgaid'],
+                                      'network_ids': [network['networkid'] for network in org['networks']]}
+
+        for network in org['networks']:
+            network_to_id[network['networkname']] = network['networkid']
+
+    entry = {'dropdown_content': dropdown_content, 'org_to_id': org_to_id, 'network_to_id': network_to_id,
+             'fetched_at': time.time()}
+
+    # Never expires in the cache, staleness is handled by inventory() (soft/hard TTL)
+    cache.set(INVENTORY_CACHE_KEY, entry, timeout=0)
+
+    # Networks (and their template rows) may have been added or removed
+    invalidate_assignment_views()
+
+    return entry
+
+
+def background_refresh_inventory():
+    """
+    Refresh the inventory in the background (stale copy keeps being served meanwhile)
+    """
+    try:
+        with app.app_context():
+            refresh_inventory()
+            cache.delete(INVENTORY_REFRESH_LOCK_KEY)
+        logger.info("Background inventory refresh complete")
+    except Exception as e:
+        logger.error(f"Background inventory refresh failed: {e}")
+    finally:
+        inventory_refresh_lock.release()
+
+
+def inventory():
+    """
+    Return the cached inventory (stale-while-revalidate): the last good copy is returned immediately, a single
+    background refresh is started once the soft TTL has passed, and only a missing or hard-expired copy is rebuilt
+    synchronously
+    :return: Cached inventory entry
+    """
+    entry = cache.get(INVENTORY_CACHE_KEY)
+
+    age = time.time() - entry['fetched_at'] if entry else None
+    if entry is None or age >= INVENTORY_HARD_TTL:
+        return refresh_inventory()
+
+    if age >= INVENTORY_SOFT_TTL:
+        # One refresh per process (thread lock), and per cache (lock key shared by every worker process)
+        if inventory_refresh_lock.acquire(blocking=False):
+            if cache.add(INVENTORY_REFRESH_LOCK_KEY, True, timeout=INVENTORY_REFRESH_LOCK_TIMEOUT):
+                threading.Thread(target=background_refresh_inventory, daemon=True).start()
+            else:
+                inventory_refresh_lock.release()
+
+    return entry
+
+
+def dropdown():
+    """
+    Return Drop Down Content (wrapped in method to support new networks and organizations) - cached
+    :return: A list of orgs and the corresponding networks
+    """
+    return inventory()['dropdown_content']
+
+
+def id_maps():
+    """
+    Return org name -> {id, network ids} and network name -> id mappings (cached with the drop down content, so every
+    worker process sees the same mappings)
+    :return: Tuple of (org_to_id, network_to_id) dictionaries
+    """
+    entry = inventory()
+    return entry['org_to_id'], entry['network_to_id']
+
+
 def getSystemTimeAndLocation():
     """
     Return location and time of accessing device (used on all webpage footers)
@@ -190,50 +339,33 @@ def getSystemTimeAndLocation():
 
 def get_conn():
     """
-    Open a new database connection if there is none yet for the current application context.
+    Return the database connection for the current application context (each worker thread reuses its own
+    connection across requests, see db.get_connection())
     """
     if 'conn' not in g:
-        g.conn = db.create_connection(app.config['DATABASE'])
+        g.conn = db.get_connection(app.config['DATABASE'])
     return g.conn
 
 
 @app.teardown_appcontext
 def close_conn(error):
     """
-    Closes the database again at the end of the request (using teardown of app context)
+    Release the database connection at the end of the request (using teardown of app context), discarding anything
+    left uncommitted so the next request on this thread starts clean
     """
     conn = g.pop('conn', None)
-    if conn is not None:
-        db.close_connection(conn)
+    if conn is not None and conn.in_transaction:
+        conn.rollback()
 
 
-def thread_wrapper(current_config, progress_inc, baseline_filename, exception_filename):
+def mx_config_cache_key(net_id):
     """
-    Wrapper method to trigger baseline and exception template uploads to each network, each in their own thread for
-    multiprocessing
-    :param current_config: MX Config Object used for uploading and processing combined template config to each network
-    :param progress_inc: Increment value for global progress value (used for progress bar displayed on webpage)
-    :param baseline_filename: File name for baseline template
-    :param exception_filename: File name for exception template
+    Return the shared cache key of a network's MX config object
+    :param net_id: Network ID
     """
-    global progress, upload_errors
-
-    # Trigger settings upload to network
-    current_config.upload(baseline_filename, exception_filename)
+    return f"mx_config/{net_id}"
 
-    # Update Progress for display bar
-    progress += progress_inc
 
-    # Retrieve upload errors (if any), append to global errors for webpage display
-    current_run_errors = current_config.get_upload_errors()
-    for error in current_run_errors:
-        if error['network'] in upload_errors:
-            upload_errors[error['network']].append(error['error'])
-        else:
-            upload_errors[error['network']] = [error['error']]
-
-
-@cache.memoize(timeout=60)  # Cache the result for 1 minute
 def get_mx_config_information(selected_organization, selected_network):
     """
     Get the current MX Security configs for the selected Network (wrapped in a separate method to support caching results)
@@ -241,15 +373,81 @@ def get_mx_config_information(selected_organization, selected_network):
     :param selected_network: Network ID selected from drop down
     :return: MX Config Object with current security configs
     """
+    # Cached copies are kept up to date by uploads (see write_through_mx_config())
+    current_config = cache.get(mx_config_cache_key(selected_network))
+    if current_config is not None:
+        return current_config
+
     # Define class object representing current MX Security Settings
     current_config = MerakiMXConfig(selected_organization, selected_network, logger)
 
-    # Retrieve all current security configs
-    current_config.get_existing_security_config()
+    # Retrieve all current security configs (live, a downloaded template must not be built from a cached response)
+    current_config.get_existing_security_config(fresh=True)
+
+    # Only cache complete configs (a setting which couldn't be read is fetched again on the next request)
+    if not current_config.fetch_errors:
+        cache.set(mx_config_cache_key(selected_network), current_config, timeout=MX_CONFIG_CACHE_TTL)
 
     return current_config
 
 
+def write_through_mx_config(current_config):
+    """
+    Refresh a network's cached MX config after an upload, using the settings just written (no re-fetch). If any
+    setting failed to upload, the network's state is unknown and the cached copy is dropped instead.
+    :param current_config: MX Config Object used for the upload
+    """
+    key = mx_config_cache_key(current_config.net_id)
+
+    if current_config.get_upload_errors():
+        cache.delete(key)
+        return
+
+    cached_config = cache.get(key)
+    if cached_config is not None:
+        cached_config.apply_settings(current_config.uploaded_settings)
+        cache.set(key, cached_config, timeout=MX_CONFIG_CACHE_TTL)
+
+
+def upload_done(current_config):
+    """
+    Refresh the cached config of a network uploaded by the job queue workers (runs outside of any request)
+    :param current_config: MX Config Object used for the upload
+    """
+    with app.app_context():
+        write_through_mx_config(current_config)
+
+
+def invalidate_assignment_views():
+    """
+    Invalidate every cached view derived from template assignments or the inventory (called after DB assignment
+    writes, cached entries keyed by an older version are never read again and expire)
+    """
+    cache.set(ASSIGNMENT_VIEWS_VERSION_KEY, time.time_ns(), timeout=0)
+
+
+def assignment_view_cache_key(args):
+    """
+    Return the shared cache key of an /api/networks response (request parameters + current assignments version)
+    :param args: Request query parameters
+    """
+    params = sorted((k, v) for k, v in args.items(multi=True) if k not in ('draw', '_'))
+    digest = hashlib.sha1(json.dumps(params).encode('utf-8')).hexdigest()
+
+    return f"assignment_view/{cache.get(ASSIGNMENT_VIEWS_VERSION_KEY) or 0}/{digest}"
+
+
+@app.before_request
+def start_background_jobs():
+    """
+    Set up the process and start the background drift scan and job queue loops with the first request (no-op
+    afterwards)
+    """
+    setup_app()
+    drift_scanner.start()
+    job_runner.start()
+
+
 # Routes
 @app.route('/progress')
 def get_progress():
@@ -262,45 +460,81 @@ def get_progress():
     return jsonify({'progress': progress})
 
 
+@app.route('/refresh_inventory', methods=['GET'])
+def refresh_inventory_now():
+    """
+    Rebuild the cached org/network inventory now, then return to the previous page
+    """
+    logger.info(f"Refresh Inventory {request.method} Request:")
+
+    # Explicit refresh, don't reuse cached Dashboard responses
+    dashboard_cache.read_cache.clear('getOrganizations', 'getOrganizationNetworks')
+    refresh_inventory()
+
+    return redirect(request.referrer or url_for('index'))
+
+
 @app.route('/', methods=['GET'])
 def index():
     """
-    Landing page, display a table showing base templates and exception templates applied at each network
+    Landing page, display a table showing base templates and exception templates applied at each network (table rows
+    are loaded page by page from /api/networks)
     """
     logger.info(f"Main Index {request.method} Request:")
 
-    dropdown_content = dropdown()
-
-    # Get DB connection
-    conn = get_conn()
+    # Triggers adding any new network or org to the inventory
+    dropdown()
 
     # Get a list of organization names
+    org_to_id, _ = id_maps()
     org_names = org_to_id.keys()
 
-    # Get the table of base templates and exception templates
-    base_templates = db.query_all_base_templates(conn)
-    base_templates = {item[0]: item[1] for item in base_templates}
+    return render_template('index.html', hiddenLinks=False, org_names=org_names,
+                           timeAndLocation=getSystemTimeAndLocation())
 
-    exception_templates = db.query_all_exception_templates(conn)
-    exception_templates = {item[0]: item[1] for item in exception_templates}
 
-    # Build a display list for each orgs networks (show network name, base template, exception template)
-    network_displays = []
-    for org in dropdown_content:
-        org_networks = []
-        for network in org['networks']:
-            network_display = {'id': network['networkid'], 'org_name': org['organame'],
-                               'net_name': network['networkname'],
-                               'base_template': base_templates[org['orgaid']],
-                               'exception_template': exception_templates[network['networkid']]}
-            org_networks.append(network_display)
+@app.route('/api/networks', methods=['GET'])
+def networks_api():
+    """
+    Network template assignments (DataTables server-side processing protocol: paging, sorting and search are done in
+    SQL, so the cost of a request depends on the page size instead of the number of networks)
+    """
+    # Triggers adding any new network or org to the inventory
+    dropdown()
 
-        network_displays.append(org_networks)
+    # DataTables request parameters
+    draw = request.args.get('draw', 0, type=int)
 
-    logger.info(f"Current State of Template Assignments: {network_displays}")
+    # Same page requested since the last assignment/inventory change
+    cache_key = assignment_view_cache_key(request.args)
+    response = cache.get(cache_key)
+    if response is not None:
+        return jsonify(dict(response, draw=draw))
 
-    return render_template('index.html', hiddenLinks=False, org_names=org_names, networks=network_displays,
-                           timeAndLocation=getSystemTimeAndLocation())
+    # Get DB connection
+    conn = get_conn()
+
+    start = max(request.args.get('start', 0, type=int), 0)
+    length = request.args.get('length', 10, type=int)
+    if length < 0 or length > MAX_PAGE_LENGTH:
+        length = MAX_PAGE_LENGTH
+
+    order_index = request.args.get('order[0][column]', 0, type=int)
+    order_by = request.args.get(f'columns[{order_index}][data]', 'org_name')
+    descending = request.args.get('order[0][dir]', 'asc') == 'desc'
+
+    records_total, records_filtered, rows = db.query_network_assignments(
+        conn, org_name=request.args.get('org') or None, search=request.args.get('search[value]') or None,
+        order_by=order_by, descending=descending, start=start, length=length)
+
+    data = [{'id': row.net_id, 'org_name': row.org_name, 'net_name': row.net_name,
+             'base_template': row.base_template or "None", 'exception_template': row.exception_template or "None"}
+            for row in rows]
+
+    response = {'recordsTotal': records_total, 'recordsFiltered': records_filtered, 'data': data}
+    cache.set(cache_key, response, timeout=ASSIGNMENT_VIEW_CACHE_TTL)
+
+    return jsonify(dict(response, draw=draw))
 
 
 @app.route('/download_baseline', methods=['GET', 'POST'])
@@ -330,6 +564,8 @@ def download_baseline():
 
     # Handle the form submission, trigger a download of the current security configs
     current_config = None
+    error = False
+    errormessage = None
     if request.method == 'POST':
         logger.info(f"POST data received from client: {request.form.to_dict()}")
 
@@ -343,14 +579,23 @@ def download_baseline():
         # If this is the download form, download current config to a .json file (located in mx_configs folder)
         if form_type == 'download_form':
             logger.info("Download form request received:")
-            current_config.download()
 
-            return redirect(url_for('download_baseline', success=True))
+            # A setting couldn't be read, don't write a template missing it
+            if current_config.fetch_errors:
+                error = True
+                errormessage = "Unable to read the network's current config, template not downloaded: " + \
+                               ", ".join(f"{setting}: {e}" for setting, e in current_config.fetch_errors.items())
+                logger.error(errormessage)
+            else:
+                current_config.download()
+
+                return redirect(url_for('download_baseline', success=True))
 
     # Render page
     return render_template('download_baseline.html', hiddenLinks=False, dropdown_content=dropdown_content,
                            selected_elements=selected_elements, current_config=current_config, success=success,
-                           timeAndLocation=getSystemTimeAndLocation(), tracked_settings=config.tracked_settings)
+                           error=error, errormessage=errormessage, timeAndLocation=getSystemTimeAndLocation(),
+                           tracked_settings=config.tracked_settings)
 
 
 @app.route('/assign_baseline', methods=['GET', 'POST'])
@@ -360,8 +605,9 @@ def assign_baseline():
     """
     logger.info(f'Assign Baseline Template {request.method} Request:')
 
-    # Unused, but triggers adding any new network or org to the dictionary
+    # Unused, but triggers adding any new network or org to the inventory
     dropdown_content = dropdown()
+    org_to_id, _ = id_maps()
 
     # Get DB connection
     conn = get_conn()
@@ -379,7 +625,7 @@ def assign_baseline():
     # Build a display list for each org (show org name, existing base template)
     org_display = []
     for org in org_to_id:
-        org_display.append({'org_name': org, "existing_base_template": base_templates[org_to_id[org]['id']]})
+        org_display.append({'org_name': org, "existing_base_template": base_templates.get(org_to_id[org]['id'])})
 
     # Get a list of available baseline files for dropdown table fields
     config_files = [f for f in os.listdir(configs_path) if
@@ -398,31 +644,16 @@ def assign_baseline():
 
         logger.info(f"Baseline Template Table Before: {base_templates}")
 
-        # Add or update db table with baseline templates
-        for baseline in baselines:
-            if baseline['templateValue'] == 'existing':
-                # Skip entries with no changes to their assigned template
-                pass
-            elif baseline['templateValue'] == 'None':
-                # If baseline value is 'none', remove baseline template
-                db.remove_template(conn, 'base', org_to_id[baseline['orgName']]['id'])
-            else:
-                # Check if baseline template is assigned as exception template (if it is, remove it as exception
-                # template)
-                exceptions = db.query_all_exception_templates(conn)
-                exceptions_filtered = [item for item in exceptions if baseline['templateValue'] in item]
-
-                if len(exceptions_filtered) > 0:
-                    org_networks = org_to_id[baseline['orgName']]['network_ids']
+        # Org id -> new baseline (None removes it), entries without changes are skipped
+        assignments = {org_to_id[baseline['orgName']]['id']: None if baseline['templateValue'] == 'None'
+                       else baseline['templateValue']
+                       for baseline in baselines if baseline['templateValue'] != 'existing'}
 
-                    for exception in exceptions_filtered:
-                        # If a network with the exception template is a part of the org we want to assign the same
-                        # base template too, remove the exception template
-                        if exception[0] in org_networks:
-                            db.remove_template(conn, 'exception', exception[0])
-
-                # Update template with new template
-                db.update_template(conn, 'base', org_to_id[baseline['orgName']]['id'], baseline['templateValue'])
+        # Assign every baseline and remove conflicting exception templates (single transaction, see
+        # db.assign_baselines())
+        removed_exceptions = db.assign_baselines(conn, assignments)
+        if removed_exceptions:
+            logger.info(f"Removed {removed_exceptions} exception template(s) matching their new baseline template")
 
         # Get the table of base templates
         base_templates = db.query_all_base_templates(conn)
@@ -430,6 +661,9 @@ def assign_baseline():
 
         logger.info(f"Baseline Template Table After: {base_templates}")
 
+        # Assignments changed, drop cached views
+        invalidate_assignment_views()
+
         # Support AJAX redirect to display success message and update display tables on screen
         return jsonify({'redirect_url': url_for('assign_baseline', success=True)})
 
@@ -444,7 +678,8 @@ def assign_exception():
     """
     logger.info(f'Assign Exception {request.method} Request:')
 
-    dropdown_content = dropdown()
+    # Triggers adding any new network or org to the inventory
+    dropdown()
 
     # Get DB connection
     conn = get_conn()
@@ -456,69 +691,47 @@ def assign_exception():
         success = False
 
     # Get a list of organization names
+    org_to_id, _ = id_maps()
     org_names = org_to_id.keys()
 
-    # Get the table of base templates
-    base_templates = db.query_all_base_templates(conn)
-    base_templates = {item[0]: item[1] for item in base_templates}
-
-    # Get the table of exception templates
-    exception_templates = db.query_all_exception_templates(conn)
-    exception_templates = {item[0]: item[1] for item in exception_templates}
-
     # Get a list of available files for exceptions for drop down table fields
     config_files = [f for f in os.listdir(configs_path) if
                     os.path.isfile(os.path.join(configs_path, f)) and f != ".gitignore"]
 
-    # Build a display list for each orgs networks (show network name, base template, exception template)
-    network_displays = []
-    for org in dropdown_content:
-        org_networks = []
-        for network in org['networks']:
-            network_display = {'id': network['networkid'], 'org_name': org['organame'],
-                               'net_name': network['networkname'],
-                               'base_template': base_templates[org['orgaid']],
-                               "existing_exception_template": exception_templates[network['networkid']]}
-            org_networks.append(network_display)
-
-        network_displays.append(org_networks)
-
     # Handle the form submission, upload templates to the networks!
     if request.method == 'POST':
         logger.info(f"POST data received from client: {request.form.to_dict()}")
         logger.info(f"Current templates available in mx_configs folder: {config_files}")
 
-        # Retrieve data from the request, baseline and exception template selections from webpage
+        # Retrieve data from the request, exception template selections (changed rows only) from webpage
         data = request.form.get('data')
 
         # Convert JSON string to Python list of dictionaries
         template_selections = json.loads(data)
 
-        logger.info(f"Exception Template Table Before: {exception_templates}")
-
-        # Iterate through table selections for baseline and exception templates
-        for template_selection in template_selections:
-            if template_selection['exceptionTemplateValue'] == 'existing':
-                # Skip entries with no changes to their assigned template
-                pass
-            elif template_selection['exceptionTemplateValue'] == 'None':
-                # If baseline value is 'none', remove exception template
-                db.remove_template(conn, 'exception', network_to_id[template_selection['netName']])
-            else:
-                # Update exception template with new template (if it isn't equal to baseline)
-                db.update_template(conn, 'exception', network_to_id[template_selection['netName']],
-                                   template_selection['exceptionTemplateValue'])
-
-        # Get the table of exception templates
-        exception_templates = db.query_all_exception_templates(conn)
-        exception_templates = {item[0]: item[1] for item in exception_templates}
-
-        logger.info(f"Exception Template Table After: {exception_templates}")
+        # Iterate through table selections for exception templates (single transaction)
+        with db.transaction(conn):
+            for template_selection in template_selections:
+                if template_selection['exceptionTemplateValue'] == 'existing':
+                    # Skip entries with no changes to their assigned template
+                    pass
+                elif template_selection['exceptionTemplateValue'] == 'None':
+                    # If baseline value is 'none', remove exception template
+                    db.remove_template(conn, 'exception', template_selection['netId'])
+                else:
+                    # Update exception template with new template (if it isn't equal to baseline)
+                    db.update_template(conn, 'exception', template_selection['netId'],
+                                       template_selection['exceptionTemplateValue'])
+
+        logger.info(f"Exception Template Changes: {template_selections}")
+
+        # Assignments changed, drop cached views
+        invalidate_assignment_views()
 
         # Support AJAX redirect to display success message and update display tables on screen
         return jsonify({'redirect_url': url_for('assign_exception', success=True)})
 
-    return render_template('assign_exception.html', hiddenLinks=False, org_names=org_names, networks=network_displays,
+    return render_template('assign_exception.html', hiddenLinks=False, org_names=org_names,
                            config_files=config_files, success=success,
                            timeAndLocation=getSystemTimeAndLocation())
 
@@ -531,7 +744,8 @@ def deploy_templates():
     global progress, upload_errors
     logger.info(f'Deploy Templates {request.method} Request:')
 
-    dropdown_content = dropdown()
+    # Triggers adding any new network or org to the inventory
+    dropdown()
 
     # Get DB connection
     conn = get_conn()
@@ -545,28 +759,10 @@ def deploy_templates():
 
         success = False
 
-    # Get the table of base templates
-    base_templates = db.query_all_base_templates(conn)
-    base_templates = {item[0]: item[1] for item in base_templates}
-
-    # Get the table of exception templates
-    exception_templates = db.query_all_exception_templates(conn)
-    exception_templates = {item[0]: item[1] for item in exception_templates}
-
     # Get a list of available files for exceptions for drop down table fields
     config_files = [f for f in os.listdir(configs_path) if
                     os.path.isfile(os.path.join(configs_path, f)) and f != ".gitignore"]
 
-    # Build a display list for each orgs networks (show network name, base template, exception template)
-    network_displays = []
-    for org in dropdown_content:
-        for network in org['networks']:
-            network_display = {'id': network['networkid'], 'org_name': org['organame'],
-                               'net_name': network['networkname'],
-                               'base_template': base_templates[org['orgaid']],
-                               "existing_exception_template": exception_templates[network['networkid']]}
-            network_displays.append(network_display)
-
     # Handle the form submission, upload templates to the networks!
     if request.method == 'POST':
         progress = 0
@@ -577,21 +773,46 @@ def deploy_templates():
         logger.info(f"POST data received from client: {request.form.to_dict()}")
         logger.info(f"Current templates available in mx_configs folder: {config_files}")
 
-        # Retrieve data from the request, baseline and exception template selections from webpage
-        data = request.form.get('data')
+        # Retrieve data from the request: either the selected network ids, or 'select all' (every network matching
+        # the table search, minus any rows unchecked afterwards)
+        data = json.loads(request.form.get('data'))
 
-        # Convert JSON string to Python list of dictionaries
-        template_selections = json.loads(data)
+        if data.get('selectAll'):
+            template_selections = db.query_assignments(conn, search=data.get('search') or None,
+                                                       exclude_net_ids=data.get('excludedIds'))
+        elif data.get('networkIds'):
+            template_selections = db.query_assignments(conn, net_ids=data['networkIds'])
+        else:
+            template_selections = []
 
         # Calculate progress increment
-        progress_inc = 100 / float(len(template_selections))
-
-        threads = []
-        # Iterate through table selections for baseline and exception templates
-        for template_selection in template_selections:
-            # Grab baseline file name
-            baseline_filename = template_selection['baseTemplateValue']
-            exception_filename = template_selection['exceptionTemplateValue']
+        progress_inc = 100 / float(max(len(template_selections), 1))
+
+        # Validate the assigned templates once, before any network is scheduled (reported once per file)
+        invalid_files = template_validation.validate_files(
+            name for row in template_selections for name in (row.base_template, row.exception_template)
+            if name in config_files)
+        for name, errors in invalid_files.items():
+            upload_errors[name] = [f"Template {name} is invalid, skipping sync(s): {error}" for error in errors]
+
+        # Keys may be split between the baseline and the exception template, each combination must be complete
+        missing_files = {name for row in template_selections for name in (row.base_template, row.exception_template)
+                         if name and name not in config_files}
+        invalid_pairs = template_validation.validate_pairs(
+            ((row.base_template, row.exception_template) for row in template_selections),
+            skip_files=set(invalid_files) | missing_files)
+        for (baseline, exception), errors in invalid_pairs.items():
+            upload_errors[f"{baseline} + {exception}"] = [
+                f"Templates {baseline} + {exception} are invalid once combined, skipping sync(s): {error}"
+                for error in errors]
+
+        networks = []
+        org_names = {}
+        # Iterate through selected networks and their assigned baseline and exception templates
+        for net_id, org_id, org_name, net_name, baseline_filename, exception_filename in template_selections:
+            # Grab baseline and exception file names
+            baseline_filename = baseline_filename or "None"
+            exception_filename = exception_filename or "None"
 
             # Sanity check assigned files are present and haven't been removed from mx_configs
             if baseline_filename != 'None' and baseline_filename not in config_files:
@@ -599,7 +820,7 @@ def deploy_templates():
                     f"Assigned base template {baseline_filename} not found... skipping sync(s). Please assign a valid file.")
 
                 # Add missing file error to upload errors for display
-                upload_errors[template_selection['orgName']] = [
+                upload_errors[org_name] = [
                     f"Assigned base template {baseline_filename} not found... skipping sync(s). Please assign a valid file."]
                 continue
 
@@ -608,36 +829,50 @@ def deploy_templates():
                     f"Assigned exception template {exception_filename} not found... skipping sync(s). Please assign a valid file.")
 
                 # Add missing file error to upload errors for display
-                upload_errors[template_selection['netName']] = [
+                upload_errors[net_name] = [
                     f"Assigned exception template {exception_filename} not found... skipping sync(s). Please assign a valid file."]
                 continue
 
-            # Sanity Check (None, None) -> there's no work to do
-            if baseline_filename == "None" and exception_filename == "None":
+            # Sanity Check (None, None) or an invalid template -> there's no work to do
+            if (baseline_filename == "None" and exception_filename == "None") or \
+                    baseline_filename in invalid_files or exception_filename in invalid_files or \
+                    (baseline_filename, exception_filename) in invalid_pairs:
                 # Update Progress for display bar
                 progress += progress_inc
                 continue
             else:
-                # Upload config to network, spawn a thread that calls the upload method for each network
-                current_config = MerakiMXConfig(org_to_id[template_selection['orgName']]['id'],
-                                                network_to_id[template_selection['netName']], logger)
+                networks.append((org_id, net_id, net_name))
+                org_names[org_id] = org_name
+
+        # Queue the networks ahead of background enforcement (a network already queued isn't uploaded twice), then
+        # wait for the workers draining the queue (in this process or another one, ex: the periodic runner)
+        batch = job_runner.batch('web')
+        batch.add(networks, job_queue.PRIORITY_MANUAL)
+
+        skipped = {}
+
+        def job_finished(job):
+            global progress
+
+            # Update Progress for display bar
+            progress += progress_inc
 
-                # If name is still none, there was a failure
-                if current_config.net_name is None:
-                    continue
+            # Uploads run by another process (ex: the periodic runner) don't refresh the cached config, drop it instead
+            if not job_runner.ran_here(job):
+                cache.delete(mx_config_cache_key(job.net_id))
 
-                # Spawn a background thread
-                thread = threading.Thread(target=thread_wrapper,
-                                          args=(current_config, progress_inc, baseline_filename, exception_filename,))
-                threads.append(thread)
+            # Retrieve upload errors (if any) for webpage display
+            if job.errors:
+                upload_errors.setdefault(job.net_name, []).extend(job.errors)
+            if job.skipped:
+                skipped.setdefault(job.org_id, []).append(job.net_name)
 
-        # Start all threads
-        for t in threads:
-            t.start()
+        batch.wait(job_finished)
 
-        # Wait for all threads to finish
-        for t in threads:
-            t.join()
+        # Networks skipped because an org's circuit breaker opened are reported once per org
+        for org_id, net_names in skipped.items():
+            upload_errors[org_names.get(org_id, org_id)] = [
+                f"{len(net_names)} network(s) skipped. {circuit_breaker.breakers.summary(org_id) or 'Circuit open'}"]
 
         # If there's any remaining progress (clean division not possible, set to 100 for display)
         progress = 100
@@ -645,10 +880,98 @@ def deploy_templates():
         # Support AJAX redirect to display success message and update display tables on screen
         return jsonify({'redirect_url': url_for('deploy_templates', success=True)})
 
-    return render_template('deploy_templates.html', hiddenLinks=False, networks=network_displays,
-                           config_files=config_files, success=success, upload_errors=upload_errors,
-                           timeAndLocation=getSystemTimeAndLocation())
+    return render_template('deploy_templates.html', hiddenLinks=False, config_files=config_files, success=success,
+                           upload_errors=upload_errors, timeAndLocation=getSystemTimeAndLocation())
+
+
+@app.route('/api/run_stats')
+def run_stats():
+    """
+    Upload run history aggregated per organization over time: throughput and tail latency (JSON)
+    """
+    hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * run_ledger.RUN_HISTORY_DAYS)
+    bucket_seconds = max(request.args.get('bucket', 3600, type=int), 60)
+
+    statistics = run_ledger.run_statistics(get_conn(), hours, bucket_seconds)
+
+    # Current adaptive API call limit of this process (see setting_handlers.AdaptiveLimiter)
+    statistics['api_concurrency'] = setting_handlers.api_calls.stats()
+
+    # Shared network job queue depth, and whether this process drains it (see job_queue.py)
+    statistics['job_queue'] = job_runner.stats()
+
+    return jsonify(statistics)
+
+
+@app.route('/compliance', methods=['GET'])
+def compliance():
+    """
+    Compliance dashboard: drift of each network against its assigned templates, from the last background drift scan
+    (charts and table are loaded from /api/compliance, no Dashboard API call on page load)
+    """
+    logger.info(f"Compliance {request.method} Request:")
+
+    return render_template('compliance.html', hiddenLinks=False, scan_running=drift_scanner.running,
+                           scan_interval=drift_scanner.interval, timeAndLocation=getSystemTimeAndLocation())
+
+
+@app.route('/api/compliance', methods=['GET'])
+def compliance_api():
+    """
+    Stored drift results: totals, per organization and per setting counts, scan history and drifted networks (JSON)
+    """
+    days = min(max(request.args.get('days', 7, type=int), 1), drift_scan.DRIFT_HISTORY_DAYS)
+
+    return jsonify(dict(drift_scan.compliance_summary(get_conn(), days), scan_running=drift_scanner.running))
+
+
+@app.route('/compliance/scan', methods=['POST'])
+def compliance_scan():
+    """
+    Start a drift scan now (in the background)
+    """
+    logger.info(f"Compliance Scan {request.method} Request:")
+
+    if drift_scanner.trigger():
+        return jsonify({'status': 'started'}), 202
+
+    return jsonify({'status': 'running'}), 200
+
+
+@app.route('/webhook', methods=['POST'])
+def receive_webhook():
+    """
+    Receive Meraki Dashboard configuration change alerts, queue enforcement of the affected network only
+    """
+    payload = request.get_json(silent=True)
+    if not isinstance(payload, dict):
+        return jsonify({'error': 'Invalid payload'}), 400
+
+    # Verify shared secret (configured on the Dashboard webhook receiver and in .env)
+    if not webhook.verify_shared_secret(payload, MERAKI_WEBHOOK_SECRET):
+        logger.warning(f"Webhook rejected, invalid shared secret (alert: {payload.get('alertId')})")
+        return jsonify({'error': 'Invalid shared secret'}), 403
+
+    logger.info(f"Webhook received: {payload.get('alertType')} for network {payload.get('networkName')}")
+
+    # Ignore duplicate deliveries of the same alert
+    if webhook_deduplicator.is_duplicate(webhook.alert_key(payload)):
+        return jsonify({'status': 'duplicate'}), 200
+
+    # Only configuration change alerts for a network trigger enforcement
+    alert_types = getattr(config, 'webhook_alert_types', ['settings_changed'])
+    if payload.get('alertTypeId') not in alert_types or not payload.get('networkId'):
+        return jsonify({'status': 'ignored'}), 200
+
+    # The network's config changed on the Dashboard, cached reads of it are stale
+    dashboard_cache.read_cache.invalidate(payload['networkId'])
+
+    if webhook_enforcer.enqueue(payload.get('organizationId'), payload['networkId']):
+        return jsonify({'status': 'queued'}), 202
+
+    return jsonify({'status': 'skipped'}), 200
 
 
 if __name__ == "__main__":
+    setup_app()
     app.run(host='0.0.0.0', debug=False)
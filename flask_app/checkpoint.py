@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+
+import config
+import db
+from mx_config import folder_path
+
+logger = logging.getLogger('my_logger')
+
+# Checkpoints of interrupted runs older than this are discarded (the next run starts over)
+CHECKPOINT_MAX_AGE_HOURS = getattr(config, 'checkpoint_max_age_hours', 7 * 24)
+
+
+def template_hashes(file_names):
+    """
+    Hash the content of template files (a resumed run must use the same templates as the interrupted run)
+    :param file_names: Template filenames
+    :return: Dictionary of file name -> sha256 of the content
+    """
+    hashes = {}
+    for file_name in sorted(set(file_names)):
+        try:
+            with open(os.path.join(folder_path, file_name), 'rb') as fp:
+                hashes[file_name] = hashlib.sha256(fp.read()).hexdigest()
+        except OSError:
+            hashes[file_name] = None
+
+    return hashes
+
+
+def resume_key(file_names, base_templates, exception_templates):
+    """
+    Build the key a run is resumed with: the content hash of each template file and a hash of the template
+    assignments (a resumed run must use the same templates and assignments as the interrupted run)
+    :param file_names: Assigned template filenames
+    :param base_templates: Dictionary of org id -> baseline file name
+    :param exception_templates: Dictionary of network id -> exception file name
+    :return: Dictionary of 'templates' (see template_hashes()) and 'assignments' (sha256 of the assignments)
+    """
+    assignments = json.dumps([sorted(base_templates.items()), sorted(exception_templates.items())])
+
+    return {'templates': template_hashes(file_names),
+            'assignments': hashlib.sha256(assignments.encode('utf-8')).hexdigest()}
+
+
+class RunCheckpoint:
+    """
+    Progress of a long run stored in the DB (run id, resume key, start time, completed networks). If the process is
+    interrupted, the next run of the same scope with the same templates and assignments resumes with the pending
+    networks only. The checkpoint is deleted once the run finishes.
+    """
+
+    def __init__(self, db_file, scope, run_id, key):
+        self.db_file = db_file
+        self.scope = scope
+        self.completed = set()
+        self.resumed = False
+
+        conn = db.get_connection(db_file)
+
+        # Discard abandoned checkpoints
+        expired = datetime.now(timezone.utc) - timedelta(hours=CHECKPOINT_MAX_AGE_HOURS)
+        db.delete_checkpoints(conn, before=expired.strftime('%Y-%m-%dT%H:%M:%SZ'))
+
+        previous = db.query_checkpoint(conn, scope)
+        if previous is not None and json.loads(previous[1]) == key:
+            # Resume the interrupted run (started_at: the interrupted run's start, changes made since then to the
+            # networks it completed are only picked up if the watermark isn't advanced past it)
+            self.run_id, self.started_at = previous[0], previous[2]
+            self.resumed = True
+            self.completed = set(db.query_checkpoint_networks(conn, self.run_id))
+            logger.info(f"Resuming interrupted run {self.run_id} ({scope}, started {self.started_at}): "
+                        f"{len(self.completed)} network(s) already completed")
+        else:
+            if previous is not None:
+                logger.info(f"Templates or assignments changed since interrupted run {previous[0]} ({scope}), "
+                            f"starting over")
+
+            self.started_at = db.utc_timestamp()
+            self.run_id = db.add_checkpoint(conn, run_id, scope, json.dumps(key), self.started_at)
+
+    def is_completed(self, net_id):
+        """
+        Check if a network was already completed by this run (before an interruption)
+        :param net_id: Network ID
+        """
+        return net_id in self.completed
+
+    def complete(self, net_id):
+        """
+        Record a completed network (called from the upload workers, each uses its own DB connection)
+        :param net_id: Network ID
+        """
+        db.add_checkpoint_network(db.get_connection(self.db_file), self.run_id, net_id)
+
+    def finish(self):
+        """
+        Expire the checkpoint once the run is done
+        """
+        db.delete_checkpoints(db.get_connection(self.db_file), run_id=self.run_id)
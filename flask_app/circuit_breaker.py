@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import threading
+import time
+
+import config
+
+logger = logging.getLogger('my_logger')
+
+# Consecutive failures before a circuit opens, and how long it stays open before a half-open probe is allowed
+FAILURE_THRESHOLD = getattr(config, 'circuit_breaker_threshold', 5)
+RESET_TIMEOUT = getattr(config, 'circuit_breaker_reset_seconds', 300)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def is_breaking_error(error):
+    """
+    Check if an upload error points at the org or endpoint rather than the network (authentication, permissions,
+    rate limit exhaustion, server errors, connection failures). Invalid payloads for a single network, and any other
+    exception (ex: a bug in the payload handling), don't count.
+    :param error: Exception raised by the Meraki SDK
+    """
+    # Imported here (already loaded by the Dashboard client once a call has failed), so importing this module stays fast
+    import requests
+    from meraki.exceptions import APIError
+
+    if isinstance(error, APIError):
+        status = error.status or 0
+        return status in (401, 403, 429) or 500 <= status < 600
+
+    return isinstance(error, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker for one org (or one endpoint of an org): opens after FAILURE_THRESHOLD consecutive failures,
+    then allows a single probe call after RESET_TIMEOUT (half-open) which closes or re-opens it
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.last_error = None
+        self.skipped = 0
+
+    def state(self, now):
+        """
+        Return the breaker state (CLOSED, OPEN or HALF_OPEN)
+        :param now: Current monotonic time
+        """
+        if self.opened_at is None:
+            return CLOSED
+        if now - self.opened_at < RESET_TIMEOUT:
+            return OPEN
+
+        return HALF_OPEN
+
+    def permits(self, now):
+        """
+        Check if a call may be made (half-open allows one probe at a time, a lost probe is replaced after the timeout)
+        :param now: Current monotonic time
+        """
+        state = self.state(now)
+        if state == HALF_OPEN:
+            return self.probe_started is None or now - self.probe_started >= RESET_TIMEOUT
+
+        return state == CLOSED
+
+    def success(self):
+        """
+        Record a successful call (closes the breaker)
+        """
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self.skipped = 0
+
+    def failure(self, error, now):
+        """
+        Record a failed call
+        :param error: Exception raised by the call
+        :param now: Current monotonic time
+        :return: True if the breaker just opened
+        """
+        self.failures += 1
+        self.last_error = str(error)
+
+        # Failed probe, or threshold reached
+        if self.opened_at is not None or self.failures >= FAILURE_THRESHOLD:
+            newly_opened = self.opened_at is None
+            self.opened_at = now
+            self.probe_started = None
+            return newly_opened
+
+        return False
+
+    def summary(self):
+        """
+        Describe why the breaker is open
+        """
+        return f"{self.name}: {self.failures} consecutive failure(s), {self.skipped} call(s) skipped, last error: " \
+               f"{self.last_error}"
+
+
+class CircuitBreakers:
+    """
+    Circuit breakers for each org and each (org, endpoint) pair. A call is allowed only if both are closed (or
+    half-open with the probe available).
+    """
+
+    def __init__(self):
+        self.breakers = {}
+        self.lock = threading.Lock()
+
+    def breaker(self, org_id, endpoint=None):
+        """
+        Return the breaker of an org (endpoint None) or of one of its endpoints (caller must hold the lock)
+        :param org_id: Organization ID
+        :param endpoint: Endpoint name (ex: template section name)
+        """
+        key = (org_id, endpoint)
+        if key not in self.breakers:
+            self.breakers[key] = CircuitBreaker(f"Organization {org_id}" + (f" {endpoint}" if endpoint else ""))
+
+        return self.breakers[key]
+
+    def allow(self, org_id, endpoint):
+        """
+        Check if a call to an org's endpoint may be made, reserving the half-open probe if there is one
+        :param org_id: Organization ID
+        :param endpoint: Endpoint name
+        """
+        now = time.monotonic()
+
+        with self.lock:
+            breakers = (self.breaker(org_id), self.breaker(org_id, endpoint))
+
+            blocked = [breaker for breaker in breakers if not breaker.permits(now)]
+            if blocked:
+                for breaker in blocked:
+                    breaker.skipped += 1
+                return False
+
+            for breaker in breakers:
+                if breaker.state(now) == HALF_OPEN:
+                    breaker.probe_started = now
+
+            return True
+
+    def record_success(self, org_id, endpoint):
+        """
+        Record a successful call to an org's endpoint
+        :param org_id: Organization ID
+        :param endpoint: Endpoint name
+        """
+        with self.lock:
+            self.breaker(org_id).success()
+            self.breaker(org_id, endpoint).success()
+
+    def record_failure(self, org_id, endpoint, error):
+        """
+        Record a failed call to an org's endpoint (network specific errors count as a successful call)
+        :param org_id: Organization ID
+        :param endpoint: Endpoint name
+        :param error: Exception raised by the call
+        """
+        if not is_breaking_error(error):
+            self.record_success(org_id, endpoint)
+            return
+
+        now = time.monotonic()
+
+        with self.lock:
+            for breaker in (self.breaker(org_id), self.breaker(org_id, endpoint)):
+                if breaker.failure(error, now):
+                    logger.error(f"Circuit opened, skipping calls for {RESET_TIMEOUT}s: {breaker.summary()}")
+
+    def summary(self, org_id):
+        """
+        Summarize the open circuits of an org (one error for every network skipped)
+        :param org_id: Organization ID
+        :return: Summary string, or None if no circuit is open
+        """
+        with self.lock:
+            open_breakers = [breaker for (breaker_org_id, _), breaker in self.breakers.items()
+                             if breaker_org_id == org_id and breaker.opened_at is not None]
+
+        if not open_breakers:
+            return None
+
+        return "Circuit open, calls skipped: " + "; ".join(breaker.summary() for breaker in open_breakers)
+
+
+# Shared by every upload in this process
+breakers = CircuitBreakers()
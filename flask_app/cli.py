@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from requests.adapters import HTTPAdapter
+
+import dashboard_client
+import db
+import discovery
+import mx_config
+import run_ledger
+import template_validation
+from mx_config import MerakiMXConfig, folder_path
+
+logger = logging.getLogger('my_logger')
+
+# Serialize JSON lines written by concurrent workers
+output_lock = threading.Lock()
+
+
+class RateLimitedAdapter(HTTPAdapter):
+    """
+    HTTP adapter which spaces out requests to a maximum rate (shared by every worker thread)
+    """
+
+    def __init__(self, rate, **kwargs):
+        super().__init__(**kwargs)
+        self.interval = 1.0 / rate
+        self.next_slot = time.monotonic()
+        self.slot_lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self.slot_lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(self.next_slot, now) + self.interval
+
+        if wait > 0:
+            time.sleep(wait)
+
+        return super().send(request, **kwargs)
+
+
+def emit(record):
+    """
+    Write one JSON line to stdout
+    :param record: Dictionary
+    """
+    with output_lock:
+        sys.stdout.write(json.dumps(record) + "\n")
+        sys.stdout.flush()
+
+
+def refresh_inventory(conn):
+    """
+    Rebuild the org/network inventory in the DB from the Dashboard (the web app does this on page load)
+    :param conn: DB connection object
+    """
+    dashboard = dashboard_client.get_dashboard()
+    orgs = dashboard.organizations.getOrganizations()
+
+    networks = []
+    for item in discovery.stream_networks(dashboard, orgs):
+        if item.network is not None and 'appliance' in item.network['productTypes']:
+            networks.append((item.network['id'], item.network['name'], item.org['id']))
+
+    with db.transaction(conn):
+        db.add_templates(conn, 'base', [org['id'] for org in orgs])
+        db.add_templates(conn, 'exception', [network[0] for network in networks])
+        db.replace_inventory(conn, [(org['id'], org['name']) for org in orgs], networks)
+
+
+def select_networks(conn, args):
+    """
+    Return the inventory rows matching the org, network and template filters (filtered in SQL)
+    :param conn: DB connection object
+    :param args: Parsed command line arguments
+    :return: List of NetworkAssignment rows
+    """
+    return db.query_assignments(conn, orgs=args.org, networks=args.network, templates=args.template)
+
+
+def network_record(row, action, **fields):
+    """
+    Build the JSON line of a network result
+    :param row: Inventory row (see select_networks())
+    :param action: Subcommand
+    """
+    net_id, org_id, org_name, net_name, base_file, exception_file = row
+
+    return dict({'action': action, 'org_id': org_id, 'org_name': org_name, 'network_id': net_id,
+                 'network_name': net_name, 'baseline': base_file, 'exception': exception_file}, **fields)
+
+
+def fetch_error_messages(current_config):
+    """
+    Return the errors of the settings which couldn't be read from a network
+    :param current_config: MerakiMXConfig object
+    """
+    return [f"{setting}: {error}" for setting, error in current_config.fetch_errors.items()]
+
+
+def download_network(row):
+    """
+    Download a network's current security config to a template file in mx_configs
+    :param row: Inventory row (see select_networks())
+    """
+    net_id, org_id, _, net_name, _, _ = row
+
+    current_config = MerakiMXConfig(org_id, net_id, logger, net_name=net_name)
+    current_config.get_existing_security_config(fresh=True)
+
+    # A setting couldn't be read, don't write a template missing it
+    if current_config.fetch_errors:
+        return network_record(row, 'download', status='failed', errors=fetch_error_messages(current_config))
+
+    file_name = current_config.download()
+
+    return network_record(row, 'download', status='success', file=file_name)
+
+
+def plan_network(row, invalid_files, invalid_pairs):
+    """
+    Compare a network's current security config with its assigned templates (dry run, nothing is changed)
+    :param row: Inventory row (see select_networks())
+    :param invalid_files: Dictionary of invalid template file -> errors
+    :param invalid_pairs: Dictionary of (baseline, exception) file names -> errors of the combined config
+    """
+    net_id, org_id, _, net_name, base_file, exception_file = row
+    base_file, exception_file = base_file or "None", exception_file or "None"
+
+    if base_file == "None" and exception_file == "None":
+        return network_record(row, 'plan', status='unassigned')
+    for file_name in (base_file, exception_file):
+        if file_name in invalid_files:
+            return network_record(row, 'plan', status='invalid_template', errors=invalid_files[file_name])
+    pair_errors = invalid_pairs.get((base_file, exception_file))
+    if pair_errors:
+        return network_record(row, 'plan', status='invalid_template', errors=pair_errors)
+
+    new_config = mx_config.build_template(base_file, exception_file)
+    if isinstance(new_config, str):
+        return network_record(row, 'plan', status='invalid_template', errors=[new_config])
+
+    current_config = MerakiMXConfig(org_id, net_id, logger, net_name=net_name)
+    current_config.get_existing_security_config(fresh=True)
+
+    # A setting couldn't be read, its current config is unknown
+    if current_config.fetch_errors:
+        return network_record(row, 'plan', status='failed', errors=fetch_error_messages(current_config))
+
+    changes = current_config.diff(new_config)
+
+    in_sync = all(change['in_sync'] for change in changes.values())
+    return network_record(row, 'plan', status='in_sync' if in_sync else 'changes', changes=changes)
+
+
+def deploy_network(row, invalid_files, invalid_pairs, ledger):
+    """
+    Apply a network's assigned baseline and exception templates
+    :param row: Inventory row (see select_networks())
+    :param invalid_files: Dictionary of invalid template file -> errors
+    :param invalid_pairs: Dictionary of (baseline, exception) file names -> errors of the combined config
+    :param ledger: RunLedger recording the run
+    """
+    net_id, org_id, _, net_name, base_file, exception_file = row
+    base_file, exception_file = base_file or "None", exception_file or "None"
+
+    if base_file == "None" and exception_file == "None":
+        return network_record(row, 'deploy', status='unassigned')
+    for file_name in (base_file, exception_file):
+        if file_name in invalid_files:
+            return network_record(row, 'deploy', status='invalid_template', errors=invalid_files[file_name])
+    pair_errors = invalid_pairs.get((base_file, exception_file))
+    if pair_errors:
+        return network_record(row, 'deploy', status='invalid_template', errors=pair_errors)
+
+    current_config = MerakiMXConfig(org_id, net_id, logger, net_name=net_name, ledger=ledger)
+    current_config.upload(base_file, exception_file)
+    # Webhook alerts caused by this upload are ignored within the cooldown (see webhook.py)
+    db.record_network_upload(db.get_connection(db.db_path), net_id, db.utc_timestamp())
+
+    errors = [error['error'] for error in current_config.get_upload_errors()]
+    if errors:
+        status = 'failed'
+    elif current_config.skipped_settings:
+        status = 'skipped'
+    else:
+        status = 'success'
+
+    return network_record(row, 'deploy', status=status, settings=current_config.upload_status, errors=errors)
+
+
+def run_networks(rows, worker, workers):
+    """
+    Process networks concurrently, writing one JSON line per network as results arrive
+    :param rows: Inventory rows
+    :param worker: Callable taking an inventory row, returning the network's result record
+    :param workers: Number of networks processed at the same time
+    :return: Number of failed networks
+    """
+    failures = 0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(worker, row): row for row in rows}
+
+        for future in as_completed(futures):
+            try:
+                record = future.result()
+            except Exception as e:
+                record = network_record(futures[future], 'error', status='failed', errors=[str(e)])
+
+            if record['status'] in ('failed', 'skipped', 'invalid_template'):
+                failures += 1
+            emit(record)
+
+    return failures
+
+
+def main():
+    """
+    Headless entry point: bulk download, dry-run plan and deploy (python cli.py -h for options)
+    """
+    parser = argparse.ArgumentParser(description='Meraki MX security baseline templates (JSON lines output)')
+    parser.add_argument('command', choices=['download', 'plan', 'deploy'],
+                        help='download: save current configs as templates, plan: compare networks with their '
+                             'assigned templates (dry run), deploy: apply assigned templates')
+    parser.add_argument('--org', action='append', help='Organization ID or name (repeatable)')
+    parser.add_argument('--network', action='append', help='Network ID or name (repeatable)')
+    parser.add_argument('--template', action='append',
+                        help='Only networks with this baseline or exception template assigned (repeatable)')
+    parser.add_argument('--workers', type=int, default=10, help='Networks processed at the same time')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='Maximum API requests per second (the Dashboard allows 10 per org)')
+    parser.add_argument('--refresh-inventory', action='store_true',
+                        help='Rebuild the org/network inventory from the Dashboard first')
+    parser.add_argument('--verbose', action='store_true', help='Log progress to stderr')
+    args = parser.parse_args()
+
+    if args.rate_limit is not None and args.rate_limit <= 0:
+        parser.error('--rate-limit must be a positive number of requests per second')
+
+    if args.verbose:
+        logger.setLevel(logging.INFO)
+        logger.addHandler(logging.StreamHandler(sys.stderr))
+
+    # Spread API calls (shared by every worker), and size the connection pool to the number of workers
+    adapter_options = {'pool_connections': 1, 'pool_maxsize': max(args.workers, 10)}
+    adapter = RateLimitedAdapter(args.rate_limit, **adapter_options) if args.rate_limit else \
+        HTTPAdapter(**adapter_options)
+    dashboard_client.mount_adapter(adapter)
+
+    conn = db.get_connection(db.db_path)
+    db.create_tables(conn)
+
+    if args.refresh_inventory:
+        refresh_inventory(conn)
+
+    rows = select_networks(conn, args)
+    if not rows:
+        emit({'action': args.command, 'status': 'no_networks',
+              'error': 'No networks matched (use --refresh-inventory if the inventory is empty)'})
+        return 1
+
+    if args.command == 'download':
+        failures = run_networks(rows, download_network, args.workers)
+        return 1 if failures else 0
+
+    # Validate the assigned templates once, before any network is processed
+    config_files = set(os.listdir(folder_path))
+    invalid_files = template_validation.validate_files(
+        name for row in rows for name in row[4:6] if name in config_files)
+    for row in rows:
+        for name in row[4:6]:
+            if name and name not in config_files:
+                invalid_files[name] = [f"Assigned template {name} not found"]
+
+    invalid_pairs = template_validation.validate_pairs((row[4:6] for row in rows), skip_files=invalid_files)
+
+    if args.command == 'plan':
+        failures = run_networks(rows, lambda row: plan_network(row, invalid_files, invalid_pairs), args.workers)
+    else:
+        ledger = run_ledger.RunLedger(db.db_path, 'cli')
+        failures = run_networks(rows, lambda row: deploy_network(row, invalid_files, invalid_pairs, ledger),
+                                args.workers)
+        ledger.finish()
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
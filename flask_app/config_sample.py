@@ -1,6 +1,107 @@
-# Dictionary to determine which security settings should be included in templates (default: all supported settings)
+# Dictionary to determine which security settings should be included in templates (L3 inbound rules are opt-in)
 tracked_settings = {
     "mx_l3_outbound_firewall": True,
     "mx_l7_firewall": True,
-    "mx_content_rules": True
+    "mx_content_rules": True,
+    "mx_l3_inbound_firewall": False
 }
+
+# Resident enforcement scheduler (scheduler.py), an alternative to the crontab.txt entry
+# Default enforcement interval per organization (seconds), and the random jitter (+/- seconds) applied to each run
+enforcement_interval_seconds = 7 * 24 * 60 * 60
+enforcement_jitter_seconds = 60 * 60
+
+# Per organization interval overrides (org id -> seconds), ex: {"123456": 24 * 60 * 60}
+org_enforcement_intervals = {}
+
+# How often to re-read the organization list, how many orgs may sync at once, and the health endpoint port
+scheduler_org_refresh_seconds = 60 * 60
+scheduler_max_concurrent_orgs = 2
+scheduler_health_port = 8081
+
+# Configuration change webhooks (POST /webhook, shared secret is set with MERAKI_WEBHOOK_SECRET in .env)
+# Alert types which trigger enforcement, how long alert IDs are remembered (duplicate deliveries), and how long to
+# ignore alerts for a network after enforcing it (the upload itself generates a settings change alert)
+webhook_alert_types = ["settings_changed"]
+webhook_dedup_seconds = 60 * 60
+webhook_enforcement_cooldown_seconds = 120
+
+# Periodic enforcement only re-syncs networks with firewall/content filtering changes in the org change log (or with
+# changed template assignments/files) since the last successful sync. Set to False to always enforce every network.
+incremental_sync = True
+
+# Periodic enforcement pipeline: organizations enumerated concurrently, networks requested per page, and the number
+# of networks uploaded at the same time (upload workers of the network job queue, shared with web deploys)
+discovery_workers = 4
+discovery_page_size = 1000
+upload_workers = 10
+
+# Maximum number of entries in the shared (file backed) web cache, in flask_app/cache
+cache_threshold = 5000
+
+# Organization/network inventory cache: after the soft TTL pages keep using the cached copy while it's refreshed in
+# the background, after the hard TTL the next page load waits for a refresh (seconds)
+inventory_soft_ttl_seconds = 300
+inventory_hard_ttl_seconds = 60 * 60
+
+# Web cache lifetimes (seconds): network MX configs (download page, refreshed by deploys) and network table pages
+# (invalidated by template assignment changes)
+mx_config_cache_seconds = 15 * 60
+assignment_view_cache_seconds = 15 * 60
+
+# Upload run history (per network and setting timings, retries, rate limit waits, see /api/run_stats) is kept for
+# this many days
+run_history_days = 30
+
+# Assigned templates are validated once per run, before any network is scheduled (number of files checked at once)
+validation_workers = 4
+
+# Number of templates (and baseline/exception combinations) loaded once and shared by every upload
+template_cache_size = 128
+
+# The network job queue serves organizations round-robin (so one large org doesn't delay small orgs). Optional weights
+# give an org more networks per turn (org id -> weight, default 1), ex: {"123456": 3}
+org_upload_weights = {}
+
+# Circuit breakers (per organization and per organization/setting): after this many consecutive org-wide failures
+# (auth, permissions, rate limit exhaustion, server errors) the org's remaining uploads are skipped, and a single probe
+# call is retried after the reset time (seconds)
+circuit_breaker_threshold = 5
+circuit_breaker_reset_seconds = 300
+
+# Periodic runs checkpoint completed networks (an interrupted run resumes with the pending networks if the templates
+# haven't changed). Checkpoints of runs interrupted longer ago than this are discarded (hours)
+checkpoint_max_age_hours = 7 * 24
+
+# Background drift scan (compliance page): time between scans in seconds (0 disables the background scan), networks
+# read at the same time, and days of scan history kept
+drift_scan_interval_seconds = 6 * 60 * 60
+drift_scan_workers = 5
+drift_history_days = 30
+
+# Tracked settings of a network are read and pushed at the same time (see setting_handlers.py). Dashboard API calls in
+# flight at once across every network (weighted by each setting's rate cost), and threads shared by the settings
+api_call_budget = 10
+setting_workers = 32
+
+# HTTP connections kept open to the Meraki Dashboard, shared by every thread of a process
+dashboard_http_pool_size = 50
+
+# Idempotent Dashboard GETs are cached per process (concurrent identical calls share one API call). Override the time a
+# response is reused per SDK method (seconds, 0 only shares calls in flight), ex: {"getNetwork": 3600}. Pushing a
+# setting, or a webhook alert for the network, drops the network's cached reads.
+dashboard_cache_ttls = {}
+dashboard_cache_max_entries = 50000
+
+# The API call limit above adapts while running (AIMD): it never goes below api_call_budget_min or above
+# api_call_budget_max, is multiplied by api_call_budget_decrease on a 429 response or when call latency exceeds
+# api_call_latency_factor x its baseline, and grows by one per limit's worth of calls completed without throttling
+api_call_budget_min = 1
+api_call_budget_max = 50
+api_call_budget_decrease = 0.5
+api_call_latency_factor = 3
+
+# Web deploys and periodic/scheduled enforcement queue networks in the DB, drained by the upload workers of a single
+# process (the web app, periodic runner or scheduler holding the queue lease). Another process takes over if the
+# lease isn't renewed within this time (seconds)
+job_queue_lease_seconds = 30
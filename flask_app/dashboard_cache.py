@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import copy
+import threading
+import time
+from concurrent.futures import Future
+
+import config
+
+# Cached Dashboard GET endpoints -> time a response is reused (seconds). 0 only shares in-flight calls (concurrent
+# identical requests make one API call). Endpoints not listed are never cached.
+DEFAULT_ENDPOINT_TTLS = {
+    'getOrganizations': 60,
+    'getOrganizationNetworks': 60,
+    'getNetwork': 10 * 60,
+    'getNetworkApplianceFirewallL3FirewallRules': 30,
+    'getNetworkApplianceFirewallL7FirewallRules': 30,
+    'getNetworkApplianceContentFiltering': 30,
+    'getNetworkApplianceFirewallInboundFirewallRules': 30,
+}
+ENDPOINT_TTLS = dict(DEFAULT_ENDPOINT_TTLS, **getattr(config, 'dashboard_cache_ttls', {}))
+
+# Cached responses kept at most (expired responses are dropped first, then the oldest)
+MAX_ENTRIES = getattr(config, 'dashboard_cache_max_entries', 50000)
+
+# SDK method name prefixes that change Dashboard state (drop cached reads of the same org/network)
+WRITE_PREFIXES = ('update', 'create', 'delete', 'remove', 'claim', 'bind', 'unbind', 'split', 'combine')
+
+
+def meraki_id(args, kwargs):
+    """
+    Return the org or network a call applies to (first argument of the SDK's org and network methods)
+    :param args: Positional arguments
+    :param kwargs: Keyword arguments
+    """
+    if args:
+        return args[0]
+    return kwargs.get('networkId', kwargs.get('organizationId'))
+
+
+class ReadThroughCache:
+    """
+    Client side cache of idempotent Dashboard GETs: responses are reused for their endpoint's TTL, and concurrent
+    identical calls share a single in-flight API call (single flight). Callers get their own copy of a response.
+    """
+
+    def __init__(self, ttls=None, max_entries=MAX_ENTRIES):
+        self.ttls = ENDPOINT_TTLS if ttls is None else ttls
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+
+        # Key -> (expiry, response, org/network id), key -> Future of the call in flight, org/network id -> keys
+        self.entries = {}
+        self.in_flight = {}
+        self.keys_by_id = {}
+
+        # Incremented by every invalidation: a call started before an invalidation isn't stored
+        self.generation = 0
+
+    def call(self, endpoint, function, args, kwargs, fresh=False):
+        """
+        Return a cached response, wait for the identical call in flight, or make the call
+        :param endpoint: SDK method name (ex: getOrganizations)
+        :param function: SDK method
+        :param args: Positional arguments
+        :param kwargs: Keyword arguments
+        :param fresh: Always make the call (ex: drift and compliance reads), its response replaces the cached one
+        """
+        ttl = self.ttls.get(endpoint)
+        if ttl is None:
+            return function(*args, **kwargs)
+
+        key = (endpoint, repr(args), repr(sorted(kwargs.items())))
+
+        if fresh:
+            with self.lock:
+                generation = self.generation
+
+            response = function(*args, **kwargs)
+
+            with self.lock:
+                if ttl > 0 and generation == self.generation:
+                    if key in self.entries:
+                        self.drop(key)
+                    self.store(key, meraki_id(args, kwargs), time.monotonic() + ttl, response)
+
+            return copy.deepcopy(response)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                return copy.deepcopy(entry[1])
+
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.in_flight[key] = Future()
+                generation = self.generation
+
+        if not leader:
+            return copy.deepcopy(flight.result())
+
+        try:
+            response = function(*args, **kwargs)
+        except BaseException as e:
+            # Errors aren't cached, waiting callers get the same error
+            with self.lock:
+                del self.in_flight[key]
+            flight.set_exception(e)
+            raise
+
+        with self.lock:
+            del self.in_flight[key]
+            if ttl > 0 and generation == self.generation:
+                self.store(key, meraki_id(args, kwargs), time.monotonic() + ttl, response)
+
+        flight.set_result(response)
+        return copy.deepcopy(response)
+
+    def store(self, key, owner_id, expiry, response):
+        """
+        Add a response (lock held), making room if the cache is full
+        """
+        if len(self.entries) >= self.max_entries:
+            now = time.monotonic()
+            for old_key in [old_key for old_key, entry in self.entries.items() if entry[0] <= now]:
+                self.drop(old_key)
+            while len(self.entries) >= self.max_entries:
+                self.drop(next(iter(self.entries)))
+
+        self.entries[key] = (expiry, response, owner_id)
+        self.keys_by_id.setdefault(owner_id, set()).add(key)
+
+    def drop(self, key):
+        """
+        Remove a response (lock held)
+        """
+        _, _, owner_id = self.entries.pop(key)
+        keys = self.keys_by_id[owner_id]
+        keys.discard(key)
+        if not keys:
+            del self.keys_by_id[owner_id]
+
+    def invalidate(self, changed_id):
+        """
+        Drop the cached responses of an org or network (ex: after pushing a setting to the network)
+        :param changed_id: Org or network ID (first argument of the cached calls)
+        """
+        with self.lock:
+            self.generation += 1
+            for key in self.keys_by_id.pop(changed_id, ()):
+                del self.entries[key]
+
+    def clear(self, *endpoints):
+        """
+        Drop the cached responses of some endpoints (ex: before an explicit inventory refresh), or every response
+        :param endpoints: SDK method names (all if none given)
+        """
+        with self.lock:
+            self.generation += 1
+            for key in [key for key in self.entries if not endpoints or key[0] in endpoints]:
+                self.drop(key)
+
+
+# Shared by every thread of the process
+read_cache = ReadThroughCache()
+
+
+class CachedSection:
+    """
+    SDK API section (ex: dashboard.appliance) reading cached endpoints through the read cache, and invalidating the
+    cached reads of an org or network when a method changes it. Cached endpoints take an extra fresh=True argument to
+    skip the cached response (reads which must see the live config, ex: drift scans and plans).
+    """
+
+    def __init__(self, section, cache):
+        self._section = section
+        self._cache = cache
+
+    def __getattr__(self, name):
+        function = getattr(self._section, name)
+
+        if name in self._cache.ttls:
+            return lambda *args, fresh=False, **kwargs: self._cache.call(name, function, args, kwargs, fresh=fresh)
+
+        if name.startswith(WRITE_PREFIXES):
+            def write(*args, **kwargs):
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self._cache.invalidate(meraki_id(args, kwargs))
+            return write
+
+        return function
+
+
+class CachedDashboard:
+    """
+    Meraki Dashboard instance whose API sections go through the read cache (other attributes, ex: the HTTP session,
+    are the wrapped instance's)
+    """
+
+    def __init__(self, dashboard, cache=read_cache):
+        self._dashboard = dashboard
+        self._cache = cache
+        self._sections = {}
+
+    def __getattr__(self, name):
+        attribute = getattr(self._dashboard, name)
+        if name.startswith('_') or callable(attribute):
+            return attribute
+
+        if name not in self._sections:
+            self._sections[name] = CachedSection(attribute, self._cache)
+        return self._sections[name]
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import os
+import threading
+
+import config
+import run_ledger
+import setting_handlers
+from dashboard_cache import CachedDashboard
+
+# HTTP connections kept open to the Dashboard (shared by every thread of the process)
+HTTP_POOL_SIZE = getattr(config, 'dashboard_http_pool_size', 50)
+
+_dashboard = None
+_lock = threading.Lock()
+
+
+def create_dashboard():
+    """
+    Create a Meraki Dashboard instance from the MERAKI_API_KEY environment variable (or .env), with the run ledger
+    response hook and a connection pool sized for concurrent workers
+    """
+    # Imported here, so modules using the Dashboard can be imported quickly and without an API key
+    import meraki
+    from dotenv import load_dotenv
+    from requests.adapters import HTTPAdapter
+
+    load_dotenv()
+    dashboard = meraki.DashboardAPI(api_key=os.getenv('MERAKI_API_KEY'), suppress_logging=True)
+
+    dashboard._session._req_session.mount('https://', HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE))
+
+    # Attribute API calls to the run ledger (see run_ledger.py), and adjust the API call limit on 429s
+    run_ledger.instrument(dashboard)
+    dashboard._session._req_session.hooks.setdefault('response', []).append(setting_handlers.record_response)
+
+    return dashboard
+
+
+def get_dashboard():
+    """
+    Return the process wide Dashboard instance, created on first use (every module shares one HTTP session,
+    connection pool and read cache, see dashboard_cache.py)
+    """
+    global _dashboard
+
+    if _dashboard is None:
+        with _lock:
+            if _dashboard is None:
+                _dashboard = CachedDashboard(create_dashboard())
+
+    return _dashboard
+
+
+def set_dashboard(dashboard):
+    """
+    Replace the shared Dashboard instance (ex: a local stub for load tests)
+    :param dashboard: Meraki Dashboard instance, or None to create a new one on next use
+    """
+    global _dashboard
+
+    with _lock:
+        _dashboard = CachedDashboard(dashboard) if dashboard is not None else None
+
+
+def mount_adapter(adapter):
+    """
+    Replace the HTTP adapter of the shared Dashboard session (ex: rate limiting, larger connection pool)
+    :param adapter: requests HTTPAdapter
+    """
+    get_dashboard()._session._req_session.mount('https://', adapter)
@@ -17,8 +17,13 @@ __author__ = "Trevor Maco <tmaco@cisco.com>"
 __copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
 __license__ = "Cisco Sample Code License, Version 1.1"
 
+import json
 import os
 import sqlite3
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timezone
 from pprint import pprint
 from sqlite3 import Error
 
@@ -26,6 +31,72 @@ from sqlite3 import Error
 script_dir = os.path.dirname(os.path.abspath(__file__))
 db_path = os.path.join(script_dir, 'db/sqlite.db')
 
+# Connection settings: WAL lets the web app read while the periodic runner/deploys write, busy_timeout makes a writer
+# wait for another writer instead of failing immediately
+BUSY_TIMEOUT_MS = 5000
+CACHED_STATEMENTS = 256
+PRAGMAS = (
+    "PRAGMA journal_mode = WAL",
+    "PRAGMA synchronous = NORMAL",
+    f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000"
+)
+
+# Per thread connections (see get_connection())
+_local = threading.local()
+
+# Template statements (template type -> SQL), fixed strings so sqlite's statement cache is reused
+SELECT_TEMPLATE = {
+    'base': "SELECT file_name FROM base_templates WHERE org_id = ?",
+    'exception': "SELECT file_name FROM exception_templates WHERE net_id = ?"
+}
+INSERT_TEMPLATE = {
+    'base': "INSERT OR IGNORE INTO base_templates (org_id, file_name) VALUES (?,?)",
+    'exception': "INSERT OR IGNORE INTO exception_templates (net_id, file_name) VALUES (?,?)"
+}
+UPDATE_TEMPLATE = {
+    'base': "UPDATE base_templates SET file_name = ? WHERE org_id = ?",
+    'exception': "UPDATE exception_templates SET file_name = ? WHERE net_id = ?"
+}
+REMOVE_TEMPLATE = {
+    'base': "UPDATE base_templates SET file_name = NULL WHERE org_id = ?",
+    'exception': "UPDATE exception_templates SET file_name = NULL WHERE net_id = ?"
+}
+DELETE_TEMPLATE = {
+    'base': "DELETE FROM base_templates WHERE org_id = ?",
+    'exception': "DELETE FROM exception_templates WHERE net_id = ?"
+}
+
+
+# Row of the network_assignments view: a network with its org and assigned templates (None if unassigned)
+NetworkAssignment = namedtuple('NetworkAssignment', ['net_id', 'org_id', 'org_name', 'net_name', 'base_template',
+                                                     'exception_template'])
+
+# Row of the network_jobs table (status: queued, running or done; errors: list of error messages once done; skipped:
+# number of settings skipped by an open circuit breaker)
+NetworkJob = namedtuple('NetworkJob', ['job_id', 'net_id', 'org_id', 'net_name', 'source', 'priority', 'status',
+                                       'owner', 'errors', 'skipped'])
+NETWORK_JOB_COLUMNS = ', '.join(f"j.{column}" for column in NetworkJob._fields)
+
+
+class Connection(sqlite3.Connection):
+    """
+    SQLite connection which tracks explicit transactions (see transaction()), so single row helpers don't commit in
+    the middle of a batch
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.batch_depth = 0
+
+
+def utc_timestamp():
+    """
+    Return the current UTC time as an ISO 8601 string (format accepted by the Meraki API t0/t1 parameters)
+    """
+    return datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
 
 def create_connection(db_file):
     """
@@ -35,13 +106,64 @@ def create_connection(db_file):
     """
     conn = None
     try:
-        conn = sqlite3.connect(db_file)
+        conn = sqlite3.connect(db_file, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=CACHED_STATEMENTS,
+                               factory=Connection)
+
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
     except Error as e:
         print(e)
 
     return conn
 
 
+def get_connection(db_file):
+    """
+    Return this thread's connection to the DB (created on first use and reused afterwards, so pragmas and the
+    statement cache survive between requests/runs)
+    :param db_file: DB Object
+    :return: DB connection object
+    """
+    connections = getattr(_local, 'connections', None)
+    if connections is None:
+        connections = _local.connections = {}
+
+    conn = connections.get(db_file)
+    if conn is None:
+        conn = connections[db_file] = create_connection(db_file)
+
+    return conn
+
+
+@contextmanager
+def transaction(conn):
+    """
+    Run several changes in a single transaction (one commit/fsync), rolled back if an exception is raised
+    :param conn: DB connection object
+    """
+    conn.batch_depth += 1
+    try:
+        yield conn
+    except Exception:
+        conn.batch_depth -= 1
+        if conn.batch_depth == 0:
+            conn.rollback()
+        raise
+    else:
+        conn.batch_depth -= 1
+        if conn.batch_depth == 0:
+            conn.commit()
+
+
+def commit(conn):
+    """
+    Commit, unless a transaction() batch is in progress (the batch commits once at the end)
+    :param conn: DB connection object
+    """
+    if getattr(conn, 'batch_depth', 0) == 0:
+        conn.commit()
+
+
 def create_tables(conn):
     """
     Create initial tables (baseline template and exception template tables)
@@ -63,6 +185,179 @@ def create_tables(conn):
                UNIQUE (net_id))
               """)
 
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS organizations
+              ([org_id] TEXT PRIMARY KEY,
+               [org_name] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS networks
+              ([net_id] TEXT PRIMARY KEY,
+               [net_name] TEXT,
+               [org_id] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS sync_watermarks
+              ([org_id] TEXT PRIMARY KEY,
+               [last_sync] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS assignment_changes
+              ([template_type] TEXT,
+               [meraki_id] TEXT,
+               [changed_at] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS runs
+              ([run_id] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [source] TEXT,
+               [started_at] TEXT,
+               [ended_at] TEXT,
+               [status] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS run_items
+              ([run_id] INTEGER,
+               [org_id] TEXT,
+               [net_id] TEXT,
+               [net_name] TEXT,
+               [setting] TEXT,
+               [started_at] TEXT,
+               [ended_at] TEXT,
+               [duration_ms] REAL,
+               [api_calls] INTEGER,
+               [api_latency_ms] REAL,
+               [retries] INTEGER,
+               [rate_limit_waits] INTEGER,
+               [rate_limit_wait_seconds] REAL,
+               [bytes_sent] INTEGER,
+               [outcome] TEXT,
+               [error] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS run_checkpoints
+              ([run_id] INTEGER PRIMARY KEY,
+               [scope] TEXT,
+               [template_hashes] TEXT,
+               [started_at] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS checkpoint_networks
+              ([run_id] INTEGER,
+               [net_id] TEXT,
+               PRIMARY KEY (run_id, net_id))
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS drift_results
+              ([net_id] TEXT PRIMARY KEY,
+               [org_id] TEXT,
+               [scanned_at] TEXT,
+               [status] TEXT,
+               [drifted_settings] TEXT,
+               [details] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS drift_scans
+              ([scan_id] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [started_at] TEXT,
+               [ended_at] TEXT,
+               [in_sync] INTEGER,
+               [drifted] INTEGER,
+               [errors] INTEGER)
+              """)
+
+    # Network upload queue shared by web deploys and periodic/scheduled enforcement (see job_queue.py): jobs, the
+    # batches (deploys, enforcement runs) waiting on each job, and the lease of the process draining the queue (also
+    # used for the lease of the process running a drift scan)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS network_jobs
+              ([job_id] INTEGER PRIMARY KEY AUTOINCREMENT,
+               [net_id] TEXT NOT NULL,
+               [org_id] TEXT,
+               [net_name] TEXT,
+               [source] TEXT,
+               [priority] INTEGER,
+               [turn] INTEGER,
+               [status] TEXT,
+               [owner] TEXT,
+               [enqueued_at] TEXT,
+               [started_at] TEXT,
+               [finished_at] TEXT,
+               [errors] TEXT,
+               [skipped] INTEGER)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS network_job_batches
+              ([batch_id] TEXT,
+               [job_id] INTEGER,
+               PRIMARY KEY (batch_id, job_id))
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS queue_leases
+              ([name] TEXT PRIMARY KEY,
+               [owner] TEXT,
+               [expires_at] REAL)
+              """)
+
+    # Last upload of each network by any path (job queue, CLI), and recently received webhook alerts: alerts caused by
+    # our own uploads and duplicate deliveries are ignored by every web worker (see webhook.py)
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS network_uploads
+              ([net_id] TEXT PRIMARY KEY,
+               [uploaded_at] TEXT)
+              """)
+
+    c.execute("""
+              CREATE TABLE IF NOT EXISTS webhook_alerts
+              ([alert_key] TEXT PRIMARY KEY,
+               [received_at] TEXT)
+              """)
+
+    # Every network with its org and assigned templates (queried by the overview, assignment and deploy pages, the
+    # drift scan and the CLI)
+    c.execute("""
+              CREATE VIEW IF NOT EXISTS network_assignments AS
+              SELECT n.net_id, n.org_id, o.org_name, n.net_name, b.file_name AS base_template,
+                     e.file_name AS exception_template
+              FROM networks n
+              JOIN organizations o ON o.org_id = n.org_id
+              LEFT JOIN base_templates b ON b.org_id = n.org_id
+              LEFT JOIN exception_templates e ON e.net_id = n.net_id
+              """)
+
+    # Indexes (templates are looked up by file name when resolving conflicts and searching)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_base_templates_file_name ON base_templates (file_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_exception_templates_file_name ON exception_templates (file_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_networks_net_name ON networks (net_name)")
+    # An org's networks, in name order (paginated tables filtered by org); replaces the org_id only index
+    c.execute("CREATE INDEX IF NOT EXISTS idx_networks_org_id_net_name ON networks (org_id, net_name)")
+    c.execute("DROP INDEX IF EXISTS idx_networks_org_id")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_organizations_org_name ON organizations (org_name)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_assignment_changes_changed_at ON assignment_changes (changed_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_runs_started_at ON runs (started_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_run_items_run_id ON run_items (run_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_run_items_started_at ON run_items (started_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_run_checkpoints_scope ON run_checkpoints (scope)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_drift_scans_started_at ON drift_scans (started_at)")
+    # A network has at most one queued job, claimed in priority, round-robin turn, then enqueue order
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_network_jobs_queued_net_id ON network_jobs (net_id) "
+              "WHERE status = 'queued'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_network_jobs_queued_order ON network_jobs (priority, turn, job_id) "
+              "WHERE status = 'queued'")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_network_jobs_net_id_status ON network_jobs (net_id, status)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_network_job_batches_job_id ON network_job_batches (job_id)")
+
     conn.commit()
 
 
@@ -73,7 +368,7 @@ def query_all_base_templates(conn):
     """
     c = conn.cursor()
 
-    c.execute("""SELECT * FROM base_templates""")
+    c.execute("""SELECT org_id, file_name FROM base_templates""")
     base_templates = c.fetchall()
 
     return base_templates
@@ -86,7 +381,7 @@ def query_all_exception_templates(conn):
     """
     c = conn.cursor()
 
-    c.execute("""SELECT * FROM exception_templates""")
+    c.execute("""SELECT net_id, file_name FROM exception_templates""")
     exception_templates = c.fetchall()
 
     return exception_templates
@@ -102,19 +397,7 @@ def query_template(conn, template_type, meraki_id):
     """
     c = conn.cursor()
 
-    if template_type == "base":
-        # Base template case
-        table = "base_templates"
-
-        select_statement = f"SELECT file_name FROM {table} WHERE org_id = ?"
-        c.execute(select_statement, (meraki_id,))
-    elif template_type == "exception":
-        # Exception template case
-        table = "exception_templates"
-
-        select_statement = f"SELECT file_name FROM {table} WHERE net_id = ?"
-        c.execute(select_statement, (meraki_id,))
-
+    c.execute(SELECT_TEMPLATE[template_type], (meraki_id,))
     template_file_name = c.fetchall()
 
     if len(template_file_name) > 0:
@@ -135,22 +418,22 @@ def add_template(conn, template_type, meraki_id, file_name):
     :param meraki_id: ID used to search for a template (org id for baseline table, network id for exception table)
     :param file_name: New template file name
     """
-    c = conn.cursor()
+    add_templates(conn, template_type, [meraki_id], file_name)
 
-    if template_type == "base":
-        # Base template case
-        table = "base_templates"
 
-        update_statement = f"INSERT OR IGNORE into {table} (org_id, file_name) VALUES (?,?)"
-        c.execute(update_statement, (meraki_id, file_name))
-    elif template_type == "exception":
-        # Exception template case
-        table = "exception_templates"
+def add_templates(conn, template_type, meraki_ids, file_name=None):
+    """
+    Add several baseline or exception template rows at once (existing rows are left untouched)
+    :param conn: DB connection object
+    :param template_type: The type of template (controls table selection): base, exception
+    :param meraki_ids: Org ids for the baseline table, network ids for the exception table
+    :param file_name: Template file name for the new rows
+    """
+    c = conn.cursor()
 
-        update_statement = f"INSERT OR IGNORE into {table} (net_id, file_name) VALUES (?,?)"
-        c.execute(update_statement, (meraki_id, file_name))
+    c.executemany(INSERT_TEMPLATE[template_type], [(meraki_id, file_name) for meraki_id in meraki_ids])
 
-    conn.commit()
+    commit(conn)
 
 
 def update_template(conn, template_type, meraki_id, file_name):
@@ -163,19 +446,11 @@ def update_template(conn, template_type, meraki_id, file_name):
     """
     c = conn.cursor()
 
-    if template_type == "base":
-        # Base template case
-        table = "base_templates"
+    c.execute(UPDATE_TEMPLATE[template_type], (file_name, meraki_id))
 
-        update_statement = f"UPDATE {table} SET file_name = ? WHERE org_id = ?"
-        c.execute(update_statement, (file_name, meraki_id))
-    elif template_type == "exception":
-        # Exception template case
-        table = "exception_templates"
-        update_statement = f"UPDATE {table} SET file_name = ? WHERE net_id = ?"
-        c.execute(update_statement, (file_name, meraki_id))
+    record_assignment_change(c, template_type, meraki_id)
 
-    conn.commit()
+    commit(conn)
 
 
 def remove_template(conn, template_type, meraki_id):
@@ -187,20 +462,52 @@ def remove_template(conn, template_type, meraki_id):
     """
     c = conn.cursor()
 
-    if template_type == "base":
-        # Base template case
-        table = "base_templates"
+    c.execute(REMOVE_TEMPLATE[template_type], (meraki_id,))
 
-        update_statement = f"UPDATE {table} SET file_name = NULL WHERE org_id = ?"
-        c.execute(update_statement, (meraki_id,))
-    elif template_type == "exception":
-        # Exception template case
-        table = "exception_templates"
+    record_assignment_change(c, template_type, meraki_id)
 
-        update_statement = f"UPDATE {table} SET file_name = NULL WHERE net_id = ?"
-        c.execute(update_statement, (meraki_id,))
+    commit(conn)
 
-    conn.commit()
+
+def assign_baselines(conn, assignments):
+    """
+    Assign baseline templates to organizations in bulk, in a single transaction. Exception templates of the orgs'
+    networks using the same file as their new baseline are removed (the baseline already applies it). Statements are
+    grouped per template file (org ids bound as a json array), so the cost doesn't grow with orgs x networks.
+    :param conn: DB connection object
+    :param assignments: Dictionary of org id -> baseline file name (None removes the baseline)
+    :return: Number of exception templates removed
+    """
+    orgs_by_file = {}
+    for org_id, file_name in assignments.items():
+        orgs_by_file.setdefault(file_name, []).append(org_id)
+
+    c = conn.cursor()
+    changed_at = utc_timestamp()
+    removed_exceptions = 0
+
+    with transaction(conn):
+        for file_name, org_ids in orgs_by_file.items():
+            org_ids = json.dumps(org_ids)
+
+            if file_name is not None:
+                # Conflicting exceptions (indexed by file name, networks by org), logged then removed
+                conflicts = """FROM exception_templates
+                               WHERE file_name = ?
+                               AND net_id IN (SELECT net_id FROM networks
+                                              WHERE org_id IN (SELECT value FROM json_each(?)))"""
+                c.execute(f"INSERT INTO assignment_changes (template_type, meraki_id, changed_at) "
+                          f"SELECT 'exception', net_id, ? {conflicts}", (changed_at, file_name, org_ids))
+                c.execute(f"UPDATE exception_templates SET file_name = NULL "
+                          f"WHERE net_id IN (SELECT net_id {conflicts})", (file_name, org_ids))
+                removed_exceptions += c.rowcount
+
+            c.execute("UPDATE base_templates SET file_name = ? WHERE org_id IN (SELECT value FROM json_each(?))",
+                      (file_name, org_ids))
+            c.execute("INSERT INTO assignment_changes (template_type, meraki_id, changed_at) "
+                      "SELECT 'base', value, ? FROM json_each(?)", (changed_at, org_ids))
+
+    return removed_exceptions
 
 
 def delete_template(conn, template_type, meraki_id):
@@ -210,22 +517,753 @@ def delete_template(conn, template_type, meraki_id):
     :param template_type: The type of template (controls table selection): base, exception
     :param meraki_id: ID used to search for a template (org id for baseline table, network id for exception table)
     """
+    delete_templates(conn, template_type, [meraki_id])
+
+
+def delete_templates(conn, template_type, meraki_ids):
+    """
+    Hard Delete several templates from baseline or exception table at once
+    :param conn: DB connection object
+    :param template_type: The type of template (controls table selection): base, exception
+    :param meraki_ids: Org ids for the baseline table, network ids for the exception table
+    """
     c = conn.cursor()
 
-    if template_type == "base":
-        # Base template case
-        table = "base_templates"
+    c.executemany(DELETE_TEMPLATE[template_type], [(meraki_id,) for meraki_id in meraki_ids])
 
-        delete_statement = f"DELETE FROM {table} WHERE org_id = ?"
-        c.execute(delete_statement, (meraki_id,))
-    elif template_type == "exception":
-        # Exception template case
-        table = "exception_templates"
+    commit(conn)
 
-        delete_statement = f"DELETE FROM {table} WHERE net_id = ?"
-        c.execute(delete_statement, (meraki_id,))
 
-    conn.commit()
+def replace_inventory(conn, organizations, networks):
+    """
+    Replace the stored inventory of organizations and MX networks (single transaction)
+    :param conn: DB connection object
+    :param organizations: List of (org_id, org_name) tuples
+    :param networks: List of (net_id, net_name, org_id) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM organizations")
+    c.execute("DELETE FROM networks")
+    c.executemany("INSERT OR REPLACE INTO organizations (org_id, org_name) VALUES (?,?)", organizations)
+    c.executemany("INSERT OR REPLACE INTO networks (net_id, net_name, org_id) VALUES (?,?,?)", networks)
+
+    commit(conn)
+
+
+# Columns the network assignment table can be sorted by (DataTables column name -> SQL expression)
+NETWORK_ASSIGNMENT_ORDER_COLUMNS = {
+    'org_name': 'org_name',
+    'net_name': 'net_name',
+    'base_template': 'base_template',
+    'exception_template': 'exception_template'
+}
+
+
+def network_assignment_filters(org_name=None, search=None, net_ids=None, exclude_net_ids=None, orgs=None,
+                               networks=None, templates=None, assigned_only=False):
+    """
+    Build the WHERE clause of a network_assignments query (values are always bound as parameters, id lists as a
+    single json array so the statement text doesn't depend on their length)
+    :return: Tuple of (where clause, parameters)
+    """
+    conditions = []
+    params = []
+    if org_name:
+        conditions.append("org_name = ?")
+        params.append(org_name)
+    if search:
+        conditions.append("(org_name LIKE ? OR net_name LIKE ? OR base_template LIKE ? OR exception_template LIKE ?)")
+        params.extend([f"%{search}%"] * 4)
+    if net_ids is not None:
+        conditions.append("net_id IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(net_ids)))
+    if exclude_net_ids:
+        conditions.append("net_id NOT IN (SELECT value FROM json_each(?))")
+        params.append(json.dumps(list(exclude_net_ids)))
+    # Org ids or names, network ids or names, baseline or exception file names (each list is bound once per column)
+    for values, first_column, second_column in ((orgs, 'org_id', 'org_name'), (networks, 'net_id', 'net_name'),
+                                                (templates, 'base_template', 'exception_template')):
+        if values:
+            conditions.append(f"({first_column} IN (SELECT value FROM json_each(?)) OR "
+                              f"{second_column} IN (SELECT value FROM json_each(?)))")
+            params.extend([json.dumps(list(values))] * 2)
+    if assigned_only:
+        conditions.append("(base_template IS NOT NULL OR exception_template IS NOT NULL)")
+
+    return (f"WHERE {' AND '.join(conditions)}" if conditions else ""), params
+
+
+def query_assignments(conn, order_by='org_name', descending=False, start=0, length=None, **filters):
+    """
+    Return networks with their org and assigned templates from the network_assignments view (filtering, sorting and
+    paging are done in SQL)
+    :param conn: DB connection object
+    :param order_by: Sort column (see NETWORK_ASSIGNMENT_ORDER_COLUMNS)
+    :param descending: Sort descending
+    :param start: Offset of the first row returned
+    :param length: Maximum number of rows returned (None for all rows)
+    :param filters: Filters (see network_assignment_filters()): org_name, search (org, network or template names
+    containing the text), net_ids, exclude_net_ids, orgs (ids or names), networks (ids or names), templates (assigned
+    as baseline or exception), assigned_only (networks with at least one template)
+    :return: List of NetworkAssignment rows
+    """
+    where_clause, params = network_assignment_filters(**filters)
+
+    order_column = NETWORK_ASSIGNMENT_ORDER_COLUMNS.get(order_by, 'org_name')
+    direction = 'DESC' if descending else 'ASC'
+
+    c = conn.cursor()
+    c.row_factory = lambda cursor, row: NetworkAssignment(*row)
+    c.execute(f"""SELECT net_id, org_id, org_name, net_name, base_template, exception_template
+                  FROM network_assignments {where_clause}
+                  ORDER BY {order_column} {direction}, net_name ASC LIMIT ? OFFSET ?""",
+              params + [length if length is not None else -1, start])
+
+    return c.fetchall()
+
+
+def query_network_assignments(conn, order_by='org_name', descending=False, start=0, length=None, **filters):
+    """
+    Return a page of the network_assignments view with the row counts a paginated table needs
+    :param conn: DB connection object
+    :param order_by: Sort column (see NETWORK_ASSIGNMENT_ORDER_COLUMNS)
+    :param descending: Sort descending
+    :param start: Offset of the first row returned
+    :param length: Maximum number of rows returned (None for all rows)
+    :param filters: Filters (see query_assignments())
+    :return: Tuple of (total rows, rows matching the filters, list of NetworkAssignment rows)
+    """
+    where_clause, params = network_assignment_filters(**filters)
+
+    c = conn.cursor()
+    c.execute("SELECT COUNT(*) FROM network_assignments")
+    records_total = c.fetchone()[0]
+
+    if where_clause:
+        c.execute(f"SELECT COUNT(*) FROM network_assignments {where_clause}", params)
+        records_filtered = c.fetchone()[0]
+    else:
+        records_filtered = records_total
+
+    rows = query_assignments(conn, order_by=order_by, descending=descending, start=start, length=length, **filters)
+
+    return records_total, records_filtered, rows
+
+
+def record_assignment_change(c, template_type, meraki_id):
+    """
+    Log a template assignment change (used by incremental periodic enforcement to find networks to re-sync)
+    :param c: DB cursor (committed by the caller)
+    :param template_type: The type of template: base, exception
+    :param meraki_id: Org id for baseline templates, network id for exception templates
+    """
+    c.execute("INSERT INTO assignment_changes (template_type, meraki_id, changed_at) VALUES (?,?,?)",
+              (template_type, meraki_id, utc_timestamp()))
+
+
+def query_assignment_changes(conn, since):
+    """
+    Return template assignment changes made at or after a point in time
+    :param conn: DB connection object
+    :param since: UTC timestamp (see utc_timestamp())
+    :return: List of (template_type, meraki_id) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT DISTINCT template_type, meraki_id FROM assignment_changes WHERE changed_at >= ?", (since,))
+    changes = c.fetchall()
+
+    return changes
+
+
+def query_watermark(conn, org_id):
+    """
+    Return the time of the last successful periodic sync of an organization
+    :param conn: DB connection object
+    :param org_id: Organization ID
+    :return: UTC timestamp, or None if the org has never been synced
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT last_sync FROM sync_watermarks WHERE org_id = ?", (org_id,))
+    watermark = c.fetchone()
+
+    return watermark[0] if watermark else None
+
+
+def update_watermark(conn, org_id, last_sync):
+    """
+    Store the time of the last successful periodic sync of an organization, and prune assignment changes which are
+    older than every org's watermark
+    :param conn: DB connection object
+    :param org_id: Organization ID
+    :param last_sync: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    c.execute("INSERT OR REPLACE INTO sync_watermarks (org_id, last_sync) VALUES (?,?)", (org_id, last_sync))
+    c.execute("DELETE FROM assignment_changes WHERE changed_at < (SELECT MIN(last_sync) FROM sync_watermarks)")
+
+    commit(conn)
+
+
+# Columns of a run item (see run_ledger.py), in table order
+RUN_ITEM_COLUMNS = ('run_id', 'org_id', 'net_id', 'net_name', 'setting', 'started_at', 'ended_at', 'duration_ms',
+                    'api_calls', 'api_latency_ms', 'retries', 'rate_limit_waits', 'rate_limit_wait_seconds',
+                    'bytes_sent', 'outcome', 'error')
+
+
+def add_run(conn, source, started_at):
+    """
+    Record the start of an upload run
+    :param conn: DB connection object
+    :param source: What started the run: web, periodic, scheduler, webhook
+    :param started_at: UTC timestamp (see utc_timestamp())
+    :return: Run ID
+    """
+    c = conn.cursor()
+
+    c.execute("INSERT INTO runs (source, started_at, status) VALUES (?,?,?)", (source, started_at, 'Running'))
+    run_id = c.lastrowid
+
+    commit(conn)
+
+    return run_id
+
+
+def finish_run(conn, run_id, ended_at, status, items, keep_since=None):
+    """
+    Record the end of an upload run and its items (single transaction)
+    :param conn: DB connection object
+    :param run_id: Run ID (see add_run())
+    :param ended_at: UTC timestamp (see utc_timestamp())
+    :param status: Run outcome
+    :param items: List of run item dictionaries (keys: RUN_ITEM_COLUMNS)
+    :param keep_since: If set, runs started before this UTC timestamp are pruned
+    """
+    c = conn.cursor()
+
+    c.execute("UPDATE runs SET ended_at = ?, status = ? WHERE run_id = ?", (ended_at, status, run_id))
+    c.executemany(f"INSERT INTO run_items ({', '.join(RUN_ITEM_COLUMNS)}) "
+                  f"VALUES ({', '.join('?' * len(RUN_ITEM_COLUMNS))})",
+                  [tuple(item.get(column) for column in RUN_ITEM_COLUMNS) for item in items])
+
+    if keep_since:
+        c.execute("DELETE FROM run_items WHERE run_id IN (SELECT run_id FROM runs WHERE started_at < ?)",
+                  (keep_since,))
+        c.execute("DELETE FROM runs WHERE started_at < ?", (keep_since,))
+
+    commit(conn)
+
+
+def query_runs(conn, since):
+    """
+    Return the runs started at or after a point in time, most recent first
+    :param conn: DB connection object
+    :param since: UTC timestamp (see utc_timestamp())
+    :return: List of (run_id, source, started_at, ended_at, status) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT run_id, source, started_at, ended_at, status FROM runs WHERE started_at >= ? "
+              "ORDER BY started_at DESC", (since,))
+    runs = c.fetchall()
+
+    return runs
+
+
+def query_run_items(conn, since):
+    """
+    Return the run items started at or after a point in time, with the organization name
+    :param conn: DB connection object
+    :param since: UTC timestamp (see utc_timestamp())
+    :return: List of (org_id, org_name, net_id, setting, started_at, ended_at, duration_ms, api_latency_ms, retries,
+    rate_limit_waits, rate_limit_wait_seconds, bytes_sent, outcome) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT i.org_id, o.org_name, i.net_id, i.setting, i.started_at, i.ended_at, i.duration_ms,
+                        i.api_latency_ms, i.retries, i.rate_limit_waits, i.rate_limit_wait_seconds, i.bytes_sent,
+                        i.outcome
+                 FROM run_items i
+                 LEFT JOIN organizations o ON o.org_id = i.org_id
+                 WHERE i.started_at >= ?
+                 ORDER BY i.started_at""", (since,))
+    items = c.fetchall()
+
+    return items
+
+
+def query_checkpoint(conn, scope):
+    """
+    Return the unfinished run checkpoint of a scope (ex: periodic, or a single org), if any
+    :param conn: DB connection object
+    :param scope: Checkpoint scope
+    :return: Tuple of (run_id, template_hashes json, started_at), or None
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT run_id, template_hashes, started_at FROM run_checkpoints WHERE scope = ? "
+              "ORDER BY started_at DESC LIMIT 1", (scope,))
+    checkpoint = c.fetchone()
+
+    return checkpoint
+
+
+def add_checkpoint(conn, run_id, scope, template_hashes, started_at):
+    """
+    Start a run checkpoint, replacing any other checkpoint of the same scope
+    :param conn: DB connection object
+    :param run_id: Run ID (see add_run()), or None for a new ID
+    :param scope: Checkpoint scope
+    :param template_hashes: Resume key json (template content hashes and assignments hash, see checkpoint.py)
+    :param started_at: UTC timestamp (see utc_timestamp())
+    :return: Checkpoint run ID
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM checkpoint_networks WHERE run_id IN (SELECT run_id FROM run_checkpoints WHERE scope = ?)",
+              (scope,))
+    c.execute("DELETE FROM run_checkpoints WHERE scope = ?", (scope,))
+    c.execute("INSERT INTO run_checkpoints (run_id, scope, template_hashes, started_at) VALUES (?,?,?,?)",
+              (run_id, scope, template_hashes, started_at))
+    run_id = c.lastrowid
+
+    commit(conn)
+
+    return run_id
+
+
+def query_checkpoint_networks(conn, run_id):
+    """
+    Return the networks completed by a checkpointed run
+    :param conn: DB connection object
+    :param run_id: Checkpoint run ID
+    :return: List of network ids
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT net_id FROM checkpoint_networks WHERE run_id = ?", (run_id,))
+    net_ids = [row[0] for row in c.fetchall()]
+
+    return net_ids
+
+
+def add_checkpoint_network(conn, run_id, net_id):
+    """
+    Mark a network as completed in a checkpointed run
+    :param conn: DB connection object
+    :param run_id: Checkpoint run ID
+    :param net_id: Network ID
+    """
+    c = conn.cursor()
+
+    c.execute("INSERT OR IGNORE INTO checkpoint_networks (run_id, net_id) VALUES (?,?)", (run_id, net_id))
+
+    commit(conn)
+
+
+def delete_checkpoints(conn, run_id=None, before=None):
+    """
+    Expire run checkpoints: a finished run's checkpoint, and/or checkpoints started before a point in time
+    :param conn: DB connection object
+    :param run_id: Checkpoint run ID
+    :param before: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    c.execute("""DELETE FROM checkpoint_networks WHERE run_id IN
+                 (SELECT run_id FROM run_checkpoints WHERE run_id = ? OR started_at < ?)""", (run_id, before))
+    c.execute("DELETE FROM run_checkpoints WHERE run_id = ? OR started_at < ?", (run_id, before))
+
+    commit(conn)
+
+
+def network_job(row):
+    """
+    Build a NetworkJob from a network_jobs row (decoding the error list)
+    :param row: Row of NETWORK_JOB_COLUMNS
+    """
+    job = NetworkJob(*row)
+    return job._replace(errors=json.loads(job.errors) if job.errors else [])
+
+
+def enqueue_jobs(conn, batch_id, source, jobs, enqueued_at):
+    """
+    Queue network upload jobs for a batch (single transaction). A network already queued keeps its single job: the
+    job takes the better priority (and its source and turn), and the batch is added to the job's batches.
+    :param conn: DB connection object
+    :param batch_id: Batch ID (see job_queue.JobBatch), or None if nothing waits on the jobs (ex: webhooks)
+    :param source: What queued the jobs: web, periodic, scheduler, webhook
+    :param jobs: List of (net_id, org_id, net_name, priority, turn) tuples
+    :param enqueued_at: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    with transaction(conn):
+        for net_id, org_id, net_name, priority, turn in jobs:
+            c.execute("""INSERT INTO network_jobs
+                         (net_id, org_id, net_name, source, priority, turn, status, enqueued_at)
+                         VALUES (?,?,?,?,?,?,'queued',?)
+                         ON CONFLICT (net_id) WHERE status = 'queued' DO UPDATE SET
+                         source = CASE WHEN excluded.priority < priority THEN excluded.source ELSE source END,
+                         turn = CASE WHEN excluded.priority < priority THEN excluded.turn ELSE turn END,
+                         priority = min(priority, excluded.priority)""",
+                      (net_id, org_id, net_name, source, priority, turn, enqueued_at))
+            if batch_id is not None:
+                c.execute("INSERT OR IGNORE INTO network_job_batches (batch_id, job_id) "
+                          "SELECT ?, job_id FROM network_jobs WHERE net_id = ? AND status = 'queued'",
+                          (batch_id, net_id))
+
+
+def claim_job(conn, owner, started_at):
+    """
+    Take the next queued job (best priority, then round-robin turn, then enqueue order), skipping networks with a job
+    already running, so a network is never uploaded by two workers at once. A single statement, safe across processes.
+    :param conn: DB connection object
+    :param owner: Worker ID (a worker runs one job at a time)
+    :param started_at: UTC timestamp (see utc_timestamp())
+    :return: NetworkJob, or None if nothing can be claimed
+    """
+    c = conn.cursor()
+
+    # Cheap read first, idle workers don't take the write lock
+    c.execute("SELECT 1 FROM network_jobs WHERE status = 'queued' LIMIT 1")
+    if c.fetchone() is None:
+        return None
+
+    c.execute("""UPDATE network_jobs SET status = 'running', owner = ?, started_at = ?
+                 WHERE job_id = (SELECT q.job_id FROM network_jobs q
+                                 WHERE q.status = 'queued'
+                                 AND NOT EXISTS (SELECT 1 FROM network_jobs r
+                                                 WHERE r.net_id = q.net_id AND r.status = 'running')
+                                 ORDER BY q.priority, q.turn, q.job_id LIMIT 1)""", (owner, started_at))
+    claimed = c.rowcount
+    commit(conn)
+
+    if not claimed:
+        return None
+
+    c.execute(f"SELECT {NETWORK_JOB_COLUMNS} FROM network_jobs j WHERE j.owner = ? AND j.status = 'running'", (owner,))
+    return network_job(c.fetchone())
+
+
+def finish_job(conn, job_id, owner, finished_at, errors, skipped):
+    """
+    Record the outcome of a job, and the network's last upload time (see record_network_upload()). Only the worker
+    running the job can finish it: a job queued again by a new lease holder (see requeue_orphaned_jobs()) is left as is.
+    :param conn: DB connection object
+    :param job_id: Job ID
+    :param owner: Worker ID which claimed the job
+    :param finished_at: UTC timestamp (see utc_timestamp())
+    :param errors: List of error messages
+    :param skipped: Number of settings skipped by an open circuit breaker
+    :return: True if the job was finished, False if the worker no longer owns it
+    """
+    c = conn.cursor()
+
+    with transaction(conn):
+        c.execute("UPDATE network_jobs SET status = 'done', finished_at = ?, errors = ?, skipped = ? "
+                  "WHERE job_id = ? AND owner = ? AND status = 'running'",
+                  (finished_at, json.dumps(errors), skipped, job_id, owner))
+        finished = c.rowcount == 1
+        if finished:
+            c.execute("INSERT INTO network_uploads (net_id, uploaded_at) SELECT net_id, ? FROM network_jobs "
+                      "WHERE job_id = ? ON CONFLICT (net_id) DO UPDATE SET uploaded_at = excluded.uploaded_at",
+                      (finished_at, job_id))
+
+    return finished
+
+
+def requeue_orphaned_jobs(conn, owner_prefix):
+    """
+    Queue again the jobs left running by a process which lost the queue lease (stopped or crashed). If the network was
+    queued again since, the orphan is dropped and its batches wait on the queued job instead (single transaction).
+    :param conn: DB connection object
+    :param owner_prefix: Worker ID prefix of the current lease holder (its own running jobs are kept)
+    :return: Number of jobs queued again
+    """
+    c = conn.cursor()
+    orphans = """SELECT r.job_id FROM network_jobs r
+                 WHERE r.status = 'running' AND r.owner NOT LIKE ?
+                 AND EXISTS (SELECT 1 FROM network_jobs q WHERE q.net_id = r.net_id AND q.status = 'queued')"""
+    pattern = f"{owner_prefix}%"
+
+    with transaction(conn):
+        c.execute("""UPDATE network_jobs SET priority =
+                     (SELECT min(r.priority) FROM network_jobs r
+                      WHERE r.net_id = network_jobs.net_id AND r.status = 'running' AND r.owner NOT LIKE ?)
+                     WHERE status = 'queued' AND net_id IN
+                     (SELECT r.net_id FROM network_jobs r
+                      WHERE r.status = 'running' AND r.owner NOT LIKE ? AND r.priority < network_jobs.priority)""",
+                  (pattern, pattern))
+        c.execute(f"""UPDATE OR IGNORE network_job_batches SET job_id =
+                      (SELECT q.job_id FROM network_jobs q JOIN network_jobs r ON r.net_id = q.net_id
+                       WHERE r.job_id = network_job_batches.job_id AND q.status = 'queued')
+                      WHERE job_id IN ({orphans})""", (pattern,))
+        c.execute(f"DELETE FROM network_job_batches WHERE job_id IN ({orphans})", (pattern,))
+        c.execute(f"DELETE FROM network_jobs WHERE job_id IN ({orphans})", (pattern,))
+        c.execute("UPDATE network_jobs SET status = 'queued', owner = NULL, started_at = NULL "
+                  "WHERE status = 'running' AND owner NOT LIKE ?", (pattern,))
+        requeued = c.rowcount
+
+    return requeued
+
+
+def query_batch_jobs(conn, batch_id):
+    """
+    Return the jobs of a batch
+    :param conn: DB connection object
+    :param batch_id: Batch ID
+    :return: List of NetworkJob
+    """
+    c = conn.cursor()
+
+    c.execute(f"""SELECT {NETWORK_JOB_COLUMNS} FROM network_job_batches b
+                  JOIN network_jobs j ON j.job_id = b.job_id
+                  WHERE b.batch_id = ?""", (batch_id,))
+    jobs = [network_job(row) for row in c.fetchall()]
+
+    return jobs
+
+
+def delete_job_batch(conn, batch_id, keep_since):
+    """
+    Forget a finished batch, pruning the finished jobs no batch waits on anymore (and those finished before a point
+    in time, ex: batches whose waiting process went away)
+    :param conn: DB connection object
+    :param batch_id: Batch ID
+    :param keep_since: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM network_job_batches WHERE batch_id = ?", (batch_id,))
+    c.execute("DELETE FROM network_job_batches WHERE job_id IN "
+              "(SELECT job_id FROM network_jobs WHERE status = 'done' AND finished_at < ?)", (keep_since,))
+    c.execute("""DELETE FROM network_jobs WHERE status = 'done'
+                 AND (finished_at < ? OR NOT EXISTS (SELECT 1 FROM network_job_batches b
+                                                     WHERE b.job_id = network_jobs.job_id))""", (keep_since,))
+
+    commit(conn)
+
+
+def count_pending_jobs(conn, source=None):
+    """
+    Count the queued and running jobs (of a source, if given)
+    :param conn: DB connection object
+    :param source: Job source
+    :return: Dictionary of status -> number of jobs
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT status, count(*) FROM network_jobs WHERE status IN ('queued', 'running') "
+              "AND (? IS NULL OR source = ?) GROUP BY status", (source, source))
+    counts = dict(c.fetchall())
+
+    return {'queued': counts.get('queued', 0), 'running': counts.get('running', 0)}
+
+
+def query_setting_pushes(conn, org_id, since):
+    """
+    Return the settings pushed to an organization's networks since a point in time, by any run (run items of web
+    deploys, enforcement runs, webhooks and the CLI)
+    :param conn: DB connection object
+    :param org_id: Organization ID
+    :param since: UTC timestamp (see utc_timestamp())
+    :return: Dictionary of network ID -> list of (setting, started_at, ended_at)
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT net_id, setting, started_at, ended_at FROM run_items "
+              "WHERE org_id = ? AND started_at >= ? AND outcome = 'Success'", (org_id, since))
+    pushes = {}
+    for net_id, setting, started_at, ended_at in c.fetchall():
+        pushes.setdefault(net_id, []).append((setting, started_at, ended_at))
+
+    return pushes
+
+
+def record_network_upload(conn, net_id, uploaded_at):
+    """
+    Record the time a network was last uploaded (uploads outside of the job queue, ex: the CLI)
+    :param conn: DB connection object
+    :param net_id: Network ID
+    :param uploaded_at: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    c.execute("INSERT INTO network_uploads (net_id, uploaded_at) VALUES (?,?) "
+              "ON CONFLICT (net_id) DO UPDATE SET uploaded_at = excluded.uploaded_at", (net_id, uploaded_at))
+
+    commit(conn)
+
+
+def network_recently_uploaded(conn, net_id, since):
+    """
+    Check if a network is being uploaded, or was uploaded at or after a point in time (by any process)
+    :param conn: DB connection object
+    :param net_id: Network ID
+    :param since: UTC timestamp (see utc_timestamp())
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT EXISTS (SELECT 1 FROM network_uploads WHERE net_id = ? AND uploaded_at >= ?)
+                 OR EXISTS (SELECT 1 FROM network_jobs WHERE net_id = ? AND status = 'running')""",
+              (net_id, since, net_id))
+    recent = bool(c.fetchone()[0])
+
+    return recent
+
+
+def add_webhook_alert(conn, alert_key, received_at, keep_since):
+    """
+    Record a received webhook alert, pruning alerts received before a point in time
+    :param conn: DB connection object
+    :param alert_key: Alert key (see webhook.alert_key())
+    :param received_at: UTC timestamp (see utc_timestamp())
+    :param keep_since: UTC timestamp, older alerts are forgotten
+    :return: True if the alert is new, False if it was already received since keep_since
+    """
+    c = conn.cursor()
+
+    with transaction(conn):
+        c.execute("DELETE FROM webhook_alerts WHERE received_at < ?", (keep_since,))
+        c.execute("INSERT OR IGNORE INTO webhook_alerts (alert_key, received_at) VALUES (?,?)",
+                  (alert_key, received_at))
+        new = c.rowcount == 1
+
+    return new
+
+
+def acquire_lease(conn, name, owner, now, duration):
+    """
+    Take or renew a lease (held by one process at a time, taken over once expired)
+    :param conn: DB connection object
+    :param name: Lease name
+    :param owner: Process ID of the requester
+    :param now: Current time (epoch seconds)
+    :param duration: Lease duration (seconds)
+    :return: True if the requester holds the lease
+    """
+    c = conn.cursor()
+
+    c.execute("""INSERT INTO queue_leases (name, owner, expires_at) VALUES (?,?,?)
+                 ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+                 WHERE queue_leases.owner = excluded.owner OR queue_leases.expires_at < ?""",
+              (name, owner, now + duration, now))
+    acquired = c.rowcount == 1
+
+    commit(conn)
+
+    return acquired
+
+
+def holds_lease(conn, name, owner, now):
+    """
+    Check if a lease is held, and not expired (read only, see acquire_lease() to renew it)
+    :param conn: DB connection object
+    :param name: Lease name
+    :param owner: Process ID of the requester
+    :param now: Current time (epoch seconds)
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT 1 FROM queue_leases WHERE name = ? AND owner = ? AND expires_at >= ?", (name, owner, now))
+    held = c.fetchone() is not None
+
+    return held
+
+
+def release_lease(conn, name, owner):
+    """
+    Give up a lease (another process can take it immediately)
+    :param conn: DB connection object
+    :param name: Lease name
+    :param owner: Process ID of the holder
+    """
+    c = conn.cursor()
+
+    c.execute("DELETE FROM queue_leases WHERE name = ? AND owner = ?", (name, owner))
+
+    commit(conn)
+
+
+def replace_drift_results(conn, results, keep_net_ids=None):
+    """
+    Store the latest drift result of each scanned network (single transaction)
+    :param conn: DB connection object
+    :param results: List of (net_id, org_id, scanned_at, status, drifted_settings json, details json) tuples
+    :param keep_net_ids: If set, results of any other network (no longer assigned a template) are removed
+    """
+    c = conn.cursor()
+
+    c.executemany("INSERT OR REPLACE INTO drift_results (net_id, org_id, scanned_at, status, drifted_settings, "
+                  "details) VALUES (?,?,?,?,?,?)", results)
+
+    if keep_net_ids is not None:
+        c.execute("CREATE TEMP TABLE IF NOT EXISTS drift_keep (net_id TEXT PRIMARY KEY)")
+        c.execute("DELETE FROM drift_keep")
+        c.executemany("INSERT OR IGNORE INTO drift_keep (net_id) VALUES (?)", [(net_id,) for net_id in keep_net_ids])
+        c.execute("DELETE FROM drift_results WHERE net_id NOT IN (SELECT net_id FROM drift_keep)")
+
+    commit(conn)
+
+
+def query_drift_results(conn):
+    """
+    Return the latest drift result of each network in the inventory
+    :param conn: DB connection object
+    :return: List of (net_id, org_name, net_name, scanned_at, status, drifted_settings json, details json) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("""SELECT d.net_id, o.org_name, n.net_name, d.scanned_at, d.status, d.drifted_settings, d.details
+                 FROM drift_results d
+                 JOIN networks n ON n.net_id = d.net_id
+                 LEFT JOIN organizations o ON o.org_id = n.org_id
+                 ORDER BY o.org_name, n.net_name""")
+    results = c.fetchall()
+
+    return results
+
+
+def add_drift_scan(conn, started_at, ended_at, in_sync, drifted, errors, keep_since=None):
+    """
+    Record the totals of a finished drift scan
+    :param conn: DB connection object
+    :param started_at: UTC timestamp (see utc_timestamp())
+    :param ended_at: UTC timestamp (see utc_timestamp())
+    :param in_sync: Number of networks matching their templates
+    :param drifted: Number of networks with at least one drifted setting
+    :param errors: Number of networks which couldn't be scanned
+    :param keep_since: If set, scans started before this UTC timestamp are pruned
+    """
+    c = conn.cursor()
+
+    c.execute("INSERT INTO drift_scans (started_at, ended_at, in_sync, drifted, errors) VALUES (?,?,?,?,?)",
+              (started_at, ended_at, in_sync, drifted, errors))
+
+    if keep_since:
+        c.execute("DELETE FROM drift_scans WHERE started_at < ?", (keep_since,))
+
+    commit(conn)
+
+
+def query_drift_scans(conn, since):
+    """
+    Return the drift scans started at or after a point in time, oldest first
+    :param conn: DB connection object
+    :param since: UTC timestamp (see utc_timestamp())
+    :return: List of (started_at, ended_at, in_sync, drifted, errors) tuples
+    """
+    c = conn.cursor()
+
+    c.execute("SELECT started_at, ended_at, in_sync, drifted, errors FROM drift_scans WHERE started_at >= ? "
+              "ORDER BY started_at", (since,))
+    scans = c.fetchall()
+
+    return scans
 
 
 def close_connection(conn):
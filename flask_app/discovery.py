@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import queue
+import threading
+import urllib.parse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger('my_logger')
+
+# A discovered network (network is None once an org has been fully enumerated, error is set if enumeration failed)
+DiscoveryItem = namedtuple('DiscoveryItem', ['org', 'context', 'network', 'error'])
+
+
+def iter_network_pages(dashboard, org_id, per_page=1000):
+    """
+    Stream the networks of an organization one page at a time (getOrganizationNetworks with total_pages='all' holds
+    the whole list in memory before returning)
+    :param dashboard: Meraki Dashboard instance
+    :param org_id: Organization ID
+    :param per_page: Networks per page (3 - 100000)
+    :return: Generator of network lists
+    """
+    metadata = {
+        'tags': ['organizations', 'configure', 'networks'],
+        'operation': 'getOrganizationNetworks',
+        'page': 1
+    }
+    url = f"/organizations/{urllib.parse.quote(str(org_id), safe='')}/networks"
+    params = {'perPage': per_page}
+
+    while url:
+        # Same session (retries, rate limit handling) the SDK uses, following the Link header between pages
+        response = dashboard._session.request(metadata, 'GET', url, params=params)
+        page = response.json()
+        url = response.links.get('next', {}).get('url')
+        params = None
+        response.close()
+
+        yield page
+        metadata['page'] += 1
+
+
+def stream_networks(dashboard, orgs, max_workers=4, queue_size=1000, per_page=1000, prepare_org=None):
+    """
+    Enumerate the networks of several organizations concurrently, yielding each network as soon as its page arrives.
+    The bounded queue applies backpressure to discovery, so memory stays bounded for very large orgs.
+    :param dashboard: Meraki Dashboard instance
+    :param orgs: List of organization dictionaries (as returned by getOrganizations)
+    :param max_workers: Number of organizations enumerated at the same time
+    :param queue_size: Maximum number of discovered networks waiting to be consumed
+    :param per_page: Networks per page
+    :param prepare_org: Optional callable run for each org before enumeration, its result is returned as the context
+    :return: Generator of DiscoveryItem
+    """
+    orgs = list(orgs)
+    results = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+
+    def put(item):
+        # Block while the consumer is behind, unless the consumer has gone away
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=1)
+                return
+            except queue.Full:
+                continue
+
+    def discover(org):
+        context = None
+        error = None
+
+        try:
+            if prepare_org:
+                context = prepare_org(org)
+
+            for page in iter_network_pages(dashboard, org['id'], per_page):
+                for network in page:
+                    if stop.is_set():
+                        return
+                    put(DiscoveryItem(org, context, network, None))
+        except Exception as e:
+            logger.error(f"Error retrieving networks for organization ID {org['id']}: {e}")
+            error = e
+
+        # End of org marker
+        put(DiscoveryItem(org, context, None, error))
+
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    for org in orgs:
+        executor.submit(discover, org)
+
+    remaining = len(orgs)
+    try:
+        while remaining:
+            item = results.get()
+            if item.network is None:
+                remaining -= 1
+            yield item
+    finally:
+        # Consumer finished (or stopped early), release any blocked producers
+        stop.set()
+        executor.shutdown(wait=False, cancel_futures=True)
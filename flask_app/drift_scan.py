@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import config
+import db
+import mx_config
+import template_validation
+from mx_config import MerakiMXConfig, folder_path
+
+logger = logging.getLogger('my_logger')
+
+# Time between background drift scans (0 disables the background scan), networks read at the same time, and how long
+# scan totals are kept (compliance trend chart)
+DRIFT_SCAN_INTERVAL = getattr(config, 'drift_scan_interval_seconds', 6 * 60 * 60)
+DRIFT_SCAN_WORKERS = getattr(config, 'drift_scan_workers', 5)
+DRIFT_HISTORY_DAYS = getattr(config, 'drift_history_days', 30)
+
+# A scanning process holds a lease in the DB (renewed every third of its duration), so several web workers don't scan
+# the same networks at once. If it stops renewing it (crash, hang), another process may scan once it expires.
+LEASE_NAME = 'drift_scan'
+LEASE_SECONDS = 60
+
+IN_SYNC = 'in_sync'
+DRIFTED = 'drifted'
+ERROR = 'error'
+
+
+def scan_network(row, invalid_files, invalid_pairs, scanned_at):
+    """
+    Compare a network's live security config with its compiled baseline + exception template (read only)
+    :param row: NetworkAssignment row (see db.query_assignments())
+    :param invalid_files: Dictionary of invalid or missing template file -> errors
+    :param invalid_pairs: Dictionary of (baseline, exception) file names -> errors of the combined config
+    :param scanned_at: UTC timestamp (see db.utc_timestamp())
+    :return: Drift result tuple (see db.replace_drift_results())
+    """
+    net_id, org_id, _, net_name, base_file, exception_file = row
+    base_file, exception_file = base_file or "None", exception_file or "None"
+
+    def result(status, drifted_settings=(), **details):
+        return net_id, org_id, scanned_at, status, json.dumps(list(drifted_settings)), json.dumps(details)
+
+    errors = [error for file_name in (base_file, exception_file) for error in invalid_files.get(file_name, [])]
+    errors = errors or invalid_pairs.get((base_file, exception_file))
+    if errors:
+        return result(ERROR, errors=errors)
+
+    new_config = mx_config.build_template(base_file, exception_file)
+    if isinstance(new_config, str):
+        return result(ERROR, errors=[new_config])
+
+    current_config = MerakiMXConfig(org_id, net_id, logger, net_name=net_name)
+    current_config.get_existing_security_config(fresh=True)
+    if current_config.fetch_errors:
+        return result(ERROR, errors=[f"{setting}: {error}" for setting, error in current_config.fetch_errors.items()])
+
+    changes = current_config.diff(new_config)
+    drifted_settings = [setting for setting, change in changes.items() if not change['in_sync']]
+
+    return result(DRIFTED if drifted_settings else IN_SYNC, drifted_settings, changes=changes)
+
+
+class DriftScanner:
+    """
+    Background job reading the live L3, L7 and content filtering config of every network with an assigned template
+    (DRIFT_SCAN_WORKERS networks at a time) and storing per network drift results in the DB. Pages only read the
+    stored results, so they never call the Dashboard. Only the process holding the scan lease scans.
+    """
+
+    def __init__(self, db_file, interval=DRIFT_SCAN_INTERVAL, workers=DRIFT_SCAN_WORKERS):
+        self.db_file = db_file
+        self.interval = interval
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.running = False
+        self.worker = None
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+    def start(self):
+        """
+        Start the background scan loop (once per process, safe to call on every request)
+        """
+        if self.interval <= 0 or (self.worker is not None and self.worker.is_alive()):
+            return
+
+        with self.lock:
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self.run, daemon=True)
+                self.worker.start()
+
+    def trigger(self):
+        """
+        Start a scan now in the background
+        :return: False if a scan is already running
+        """
+        with self.lock:
+            if self.running:
+                return False
+
+        threading.Thread(target=self.scan, daemon=True).start()
+        return True
+
+    def seconds_until_due(self):
+        """
+        Return the time left before the next scan, based on the last scan stored in the DB (shared by every web worker
+        process, and kept across restarts)
+        """
+        since = (datetime.now(timezone.utc) - timedelta(seconds=self.interval)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        scans = db.query_drift_scans(db.get_connection(self.db_file), since)
+        if not scans:
+            return 0
+
+        last_started = datetime.strptime(scans[-1][0], '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        return max((last_started + timedelta(seconds=self.interval) - datetime.now(timezone.utc)).total_seconds(), 0)
+
+    def run(self):
+        """
+        Scan loop, one scan every interval
+        """
+        while True:
+            try:
+                wait = self.seconds_until_due()
+                if wait <= 0 and not self.scan():
+                    # A manually triggered scan is running, or nothing to scan yet (empty inventory)
+                    wait = 60
+
+                if wait > 0:
+                    time.sleep(wait)
+            except Exception as e:
+                logger.error(f"Drift scan failed: {e}")
+                time.sleep(60)
+
+    def scan(self):
+        """
+        Scan every network with an assigned template, then store the results and the scan totals
+        :return: Dictionary of status -> number of networks (empty if no network has a template), or None if a scan is
+        already running (in this or another process)
+        """
+        with self.lock:
+            if self.running:
+                return None
+            self.running = True
+
+        conn = db.get_connection(self.db_file)
+        if not db.acquire_lease(conn, LEASE_NAME, self.owner, time.time(), LEASE_SECONDS):
+            logger.info("Drift scan skipped, another process is scanning")
+            with self.lock:
+                self.running = False
+            return None
+
+        done = threading.Event()
+        renewer = threading.Thread(target=self.renew_lease, args=(done,), daemon=True)
+        renewer.start()
+
+        try:
+            started_at = db.utc_timestamp()
+
+            rows = db.query_assignments(conn, assigned_only=True)
+
+            # Validate the assigned templates once (reported on each network using them)
+            config_files = set(os.listdir(folder_path))
+            assigned_files = {name for row in rows for name in (row.base_template, row.exception_template) if name}
+            invalid_files = template_validation.validate_files(assigned_files & config_files)
+            for name in assigned_files - config_files:
+                invalid_files[name] = [f"Assigned template {name} not found"]
+            invalid_pairs = template_validation.validate_pairs(((row.base_template, row.exception_template)
+                                                                for row in rows), skip_files=invalid_files)
+
+            if not rows:
+                # Not recorded, so the scan is retried soon (ex: inventory not built yet)
+                return {}
+
+            logger.info(f"Drift scan started: {len(rows)} network(s)")
+
+            results = []
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for row, future in [(row, executor.submit(scan_network, row, invalid_files, invalid_pairs,
+                                                          started_at)) for row in rows]:
+                    try:
+                        results.append(future.result())
+                    except Exception as e:
+                        results.append((row.net_id, row.org_id, started_at, ERROR, '[]',
+                                        json.dumps({'errors': [str(e)]})))
+
+            counts = {IN_SYNC: 0, DRIFTED: 0, ERROR: 0}
+            for result in results:
+                counts[result[3]] += 1
+
+            keep_since = (datetime.now(timezone.utc) - timedelta(days=DRIFT_HISTORY_DAYS)).strftime(
+                '%Y-%m-%dT%H:%M:%SZ')
+            with db.transaction(conn):
+                db.replace_drift_results(conn, results, keep_net_ids=[row.net_id for row in rows])
+                db.add_drift_scan(conn, started_at, db.utc_timestamp(), counts[IN_SYNC], counts[DRIFTED],
+                                  counts[ERROR], keep_since=keep_since)
+
+            logger.info(f"Drift scan finished: {counts[IN_SYNC]} in sync, {counts[DRIFTED]} drifted, "
+                        f"{counts[ERROR]} error(s)")
+            return counts
+        finally:
+            done.set()
+            renewer.join()
+            db.release_lease(conn, LEASE_NAME, self.owner)
+            with self.lock:
+                self.running = False
+
+    def renew_lease(self, done):
+        """
+        Renew the scan lease until the scan is done
+        :param done: Event set when the scan finishes
+        """
+        conn = db.get_connection(self.db_file)
+
+        while not done.wait(LEASE_SECONDS / 3):
+            try:
+                if not db.acquire_lease(conn, LEASE_NAME, self.owner, time.time(), LEASE_SECONDS):
+                    logger.warning("Drift scan lease lost, another process may scan at the same time")
+            except Exception as e:
+                logger.error(f"Drift scan lease renewal failed: {e}")
+
+
+def compliance_summary(conn, days=DRIFT_HISTORY_DAYS):
+    """
+    Build the compliance dashboard data from the stored drift results (no Dashboard API calls)
+    :param conn: DB connection object
+    :param days: Days of scan history included in the trend
+    :return: Dictionary of totals, per organization counts, per setting drift counts, scan history and networks
+    """
+    totals = {IN_SYNC: 0, DRIFTED: 0, ERROR: 0}
+    organizations = {}
+    settings = {}
+    networks = []
+
+    for net_id, org_name, net_name, scanned_at, status, drifted_settings, details in db.query_drift_results(conn):
+        drifted_settings = json.loads(drifted_settings or '[]')
+        details = json.loads(details or '{}')
+
+        totals[status] = totals.get(status, 0) + 1
+        org_counts = organizations.setdefault(org_name, {IN_SYNC: 0, DRIFTED: 0, ERROR: 0})
+        org_counts[status] = org_counts.get(status, 0) + 1
+        for setting in drifted_settings:
+            settings[setting] = settings.get(setting, 0) + 1
+
+        networks.append({'id': net_id, 'org_name': org_name, 'net_name': net_name, 'scanned_at': scanned_at,
+                         'status': status, 'drifted_settings': drifted_settings,
+                         'errors': details.get('errors', [])})
+
+    since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%dT%H:%M:%SZ')
+    history = [{'started_at': started_at, 'ended_at': ended_at, IN_SYNC: in_sync, DRIFTED: drifted, ERROR: errors}
+               for started_at, ended_at, in_sync, drifted, errors in db.query_drift_scans(conn, since)]
+
+    return {'totals': totals, 'organizations': organizations, 'settings': settings, 'history': history,
+            'networks': networks}
+
+
+if __name__ == "__main__":
+    # One-off scan (ex: from cron instead of the web app's background scan)
+    logger.setLevel(logging.INFO)
+    logger.addHandler(logging.StreamHandler())
+
+    connection = db.get_connection(db.db_path)
+    db.create_tables(connection)
+
+    sys.exit(0 if DriftScanner(db.db_path).scan() is not None else 1)
@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import config
+import db
+import run_ledger
+import template_validation
+from mx_config import MerakiMXConfig, folder_path
+
+logger = logging.getLogger('my_logger')
+
+# Priorities (lower runs first): manual deploys, networks known to have drifted, routine enforcement
+PRIORITY_MANUAL = 0
+PRIORITY_DRIFT = 1
+PRIORITY_ROUTINE = 2
+
+# Upload workers of the process draining the queue
+UPLOAD_WORKERS = getattr(config, 'upload_workers', 10)
+
+# Upload scheduling weights (org id -> networks per round-robin turn, default 1)
+ORG_WEIGHTS = getattr(config, 'org_upload_weights', {})
+
+# The process draining the queue holds a lease in the DB, renewed every third of its duration. If the process stops
+# renewing it (crash, hang), another process takes over once it expires and queues its running jobs again.
+LEASE_NAME = 'network_jobs'
+LEASE_SECONDS = getattr(config, 'job_queue_lease_seconds', 30)
+
+# Idle workers and batch waiters check the DB this often (jobs queued or finished in the same process wake them
+# immediately)
+POLL_SECONDS = 1
+
+# Finished jobs whose batch is never collected (ex: the waiting process was stopped) are pruned after this long
+JOB_HISTORY_HOURS = 24
+
+
+class JobBatch:
+    """
+    Networks queued together (one web deploy or enforcement run), waited on as a whole. Each org's networks are given
+    round-robin turns (weight networks per turn), so within a priority the workers serve orgs in turn and a large org
+    doesn't delay the small ones queued alongside it.
+    """
+
+    def __init__(self, jobs, source):
+        self.jobs = jobs
+        self.source = source
+        self.batch_id = uuid.uuid4().hex
+        self.net_ids = set()
+        self.queued = {}
+
+    def add(self, networks, priority=PRIORITY_ROUTINE):
+        """
+        Queue networks for upload (a network already queued, by this or another batch, isn't queued twice)
+        :param networks: List of (org_id, net_id, net_name) tuples
+        :param priority: Job priority (see PRIORITY_*)
+        """
+        rows = []
+        for org_id, net_id, net_name in networks:
+            count = self.queued.get(org_id, 0)
+            self.queued[org_id] = count + 1
+            rows.append((net_id, org_id, net_name, priority, count // ORG_WEIGHTS.get(org_id, 1)))
+            self.net_ids.add(net_id)
+
+        if rows:
+            db.enqueue_jobs(db.get_connection(self.jobs.db_file), self.batch_id, self.source, rows, db.utc_timestamp())
+            self.jobs.notify()
+
+    def wait(self, on_finished=None):
+        """
+        Wait until every network of the batch has been uploaded (by whichever process drains the queue)
+        :param on_finished: Optional callback receiving each NetworkJob as it finishes
+        :return: List of finished NetworkJob
+        """
+        conn = db.get_connection(self.jobs.db_file)
+        reported = set()
+
+        while True:
+            jobs = db.query_batch_jobs(conn, self.batch_id)
+
+            for job in jobs:
+                if job.status == 'done' and job.net_id not in reported:
+                    reported.add(job.net_id)
+                    if on_finished:
+                        on_finished(job)
+
+            if all(job.status == 'done' for job in jobs):
+                break
+
+            with self.jobs.condition:
+                self.jobs.condition.wait(POLL_SECONDS)
+
+        keep_since = (datetime.now(timezone.utc) - timedelta(hours=JOB_HISTORY_HOURS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        db.delete_job_batch(conn, self.batch_id, keep_since)
+
+        return jobs
+
+    def __len__(self):
+        return len(self.net_ids)
+
+
+class JobQueue:
+    """
+    Network upload queue stored in the DB (network_jobs table), shared by every process: web deploys, periodic or
+    scheduled enforcement and webhooks queue networks with a priority, and a single worker pool drains the queue, the
+    pool of the process holding the queue lease. A network has at most one queued job (queuing it again keeps the
+    better priority and adds the batch to the job), and is never uploaded by two workers at once, so overlapping
+    deploys and enforcement runs don't write the same network twice or compete for the API call limit from separate
+    pools.
+    """
+
+    def __init__(self, db_file, workers=UPLOAD_WORKERS, on_upload=None):
+        self.db_file = db_file
+        self.workers = workers
+        # Optional callback receiving the MX config object after each upload (ex: to refresh cached configs)
+        self.on_upload = on_upload
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+
+        self.leader = False
+        self.thread = None
+        self.pool = []
+        self.stop_event = threading.Event()
+        # Notified when jobs are queued or finish in this process
+        self.condition = threading.Condition()
+
+        # Source -> [RunLedger, jobs of the source running in this process]
+        self.ledgers = {}
+        self.lock = threading.Lock()
+
+    def batch(self, source):
+        """
+        Start a batch of networks (see JobBatch), starting this process's lease loop if needed
+        :param source: What queues the networks: web, periodic, scheduler (recorded in the run ledger)
+        """
+        self.start()
+        return JobBatch(self, source)
+
+    def enqueue(self, networks, priority, source):
+        """
+        Queue networks without waiting for them (nothing collects the results, finished jobs are pruned with the next
+        collected batch), starting this process's lease loop if needed
+        :param networks: List of (org_id, net_id, net_name) tuples (net_name None: read when the job runs)
+        :param priority: Job priority (see PRIORITY_*)
+        :param source: What queues the networks (ex: webhook)
+        """
+        self.start()
+        db.enqueue_jobs(db.get_connection(self.db_file), None, source,
+                        [(net_id, org_id, net_name, priority, 0) for org_id, net_id, net_name in networks],
+                        db.utc_timestamp())
+        self.notify()
+
+    def notify(self):
+        """
+        Wake the idle workers and batch waiters of this process
+        """
+        with self.condition:
+            self.condition.notify_all()
+
+    def start(self):
+        """
+        Start the lease loop (no-op if running): the process drains the queue whenever it holds the lease
+        """
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.stop_event.clear()
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+
+    def stop(self):
+        """
+        Stop draining: running jobs finish, then the lease is released so another process takes over right away
+        """
+        self.stop_event.set()
+        self.notify()
+
+        if self.thread is not None:
+            self.thread.join()
+
+    def run(self):
+        """
+        Lease loop: take or renew the lease, starting the worker pool when it's taken and stopping it if it's lost
+        """
+        conn = db.get_connection(self.db_file)
+
+        while not self.stop_event.is_set():
+            try:
+                held = db.acquire_lease(conn, LEASE_NAME, self.owner, time.time(), LEASE_SECONDS)
+            except Exception as e:
+                logger.error(f"Job queue lease renewal failed: {e}")
+                held = False
+
+            if held and not self.leader:
+                requeued = db.requeue_orphaned_jobs(conn, self.owner)
+                logger.info(f"Draining the network job queue with {self.workers} worker(s)"
+                            + (f", {requeued} interrupted job(s) queued again" if requeued else ""))
+                self.start_pool()
+            elif not held and self.leader:
+                logger.warning("Job queue lease lost, another process drains the queue")
+                self.stop_pool()
+
+            self.stop_event.wait(LEASE_SECONDS / 3)
+
+        self.stop_pool()
+        db.release_lease(conn, LEASE_NAME, self.owner)
+
+    def start_pool(self):
+        """
+        Start the upload workers (after the previous pool, if any, has exited)
+        """
+        self.stop_pool()
+        self.leader = True
+        self.pool = [threading.Thread(target=self.work, args=(f"{self.owner}/{index}",), daemon=True)
+                     for index in range(self.workers)]
+        for thread in self.pool:
+            thread.start()
+
+    def stop_pool(self):
+        """
+        Stop the upload workers, waiting for running jobs to finish
+        """
+        self.leader = False
+        self.notify()
+
+        for thread in self.pool:
+            thread.join()
+        self.pool = []
+
+    def work(self, worker):
+        """
+        Worker loop: claim and run jobs while this process holds the lease
+        :param worker: Worker ID (recorded as the owner of the jobs it runs)
+        """
+        conn = db.get_connection(self.db_file)
+
+        while self.leader and not self.stop_event.is_set():
+            try:
+                # The lease is checked before each claim: once it expires, another process may take it over and queue
+                # this process's running jobs again, so no new job is started (without waiting for the lease loop)
+                job = db.claim_job(conn, worker, db.utc_timestamp()) if self.holds_lease(conn) else None
+            except Exception as e:
+                logger.error(f"Job queue claim failed: {e}")
+                job = None
+
+            if job is None:
+                with self.condition:
+                    self.condition.wait(POLL_SECONDS)
+                continue
+
+            # Nothing raised here may end the worker thread: the claimed job would stay running
+            errors, skipped, ledger = [], 0, None
+            try:
+                ledger = self.open_ledger(job.source)
+                errors, skipped = self.enforce(job, ledger)
+            except Exception as e:
+                logger.error(f"Upload failed for network {job.net_name}: {e}")
+                errors = [str(e)]
+            finally:
+                self.finish(conn, job, worker, errors, skipped)
+                if ledger is not None:
+                    try:
+                        self.close_ledger(job.source)
+                    except Exception as e:
+                        logger.error(f"Job queue run ledger update failed: {e}")
+                self.notify()
+
+    def finish(self, conn, job, worker, errors, skipped):
+        """
+        Record a job's outcome. If the lease was lost during the upload, the job may have been queued again (or already
+        claimed) by the new holder: the outcome is then dropped, and the new holder's run is kept. DB errors (ex:
+        database is locked) are retried, a job left running would never be collected by its batch. If the process
+        stops first, the job is queued again by the next lease holder.
+        :param conn: DB connection object
+        :param job: NetworkJob
+        :param worker: Worker ID which claimed the job
+        :param errors: List of error messages
+        :param skipped: Number of settings skipped by an open circuit breaker
+        """
+        delay = POLL_SECONDS
+
+        while True:
+            try:
+                if not self.holds_lease(conn):
+                    logger.warning(f"Job queue lease lost while uploading network {job.net_name}, the new holder may "
+                                   f"upload it again")
+
+                # Only finishes the job if this worker still owns it
+                if not db.finish_job(conn, job.job_id, worker, db.utc_timestamp(), errors, skipped):
+                    logger.warning(f"Result of network {job.net_name} dropped, the job was queued again by another "
+                                   f"process")
+                return
+            except Exception as e:
+                logger.error(f"Recording the result of network {job.net_name} failed, retrying in {delay}s: {e}")
+
+            if self.stop_event.wait(delay):
+                return
+            delay = min(delay * 2, LEASE_SECONDS)
+
+    def holds_lease(self, conn):
+        """
+        Check if this process still holds the queue lease
+        :param conn: DB connection object
+        """
+        return db.holds_lease(conn, LEASE_NAME, self.owner, time.time())
+
+    def enforce(self, job, ledger):
+        """
+        Apply the network's assigned baseline and exception templates (read when the job runs, so a job queued before
+        an assignment change uploads the current templates)
+        :param job: NetworkJob
+        :param ledger: RunLedger recording the upload
+        :return: Tuple of (list of error messages, number of settings skipped by an open circuit breaker)
+        """
+        conn = db.get_connection(self.db_file)
+        baseline_filename = db.query_template(conn, 'base', job.org_id) or "None"
+        exception_filename = db.query_template(conn, 'exception', job.net_id) or "None"
+
+        # Sanity Check (None, None) -> there's no work to do
+        if baseline_filename == "None" and exception_filename == "None":
+            return [], 0
+
+        # Sanity check assigned files are present and valid (checked again, templates may have changed since queued)
+        for filename in (baseline_filename, exception_filename):
+            if filename == "None":
+                continue
+            if not os.path.isfile(os.path.join(folder_path, filename)):
+                error = f"Assigned template {filename} not found... skipping sync(s). Please assign a valid file."
+            elif template_validation.validate_file(filename):
+                error = f"Template {filename} is invalid, skipping sync(s)"
+            else:
+                continue
+            logger.error(f"{error} (network {job.net_name})")
+            return [error], 0
+
+        # Keys may be split between the baseline and the exception template, the combination must be complete
+        errors = template_validation.validate_pair(baseline_filename, exception_filename)
+        if errors:
+            error = f"Templates {baseline_filename} + {exception_filename} are invalid once combined, skipping " \
+                    f"sync(s): {'; '.join(errors[:5])}"
+            logger.error(f"{error} (network {job.net_name})")
+            return [error], 0
+
+        current_config = MerakiMXConfig(job.org_id, job.net_id, logger, net_name=job.net_name, ledger=ledger)
+
+        # If name is still none (not known when queued), there was a failure reading the network
+        if current_config.net_name is None:
+            return [error['error'] for error in current_config.get_upload_errors()], 0
+
+        current_config.upload(baseline_filename, exception_filename)
+
+        if self.on_upload:
+            self.on_upload(current_config)
+
+        return [error['error'] for error in current_config.get_upload_errors()], len(current_config.skipped_settings)
+
+    def open_ledger(self, source):
+        """
+        Return the run ledger of a job source, starting a run if none is in progress in this process
+        :param source: Job source
+        """
+        with self.lock:
+            entry = self.ledgers.get(source)
+            if entry is None:
+                entry = self.ledgers[source] = [run_ledger.RunLedger(self.db_file, source), 0]
+            entry[1] += 1
+
+        return entry[0]
+
+    def close_ledger(self, source):
+        """
+        Release a job's ledger, finishing the run once no job of the source is queued or running anymore
+        :param source: Job source
+        """
+        with self.lock:
+            entry = self.ledgers[source]
+            entry[1] -= 1
+            if entry[1] or any(db.count_pending_jobs(db.get_connection(self.db_file), source).values()):
+                return
+            del self.ledgers[source]
+
+        entry[0].finish()
+
+    def ran_here(self, job):
+        """
+        Check if a job was run by this process's workers
+        :param job: NetworkJob
+        """
+        return bool(job.owner) and job.owner.startswith(f"{self.owner}/")
+
+    def stats(self):
+        """
+        Queue depth and whether this process drains it (see /api/run_stats and the scheduler health endpoint)
+        """
+        counts = db.count_pending_jobs(db.get_connection(self.db_file))
+        return dict(counts, draining=self.leader, workers=len(self.pool))
@@ -19,24 +19,24 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 
 import json
 import os
+import sys
+from contextlib import nullcontext
+from functools import lru_cache
 
-import meraki
-from dotenv import load_dotenv
-
+import circuit_breaker
 import config
-
-# Load ENV Variable
-load_dotenv()
-MERAKI_API_KEY = os.getenv("MERAKI_API_KEY")
-
-# Meraki Dashboard Instance
-dashboard = meraki.DashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True)
+import setting_handlers
+from dashboard_client import get_dashboard
 
 # Get absolute path to resources folder
 script_dir = os.path.dirname(os.path.abspath(__file__))
 folder_path = os.path.join(script_dir, 'mx_configs')
 
 
+# Number of loaded (and combined) templates kept in memory, shared by every upload
+TEMPLATE_CACHE_SIZE = getattr(config, 'template_cache_size', 128)
+
+
 def load_config_from_file(file_name):
     """
     Read a template config from a .json file in mx_configs
@@ -69,10 +69,12 @@ def combine_configs(baseline_config, exception_config):
     # Iterate through combined list of config keys
     for key in baseline_config.keys() | exception_config.keys():
         if key in baseline_config and key in exception_config:
-            if isinstance(baseline_config[key], list) and isinstance(exception_config[key], list):
-                # Merge the lists while avoiding duplicates
-                new_config[key] = baseline_config[key] + [item for item in exception_config[key] if
-                                                          item not in baseline_config[key]]
+            if isinstance(baseline_config[key], (list, tuple)) and isinstance(exception_config[key], (list, tuple)):
+                # Merge the lists while avoiding duplicates (baseline items are looked up by their json form, a scan of
+                # the baseline list per exception item is quadratic for large URL pattern lists)
+                seen = {json.dumps(item, sort_keys=True) for item in baseline_config[key]}
+                new_config[key] = list(baseline_config[key]) + [item for item in exception_config[key] if
+                                                                json.dumps(item, sort_keys=True) not in seen]
             elif isinstance(baseline_config[key], dict) and isinstance(exception_config[key], dict):
                 # Combined configs recursively for nested dictionary structures
                 new_config[key] = combine_configs(baseline_config[key], exception_config[key])
@@ -86,98 +88,206 @@ def combine_configs(baseline_config, exception_config):
     return new_config
 
 
+def build_template(baseline_file_name, exception_file_name):
+    """
+    Return the config to apply to a network: the baseline template, the exception template, or both combined
+    :param baseline_file_name: Base template file name (or "None")
+    :param exception_file_name: Exception Template file name (or "None")
+    :return: Template config, or an error message if a file can't be read
+    """
+    if baseline_file_name != "None" and exception_file_name != "None":
+        for file_name in (baseline_file_name, exception_file_name):
+            template_config = load_template(file_name)
+            if isinstance(template_config, str):
+                return f"There was a problem reading json file {file_name}: {template_config}"
+
+        return load_combined_template(baseline_file_name, exception_file_name)
+
+    file_name = baseline_file_name if baseline_file_name != "None" else exception_file_name
+    template_config = load_template(file_name)
+    if isinstance(template_config, str):
+        return f"There was a problem reading json file {file_name}: {template_config}"
+
+    return template_config
+
+
+class FrozenDict(dict):
+    """
+    Read-only dictionary, used for templates shared between upload threads (still a dict, so it's json serializable
+    and accepted by the Meraki SDK as a payload)
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Templates are shared between uploads and can't be modified")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = __ior__ = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    """
+    Convert a template config into an immutable, compact structure: dictionaries become FrozenDicts, lists become
+    tuples and strings are interned (rule fields and URL patterns repeated across templates are stored once)
+    :param value: Template config (parsed json)
+    :return: Frozen copy of the config
+    """
+    if isinstance(value, dict):
+        return FrozenDict((sys.intern(key) if isinstance(key, str) else key, freeze(item))
+                          for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(item) for item in value)
+    if isinstance(value, str):
+        return sys.intern(value)
+
+    return value
+
+
+def template_version(file_name):
+    """
+    Return a template file's (modification time, size), used to reload shared templates when the file changes
+    :param file_name: Template filename
+    """
+    stat = os.stat(os.path.join(folder_path, file_name))
+    return stat.st_mtime_ns, stat.st_size
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _load_template(file_name, version):
+    new_config = load_config_from_file(file_name)
+
+    return new_config if isinstance(new_config, str) else freeze(new_config)
+
+
+@lru_cache(maxsize=TEMPLATE_CACHE_SIZE)
+def _combine_templates(baseline_file_name, baseline_version, exception_file_name, exception_version):
+    baseline_config = _load_template(baseline_file_name, baseline_version)
+    exception_config = _load_template(exception_file_name, exception_version)
+
+    # File changed and became unreadable since it was checked, return the error
+    for template_config in (baseline_config, exception_config):
+        if isinstance(template_config, str):
+            return template_config
+
+    return freeze(combine_configs(baseline_config, exception_config))
+
+
+def load_template(file_name):
+    """
+    Return the shared, immutable config of a template file (loaded once, every upload using the template receives
+    the same object)
+    :param file_name: Template filename
+    :return: Frozen template config, or an error message if the file can't be read
+    """
+    try:
+        return _load_template(file_name, template_version(file_name))
+    except OSError as e:
+        return str(e)
+
+
+def load_combined_template(baseline_file_name, exception_file_name):
+    """
+    Return the shared, immutable combination of a baseline and an exception template (combined once per pair of
+    files, see combine_configs())
+    :param baseline_file_name: Base template file name
+    :param exception_file_name: Exception Template file name
+    :return: Frozen combined config, or an error message if a file can't be read
+    """
+    try:
+        return _combine_templates(baseline_file_name, template_version(baseline_file_name),
+                                  exception_file_name, template_version(exception_file_name))
+    except OSError as e:
+        return str(e)
+
+
 class MerakiMXConfig:
     """
     Class representing MX Security Config settings (either downloaded from Meraki, or obtained from reading a json file)
     Supports uploading and downloading of settings.
     """
 
-    def __init__(self, org_id, net_id, logger):
+    def __init__(self, org_id, net_id, logger, net_name=None, ledger=None):
         self.org_id = org_id
         self.net_id = net_id
         # Common logger used with main flask app
         self.logger = logger
-        self.net_name = None
-        self.l3OutRules = {}
-        self.l7Rules = {}
-        self.contentRules = {}
+        self.net_name = net_name
+        # Current config of each setting (template section name -> config, see setting_handlers.py)
+        self.settings = {}
         self.upload_errors = []
-
-        # Get Network Name
-        self.get_network_name()
+        # Settings written by the last upload (template section name -> config), used to refresh cached copies
+        self.uploaded_settings = {}
+        # Optional RunLedger recording each setting pushed by upload()
+        self.ledger = ledger
+        # Status of each setting pushed by the last upload (template section name -> Success/Failure/Skipped)
+        self.upload_status = {}
+        # Settings not pushed by the last upload because the org's (or endpoint's) circuit breaker is open
+        self.skipped_settings = []
+        # Settings which couldn't be read by the last get_existing_security_config() (template section name -> error)
+        self.fetch_errors = {}
+
+        # Get Network Name (unless already known, ex: from network discovery)
+        if self.net_name is None:
+            self.get_network_name()
 
     def get_network_name(self):
         """
         Get network name (useful for webpage table displays)
         """
         try:
-            network = dashboard.networks.getNetwork(self.net_id)
+            network = get_dashboard().networks.getNetwork(self.net_id)
             self.net_name = network['name']
         except Exception as e:
             self.upload_errors.append({'network': self.net_name, 'error': str(e)})
 
-    def get_l3_out_rules(self):
-        """
-        Get L3 Outbound Rules
-        """
-        try:
-            firewall_rules = dashboard.appliance.getNetworkApplianceFirewallL3FirewallRules(self.net_id)
-
-            # Remove default any any any rule
-            cleaned_rules = [rule for rule in firewall_rules["rules"] if rule['comment'] != "Default rule"]
-
-            self.l3OutRules = {'rules': cleaned_rules}
-            self.logger.info(f"Found the following L3 Outbound Rules: {self.l3OutRules}")
-        except Exception as e:
-            self.logger.error(f'Network ({self.net_name}) L3 Outbound Rules GET Failed: {str(e)}')
+    # Current config of the settings shown on the download page
+    @property
+    def l3OutRules(self):
+        return self.settings.get('mx_l3_outbound_firewall', {})
 
-    def get_l7_rules(self):
-        """
-        Get L7 Rules
-        """
-        try:
-            firewall_rules = dashboard.appliance.getNetworkApplianceFirewallL7FirewallRules(self.net_id)
+    @property
+    def l7Rules(self):
+        return self.settings.get('mx_l7_firewall', {})
 
-            self.l7Rules = firewall_rules
-            self.logger.info(f"Found the following L7 Rules: {firewall_rules}")
-        except Exception as e:
-            self.logger.error(f'Network ({self.net_name}) L7 Rules GET Failed: {str(e)}')
+    @property
+    def contentRules(self):
+        return self.settings.get('mx_content_rules', {})
 
-    def get_content_filtering_rules(self):
+    def fetch_setting(self, handler, fresh=False):
         """
-        Get Content Filtering Rules (URL, Content)
+        Get the current config of one setting
+        :param handler: SettingHandler of the setting
+        :param fresh: Read the live config, not a cached Dashboard response (see dashboard_cache.py)
         """
+        cost = setting_handlers.api_calls.acquire(handler.rate_cost)
         try:
-            firewall_rules = dashboard.appliance.getNetworkApplianceContentFiltering(self.net_id)
+            setting_config = handler.fetch(get_dashboard(), self.net_id, fresh=fresh)
 
-            self.contentRules = firewall_rules
-            self.logger.info(f"Found the following Content Rules: {self.contentRules}")
+            self.settings[handler.name] = setting_config
+            self.logger.info(f"Found the following {handler.label}: {setting_config}")
         except Exception as e:
-            self.logger.error(f'Network ({self.net_name}) Content Rules GET Failed: {str(e)}')
+            self.logger.error(f'Network ({self.net_name}) {handler.label} GET Failed: {str(e)}')
+            self.fetch_errors[handler.name] = str(e)
+        finally:
+            setting_handlers.api_calls.release(cost)
 
-    def get_existing_security_config(self):
+    def get_existing_security_config(self, fresh=False):
         """
-        Wrapper method to support adding more security features later, calls individual security settings getters
+        Get the current config of every tracked setting (settings are read at the same time, see setting_handlers.py)
+        :param fresh: Read the live config, not cached Dashboard responses (drift scans, plans and downloads)
         """
-        # Get current existing security config(s)
-        self.get_l3_out_rules()
-        self.get_l7_rules()
-        self.get_content_filtering_rules()
+        self.fetch_errors = {}
+        setting_handlers.run_concurrently(
+            lambda handler: self.fetch_setting(handler, fresh=fresh), setting_handlers.enabled_handlers())
 
     def download(self):
         """
         Combine security config settings, and write settings to a .json file (using the network name as the file name)
         """
         # Consolidate config into a single dictionary (only settings which are tracked!)
-        data = {}
-        if config.tracked_settings['mx_l3_outbound_firewall'] and len(self.l3OutRules) > 0:
-            data['mx_l3_outbound_firewall'] = self.l3OutRules
-
-        if config.tracked_settings['mx_l7_firewall'] and len(self.l7Rules) > 0:
-            data['mx_l7_firewall'] = self.l7Rules
-
-        if config.tracked_settings['mx_content_rules'] and len(self.contentRules) > 0:
-            data['mx_content_rules'] = self.contentRules
+        data = {setting: setting_config for setting, setting_config in self.current_settings().items()
+                if len(setting_config) > 0}
 
         self.logger.info(
             f"Downloading the following configs (based on config.py): {list(config.tracked_settings.keys())}")
@@ -192,6 +302,87 @@ class MerakiMXConfig:
         with open(path_to_config_file, 'w') as json_file:
             json.dump(data, json_file)
 
+        return file_name
+
+    def apply_settings(self, settings):
+        """
+        Replace the current config of one or more settings (ex: with the config just written by upload(), avoiding a
+        re-fetch)
+        :param settings: Dictionary of template section name -> config
+        """
+        for setting, setting_config in settings.items():
+            if setting in setting_handlers.HANDLERS:
+                self.settings[setting] = setting_config
+
+    def track(self, setting):
+        """
+        Record a setting push in the run ledger (if any), yields the run item dictionary
+        :param setting: Template section name
+        """
+        if self.ledger is None:
+            return nullcontext({})
+
+        return self.ledger.track(self.org_id, self.net_id, self.net_name, setting)
+
+    def current_settings(self):
+        """
+        Return the current config of each tracked setting (template section name -> config)
+        """
+        return {handler.name: self.settings.get(handler.name, {}) for handler in setting_handlers.enabled_handlers()}
+
+    def diff(self, new_config):
+        """
+        Compare the current config (see get_existing_security_config()) with a template config, without changing
+        anything
+        :param new_config: Template config (ex: from build_template())
+        :return: Dictionary of template section name -> {'in_sync', 'current', 'desired'} (item counts)
+        """
+        current = self.current_settings()
+
+        changes = {}
+        for setting, setting_config in new_config.items():
+            if setting not in current:
+                continue
+
+            normalize = setting_handlers.HANDLERS[setting].normalize
+            current_items = normalize(current[setting])
+            desired_items = normalize(setting_config)
+            changes[setting] = {'in_sync': current_items == desired_items,
+                                'current': sum(len(items) for items in current_items.values()),
+                                'desired': sum(len(items) for items in desired_items.values())}
+
+        return changes
+
+    def push_setting(self, handler, setting_config):
+        """
+        Push one setting of a template to the network
+        :param handler: SettingHandler of the setting
+        :param setting_config: Setting config from the template
+        :return: Upload status of the setting
+        """
+        # Org or endpoint keeps failing (circuit open), skip without calling the API (summarized once per org, see
+        # circuit_breaker.py)
+        if not circuit_breaker.breakers.allow(self.org_id, handler.name):
+            self.skipped_settings.append(handler.name)
+            return "Skipped (circuit open)"
+
+        with self.track(handler.name) as item:
+            cost = setting_handlers.api_calls.acquire(handler.rate_cost)
+            try:
+                handler.push(get_dashboard(), self.net_id, handler.build_payload(setting_config))
+
+                self.uploaded_settings[handler.name] = setting_config
+                circuit_breaker.breakers.record_success(self.org_id, handler.name)
+                return "Success"
+            except Exception as e:
+                self.logger.error(f'Network ({self.net_name}) {handler.label} Upload Failed: {str(e)}')
+                self.upload_errors.append({'network': self.net_name, 'error': str(e)})
+                item.update(outcome='Failure', error=str(e))
+                circuit_breaker.breakers.record_failure(self.org_id, handler.name, e)
+                return "Failure (see Errors)"
+            finally:
+                setting_handlers.api_calls.release(cost)
+
     def get_upload_errors(self):
         """
         Return list of upload errors (if any encountered when applying each security setting)
@@ -206,95 +397,21 @@ class MerakiMXConfig:
         :param exception_file_name: Exception Template file name
         :return:
         """
-        # Build configuration to apply to network
-        # Case 1: Baseline is not None, but Exceptions is None
-        if baseline_file_name != "None" and exception_file_name == "None":
-            new_config = load_config_from_file(baseline_file_name)
-
-            if isinstance(new_config, str):
-                # If there's a problem reading the file, return
-                self.logger.error(f"There was a problem reading json file {baseline_file_name}: {new_config}")
-                self.upload_errors.append({'network': self.net_name,
-                                           'error': f'There was a problem reading json file {baseline_file_name}: {new_config}'})
-                return
-
-        # Case 2: Baseline is None, but Exceptions is not None
-        elif baseline_file_name == "None" and exception_file_name != "None":
-            new_config = load_config_from_file(exception_file_name)
-
-            if isinstance(new_config, str):
-                # if there's a problem reading the file, return
-                self.logger.error(f"There was a problem reading json file {exception_file_name}: {new_config}")
-                self.upload_errors.append({'network': self.net_name,
-                                           'error': f'There was a problem reading json file {exception_file_name}: {new_config}'})
-                return
-
-        # Case 3: both the baseline and exceptions are not none
-        else:
-            baseline_config = load_config_from_file(baseline_file_name)
-
-            if isinstance(baseline_config, str):
-                # if there's a problem reading the file, return
-                self.logger.error(f"There was a problem reading json file {baseline_file_name}: {baseline_config}")
-                self.upload_errors.append({'network': self.net_name,
-                                           'error': f'There was a problem reading json file {baseline_file_name}: {baseline_config}'})
-                return
-
-            exception_config = load_config_from_file(exception_file_name)
-
-            if isinstance(exception_config, str):
-                # if there's a problem reading the file, return
-                self.logger.error(f"There was a problem reading json file {exception_file_name}: {exception_config}")
-                self.upload_errors.append({'network': self.net_name,
-                                           'error': f'There was a problem reading json file {exception_file_name}: {exception_config}'})
-                return
-
-            # Combine both valid configs based on key
-            new_config = combine_configs(baseline_config, exception_config)
-
-        # Upload settings to target network
-        upload_status_tracker = {}
-        for config_item in new_config:
-            # L3 Outbound Rules
-            if config_item == "mx_l3_outbound_firewall" and config.tracked_settings['mx_l3_outbound_firewall']:
-                try:
-                    response = dashboard.appliance.updateNetworkApplianceFirewallL3FirewallRules(
-                        self.net_id,
-                        rules=new_config[config_item]["rules"]
-                    )
-                    upload_status_tracker[config_item] = "Success"
-                except Exception as e:
-                    self.logger.error(f'Network ({self.net_name}) L3 Outbound Rules Upload Failed: {str(e)}')
-                    self.upload_errors.append({'network': self.net_name, 'error': str(e)})
-                    upload_status_tracker[config_item] = "Failure (see Errors)"
-
-            # L7 Rules
-            if config_item == 'mx_l7_firewall' and config.tracked_settings['mx_l7_firewall']:
-                try:
-                    response = dashboard.appliance.updateNetworkApplianceFirewallL7FirewallRules(self.net_id,
-                                                                                                 rules=new_config[
-                                                                                                     config_item][
-                                                                                                     'rules']
-                                                                                                 )
-                    upload_status_tracker[config_item] = "Success"
-                except Exception as e:
-                    self.logger.error(f'Network ({self.net_name}) L7 Rules Upload Failed: {str(e)}')
-                    self.upload_errors.append({'network': self.net_name, 'error': str(e)})
-                    upload_status_tracker[config_item] = "Failure (see Errors)"
-
-            # Content Filtering Rules
-            if config_item == 'mx_content_rules' and config.tracked_settings['mx_content_rules']:
-                try:
-                    response = dashboard.appliance.updateNetworkApplianceContentFiltering(
-                        self.net_id,
-                        allowedUrlPatterns=new_config[config_item]['allowedUrlPatterns'],
-                        blockedUrlPatterns=new_config[config_item]['blockedUrlPatterns'],
-                        blockedUrlCategories=[item['id'] for item in new_config[config_item]['blockedUrlCategories']]
-                    )
-                    upload_status_tracker[config_item] = "Success"
-                except Exception as e:
-                    self.logger.error(f'Network ({self.net_name}) Content Rules Upload Failed: {str(e)}')
-                    self.upload_errors.append({'network': self.net_name, 'error': str(e)})
-                    upload_status_tracker[config_item] = "Failure (see Errors)"
+        # Build configuration to apply to network (baseline, exception, or both combined)
+        new_config = build_template(baseline_file_name, exception_file_name)
+
+        if isinstance(new_config, str):
+            # If there's a problem reading or combining the files, return
+            self.logger.error(new_config)
+            self.upload_errors.append({'network': self.net_name, 'error': new_config})
+            return
+
+        # Upload settings to target network (tracked settings present in the template, pushed at the same time)
+        self.skipped_settings = []
+        handlers = [handler for handler in setting_handlers.enabled_handlers() if handler.name in new_config]
+        statuses = setting_handlers.run_concurrently(
+            lambda handler: self.push_setting(handler, new_config[handler.name]), handlers)
+        upload_status_tracker = {handler.name: status for handler, status in zip(handlers, statuses)}
 
         self.logger.info(f"Upload Status ({self.net_name}) for each piece of the config: {upload_status_tracker}")
+        self.upload_status = upload_status_tracker
@@ -19,49 +19,397 @@ __license__ = "Cisco Sample Code License, Version 1.1"
 
 import logging
 import os
-import threading
-from datetime import datetime
-
-import meraki
-from dotenv import load_dotenv
+from datetime import datetime, timedelta, timezone
 
+import checkpoint
+import circuit_breaker
+import config
 import db
-from mx_config import MerakiMXConfig
+import discovery
+import job_queue
+import setting_handlers
+import template_validation
+from dashboard_client import get_dashboard
+from mx_config import folder_path
 
-# Load in Environment Variables
-load_dotenv()
-MERAKI_API_KEY = os.getenv('MERAKI_API_KEY')
+logger = logging.getLogger('my_logger')
 
-# Meraki Dashboard Instance
-dashboard = meraki.DashboardAPI(api_key=MERAKI_API_KEY, suppress_logging=True)
+# Get absolute path to resources folder
+script_dir = os.path.dirname(os.path.abspath(__file__))
 
-# Set up logging (only to stdout -> cron.log)
-logger = logging.getLogger('my_logger')
-logger.setLevel(logging.INFO)
+# Incremental sync: only networks with relevant change log entries (or changed template assignments) are enforced
+INCREMENTAL_SYNC = getattr(config, 'incremental_sync', True)
 
-formatter = logging.Formatter('%(asctime)s %(levelname)s: %(funcName)s:%(lineno)d - %(message)s')
+# Change log entries (page or label) matching these keywords affect tracked security settings
+CHANGE_LOG_KEYWORDS = ('firewall', 'layer 7', 'content filtering')
 
-# log to stdout
-stream_handler = logging.StreamHandler()
-stream_handler.setLevel(logging.INFO)
-stream_handler.setFormatter(formatter)
+# The change log can't be read further back than this, older watermarks fall back to a full sync
+CHANGE_LOG_MAX_LOOKBACK = timedelta(days=365)
 
-logger.addHandler(stream_handler)
+# Change log entries written by our own pushes are ignored: entries for a setting pushed to the network (see
+# db.query_setting_pushes()), timestamped within this margin of the push (clock differences, change log write delay)
+OWN_PUSH_MARGIN = timedelta(seconds=60)
 
-# Get absolute path to resources folder
-script_dir = os.path.dirname(os.path.abspath(__file__))
+# Discovery pipeline sizing: orgs enumerated at once, networks per page
+DISCOVERY_WORKERS = getattr(config, 'discovery_workers', 4)
+DISCOVERY_PAGE_SIZE = getattr(config, 'discovery_page_size', 1000)
+
+# Discovered networks are queued this many at a time (upload workers and their weights: see job_queue.py)
+QUEUE_GROUP_SIZE = 50
+
+# Network upload queue (shared with the web app, drained by a single worker pool across processes)
+job_runner = job_queue.JobQueue(db.db_path)
+
+
+def setup_logging():
+    """
+    Set up logging (only to stdout -> cron.log), called by the entry points rather than on import
+    """
+    if logger.handlers:
+        return
+
+    logger.setLevel(logging.INFO)
+
+    formatter = logging.Formatter('%(asctime)s %(levelname)s: %(funcName)s:%(lineno)d - %(message)s')
+
+    # log to stdout
+    stream_handler = logging.StreamHandler()
+    stream_handler.setLevel(logging.INFO)
+    stream_handler.setFormatter(formatter)
+
+    logger.addHandler(stream_handler)
+
+
+def load_template_tables(conn):
+    """
+    Read the baseline and exception template tables into dictionaries
+    :param conn: DB connection object
+    :return: Tuple of (org id -> baseline file name, network id -> exception file name)
+    """
+    # Get the table of base templates and exception templates
+    base_templates = db.query_all_base_templates(conn)
+    base_templates = {item[0]: item[1] for item in base_templates}
+
+    exception_templates = db.query_all_exception_templates(conn)
+    exception_templates = {item[0]: item[1] for item in exception_templates}
+
+    return base_templates, exception_templates
+
+
+def list_config_files():
+    """
+    Return a list of the template files currently available in mx_configs
+    """
+    configs_path = os.path.join(script_dir, 'mx_configs')
+    config_files = [f for f in os.listdir(configs_path) if
+                    os.path.isfile(os.path.join(configs_path, f)) and f != ".gitignore"]
+
+    return config_files
+
+
+def template_modified_since(filename, since):
+    """
+    Check if a template file was modified after a UTC timestamp
+    :param filename: Template file name ("None" if no template is assigned)
+    :param since: UTC timestamp (see db.utc_timestamp())
+    """
+    if filename == "None":
+        return False
+
+    path_to_file = os.path.join(folder_path, filename)
+    if not os.path.isfile(path_to_file):
+        return False
+
+    modified = datetime.fromtimestamp(os.path.getmtime(path_to_file), timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    return modified >= since
+
+
+def is_own_change(change, pushes):
+    """
+    Check if a change log entry was made by one of our own pushes (a setting pushed to the network around the time of
+    the entry, whose change log keywords match the entry). Changes made by hand, by any admin, are never ignored.
+    :param change: Change log entry (as returned by getOrganizationConfigurationChanges)
+    :param pushes: List of (setting, started_at, ended_at) pushed to the network (see db.query_setting_pushes())
+    """
+    try:
+        changed_at = datetime.strptime(change['ts'][:19], '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+    except (KeyError, TypeError, ValueError):
+        return False
+
+    description = f"{change.get('page', '')} {change.get('label', '')}".lower()
+    for setting, started_at, ended_at in pushes:
+        handler = setting_handlers.HANDLERS.get(setting)
+        if handler is None or not any(keyword in description for keyword in handler.change_log_keywords):
+            continue
+
+        started = datetime.strptime(started_at, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        ended = datetime.strptime(ended_at, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+        if started - OWN_PUSH_MARGIN <= changed_at <= ended + OWN_PUSH_MARGIN:
+            return True
+
+    return False
+
+
+def find_changed_networks(org, watermark, base_templates, exception_templates, assignment_changes, pushes):
+    """
+    Determine which networks of an organization need enforcement since the last successful sync: networks with L3, L7
+    or content filtering changes in the org change log, networks with changed template assignments, and networks
+    using a template file modified since the last sync
+    :param org: Organization dictionary (as returned by getOrganizations)
+    :param watermark: UTC timestamp of the last successful sync (None if never synced)
+    :param base_templates: Dictionary of org id -> baseline file name
+    :param exception_templates: Dictionary of network id -> exception file name
+    :param assignment_changes: List of (template_type, meraki_id) changes since the watermark
+    :param pushes: Dictionary of network id -> settings pushed since the watermark (changes they made are ignored)
+    :return: Set of network ids, or None if every network in the org must be enforced
+    """
+    if not INCREMENTAL_SYNC or watermark is None:
+        return None
+
+    # Change log lookback is limited, fall back to a full sync
+    if datetime.strptime(watermark, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc) < \
+            datetime.now(timezone.utc) - CHANGE_LOG_MAX_LOOKBACK:
+        return None
+
+    # A baseline assignment or baseline file change affects every network in the org
+    baseline_filename = base_templates.get(org['id']) or "None"
+    if ('base', org['id']) in assignment_changes or template_modified_since(baseline_filename, watermark):
+        return None
+
+    changed_networks = {meraki_id for template_type, meraki_id in assignment_changes if template_type == 'exception'}
+
+    # Networks using a modified exception file
+    for net_id, exception_filename in exception_templates.items():
+        if exception_filename and template_modified_since(exception_filename, watermark):
+            changed_networks.add(net_id)
+
+    # One paginated read of the org change log since the watermark
+    changes = get_dashboard().organizations.getOrganizationConfigurationChanges(org['id'], total_pages='all',
+                                                                            t0=watermark)
+    for change in changes:
+        if not change.get('networkId') or is_own_change(change, pushes.get(change['networkId'], ())):
+            continue
+
+        description = f"{change.get('page', '')} {change.get('label', '')}".lower()
+        if any(keyword in description for keyword in CHANGE_LOG_KEYWORDS):
+            changed_networks.add(change['networkId'])
 
+    logger.info(f"Incremental sync for organization {org['name']}: {len(changed_networks)} changed network(s) "
+                f"since {watermark}")
 
-def thread_wrapper(current_config, baseline_filename, exception_filename):
+    return changed_networks
+
+
+def resolve_templates(org, network, base_templates, exception_templates, config_files, invalid_files=()):
+    """
+    Return the baseline and exception template file names to enforce on a network
+    :param org: Organization dictionary (as returned by getOrganizations)
+    :param network: Network dictionary (as returned by getOrganizationNetworks)
+    :param base_templates: Dictionary of org id -> baseline file name
+    :param exception_templates: Dictionary of network id -> exception file name
+    :param config_files: List of template files available in mx_configs
+    :param invalid_files: Template files which failed validation (already reported, see template_validation.py)
+    :return: Tuple of (baseline file name, exception file name), or None if there's nothing to enforce
+    """
+    # Grab baseline and exception file names
+    baseline_filename = base_templates.get(org['id']) or "None"
+    exception_filename = exception_templates.get(network['id']) or "None"
+
+    # Sanity check assigned files are present and haven't been removed from mx_configs
+    if baseline_filename != 'None' and baseline_filename not in config_files:
+        logger.error(
+            f"Assigned base template {baseline_filename} not found... skipping sync(s). Please assign a valid file.")
+        return None
+
+    if exception_filename != 'None' and exception_filename not in config_files:
+        logger.error(
+            f"Assigned exception template {exception_filename} not found... skipping sync(s). Please assign a valid file.")
+        return None
+
+    if baseline_filename in invalid_files or exception_filename in invalid_files:
+        return None
+
+    # Sanity Check (None, None) -> there's no work to do
+    if baseline_filename == "None" and exception_filename == "None":
+        return None
+
+    return baseline_filename, exception_filename
+
+
+def run_enforcement(conn, orgs, base_templates, exception_templates, config_files, source='periodic',
+                    checkpoint_scope='periodic'):
     """
-    Wrapper method to trigger baseline and exception template uploads to each network, each in their own thread for
-    multiprocessing
-    :param current_config: MX Config Object used for uploading and processing combined template config to each network
-    :param baseline_filename: File name for baseline template
-    :param exception_filename: File name for exception template
+    Enforce templates across organizations as a pipeline: orgs are enumerated concurrently, network pages are
+    streamed as they arrive, and each MX network is queued in the shared network job queue immediately (uploads
+    overlap with discovery; manual deploys go first and orgs are served round-robin, see job_queue.py). Each org's
+    watermark is advanced once all of its uploads have succeeded. Completed networks are checkpointed, so an
+    interrupted run resumes where it stopped.
+    :param conn: DB connection object
+    :param orgs: List of organization dictionaries (as returned by getOrganizations)
+    :param base_templates: Dictionary of org id -> baseline file name
+    :param exception_templates: Dictionary of network id -> exception file name
+    :param config_files: List of template files available in mx_configs
+    :param source: Run source recorded in the run ledger
+    :param checkpoint_scope: Runs with the same scope resume each other's progress after an interruption
+    :return: Number of networks processed
     """
-    # Trigger settings upload to network
-    current_config.upload(baseline_filename, exception_filename)
+    # Validate every assigned template once, before any network is scheduled (networks using an invalid template are
+    # skipped)
+    assigned_files = {base_templates.get(org['id']) for org in orgs} | set(exception_templates.values())
+    invalid_files = template_validation.validate_files(name for name in assigned_files if name in config_files)
+
+    # Resume an interrupted run (same scope, templates and assignments), skipping the networks it already completed
+    run_checkpoint = checkpoint.RunCheckpoint(db.db_path, checkpoint_scope, None,
+                                              checkpoint.resume_key((name for name in assigned_files
+                                                                     if name in config_files),
+                                                                    base_templates, exception_templates))
+
+    # Watermarks and assignment changes are read up front (the DB connection stays on this thread)
+    org_state = {}
+    for org in orgs:
+        watermark = db.query_watermark(conn, org['id'])
+        org_state[org['id']] = {
+            'org': org,
+            'watermark': watermark,
+            'assignment_changes': db.query_assignment_changes(conn, watermark) if watermark else [],
+            # Settings pushed since the watermark, minus the margin (their change log entries are ignored)
+            'pushes': db.query_setting_pushes(conn, org['id'], (datetime.strptime(watermark, '%Y-%m-%dT%H:%M:%SZ')
+                                                                - OWN_PUSH_MARGIN).strftime('%Y-%m-%dT%H:%M:%SZ'))
+            if watermark else {},
+            'jobs': [],
+            'discovery_error': None,
+            # Recorded before reading the change log, so changes made during the run are picked up next time. A
+            # resumed run skips the networks completed before the interruption, so the watermark only advances to
+            # the interrupted run's start (changes made to those networks since are picked up next time).
+            'sync_started': run_checkpoint.started_at if run_checkpoint.resumed else db.utc_timestamp()
+        }
+
+    def prepare_org(org):
+        # Runs on a discovery thread: read the change log to find the networks which need enforcement
+        state = org_state[org['id']]
+        try:
+            return find_changed_networks(org, state['watermark'], base_templates, exception_templates,
+                                         state['assignment_changes'], state['pushes'])
+        except Exception as e:
+            logger.error(f"Error reading change log for organization ID {org['id']}, running full sync: {e}")
+            return None
+
+    # Keys may be split between the baseline and the exception template, each combination must be complete (validated
+    # the first time a network uses it, reported once)
+    checked_pairs = {}
+
+    def pair_invalid(templates):
+        if templates not in checked_pairs:
+            checked_pairs[templates] = bool(template_validation.validate_pairs([templates]))
+        return checked_pairs[templates]
+
+    # Discovered networks are queued in small groups (one DB transaction each) so uploads start while discovery
+    # continues, networks with detected changes first
+    batch = job_runner.batch(source)
+    pending = {job_queue.PRIORITY_DRIFT: [], job_queue.PRIORITY_ROUTINE: []}
+
+    def flush(minimum=1):
+        for priority, networks in pending.items():
+            if len(networks) >= minimum:
+                batch.add(networks, priority)
+                networks.clear()
+
+    for item in discovery.stream_networks(get_dashboard(), orgs, max_workers=DISCOVERY_WORKERS,
+                                          per_page=DISCOVERY_PAGE_SIZE, prepare_org=prepare_org):
+        org, network_filter, network = item.org, item.context, item.network
+
+        # End of org marker
+        if network is None:
+            org_state[org['id']]['discovery_error'] = item.error
+            flush()
+            continue
+
+        if 'appliance' not in network['productTypes']:
+            continue
+
+        if run_checkpoint.is_completed(network['id']):
+            continue
+
+        # Skip networks without changes (incremental sync), networks not yet in the exception table are new
+        if network_filter is not None and network['id'] not in network_filter and \
+                network['id'] in exception_templates:
+            continue
+
+        templates = resolve_templates(org, network, base_templates, exception_templates, config_files,
+                                      invalid_files)
+        if templates is None or pair_invalid(templates):
+            continue
+
+        # Networks found in the change log (known drift) or with changed assignments go first
+        if network_filter is not None and network['id'] in network_filter:
+            priority = job_queue.PRIORITY_DRIFT
+        else:
+            priority = job_queue.PRIORITY_ROUTINE
+        pending[priority].append((org['id'], network['id'], network['name']))
+        flush(QUEUE_GROUP_SIZE)
+
+    flush()
+
+    def job_finished(job):
+        state = org_state.get(job.org_id)
+        if state is not None:
+            state['jobs'].append(job)
+
+        if not job.errors and not job.skipped:
+            run_checkpoint.complete(job.net_id)
+
+    # Wait for the uploads (run by whichever process drains the queue)
+    batch.wait(job_finished)
+    run_checkpoint.finish()
+
+    # Advance each org's watermark
+    for state in org_state.values():
+        finish_organization(conn, state['org'], state['jobs'], state['sync_started'], state['discovery_error'])
+
+    return len(batch)
+
+
+def finish_organization(conn, org, jobs, sync_started, discovery_error=None):
+    """
+    Advance the watermark of an organization once its uploads have finished, if discovery and every upload
+    succeeded (failed networks and networks skipped by an open circuit breaker are retried next run)
+    :param conn: DB connection object
+    :param org: Organization dictionary (as returned by getOrganizations)
+    :param jobs: List of finished NetworkJob of the org
+    :param sync_started: Sync start timestamp
+    :param discovery_error: Exception raised while enumerating the org's networks (if any)
+    """
+    if discovery_error is not None:
+        logger.error(f"Network discovery failed for organization {org['name']}, watermark not advanced")
+    elif any(job.errors for job in jobs):
+        logger.error(f"Upload errors for organization {org['name']}, watermark not advanced")
+    elif any(job.skipped for job in jobs):
+        skipped = sum(1 for job in jobs if job.skipped)
+        logger.error(f"{skipped} network(s) skipped for organization {org['name']}, watermark not advanced. "
+                     f"{circuit_breaker.breakers.summary(org['id']) or 'Circuit open'}")
+    else:
+        db.update_watermark(conn, org['id'], sync_started)
+
+
+def enforce_organization(org):
+    """
+    Run synchronization for the networks of a single organization (used by the resident scheduler, see scheduler.py)
+    :param org: Organization dictionary (as returned by getOrganizations)
+    """
+    logger.info(f"Starting sync for organization: {org['name']} ({org['id']})")
+
+    # Connection to DB (one-time)
+    conn_one_time = db.create_connection(db.db_path)
+
+    base_templates, exception_templates = load_template_tables(conn_one_time)
+
+    processed = run_enforcement(conn_one_time, [org], base_templates, exception_templates, list_config_files(),
+                                source='scheduler', checkpoint_scope=f"org:{org['id']}")
+
+    # Close DB connection (one-time)
+    db.close_connection(conn_one_time)
+
+    logger.info(f"Finished sync for organization: {org['name']} ({org['id']}), {processed} network(s) processed")
 
 
 def main():
@@ -69,82 +417,34 @@ def main():
     Run synchronization for each network with respect to assigned base template and exception template
     :return:
     """
+    setup_logging()
+
     current_datetime = datetime.now()
     formatted_datetime = current_datetime.strftime("%Y-%m-%d %H:%M:%S")
 
     logger.info(f"Starting Periodic sync at: {formatted_datetime}")
 
     # Connection to DB (one-time)
-    conn_one_time = db.create_connection(os.path.join(script_dir, 'sqlite.db'))
+    conn_one_time = db.create_connection(db.db_path)
 
     # Get the table of base templates and exception templates
-    base_templates = db.query_all_base_templates(conn_one_time)
-    base_templates = {item[0]: item[1] for item in base_templates}
-
-    exception_templates = db.query_all_exception_templates(conn_one_time)
-    exception_templates = {item[0]: item[1] for item in exception_templates}
+    base_templates, exception_templates = load_template_tables(conn_one_time)
 
     # Get a list of available files for exceptions for drop down table fields
-    configs_path = os.path.join(script_dir, 'mx_configs')
-    config_files = [f for f in os.listdir(configs_path) if
-                    os.path.isfile(os.path.join(configs_path, f)) and f != ".gitignore"]
+    config_files = list_config_files()
     logger.info(f"Current templates available in mx_configs folder: {config_files}")
 
     logger.info(f"Baseline Template Table: {base_templates}")
     logger.info(f"Exception Template Table: {exception_templates}")
 
-    threads = []
     # Iterate through orgs and networks grabbing respective templates, kick off upload workflow
-    orgs = dashboard.organizations.getOrganizations()
-    for org in orgs:
-        # Grab baseline file name
-        baseline_filename = base_templates[org['id']]
-        if not baseline_filename:
-            baseline_filename = "None"
+    orgs = get_dashboard().organizations.getOrganizations()
+    processed = run_enforcement(conn_one_time, orgs, base_templates, exception_templates, config_files)
 
-        try:
-            networks = dashboard.organizations.getOrganizationNetworks(org['id'], total_pages='all')
-        except:
-            continue
+    logger.info(f"Periodic sync finished, {processed} network(s) processed")
 
-        for network in networks:
-            if 'appliance' in network['productTypes']:
-                # Grab Exception File Name
-                exception_filename = exception_templates[network['id']]
-                if not exception_filename:
-                    exception_filename = "None"
-
-                # Sanity check assigned files are present and haven't been removed from mx_configs
-                if baseline_filename != 'None' and baseline_filename not in config_files:
-                    logger.error(
-                        f"Assigned base template {baseline_filename} not found... skipping sync(s). Please assign a valid file.")
-                    continue
-
-                if exception_filename != 'None' and exception_filename not in config_files:
-                    logger.error(
-                        f"Assigned exception template {exception_filename} not found... skipping sync(s). Please assign a valid file.")
-
-                    continue
-
-                # Sanity Check (None, None) -> there's no work to do
-                if baseline_filename == "None" and exception_filename == "None":
-                    continue
-                else:
-                    # Upload config to network - return action batch of configs to apply
-                    current_config = MerakiMXConfig(org['id'], network['id'], logger)
-
-                    # Spawn a background thread to perform settings upload to each network
-                    thread = threading.Thread(target=thread_wrapper,
-                                              args=(current_config, baseline_filename, exception_filename,))
-                    threads.append(thread)
-
-    # Start all threads.
-    for t in threads:
-        t.start()
-
-    # Wait for all threads to finish.
-    for t in threads:
-        t.join()
+    # Hand the queue over to another process (ex: the web app)
+    job_runner.stop()
 
     # Close DB connection (one-time)
     db.close_connection(conn_one_time)
@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+import config
+import db
+import setting_handlers
+
+logger = logging.getLogger('my_logger')
+
+# Run history older than this is pruned when a run finishes
+RUN_HISTORY_DAYS = getattr(config, 'run_history_days', 30)
+
+# Stats of the run item being recorded on the current thread (see RunLedger.track())
+_local = threading.local()
+
+
+def record_response(response, *args, **kwargs):
+    """
+    requests response hook, adds each Dashboard API call (every attempt, including retries) to the run item being
+    recorded on the current thread
+    :param response: requests Response
+    """
+    stats = getattr(_local, 'stats', None)
+    if stats is None:
+        return
+
+    stats['api_calls'] += 1
+    stats['api_latency_ms'] += response.elapsed.total_seconds() * 1000
+
+    body = response.request.body
+    stats['bytes_sent'] += len(body) if body else 0
+
+    # The SDK sleeps for Retry-After before retrying a rate limited call
+    if response.status_code == 429:
+        stats['rate_limit_waits'] += 1
+        try:
+            stats['rate_limit_wait_seconds'] += float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            stats['rate_limit_wait_seconds'] += 1
+
+
+def instrument(dashboard):
+    """
+    Install the run ledger response hook on a Dashboard instance's HTTP session (safe to call more than once)
+    :param dashboard: Meraki Dashboard instance
+    """
+    hooks = dashboard._session._req_session.hooks.setdefault('response', [])
+    if record_response not in hooks:
+        hooks.append(record_response)
+
+
+class RunLedger:
+    """
+    Record of a single upload run (web deploy, periodic sync, webhook enforcement): one run item per network and
+    setting pushed, with API latency, retries, 429 waits, bytes sent and outcome. Items are collected in memory and
+    written with the run's end in a single transaction.
+    """
+
+    def __init__(self, db_file, source):
+        self.db_file = db_file
+        self.source = source
+        self.items = []
+        self.lock = threading.Lock()
+
+        self.run_id = db.add_run(db.get_connection(db_file), source, db.utc_timestamp())
+
+    @contextmanager
+    def track(self, org_id, net_id, net_name, setting):
+        """
+        Record a setting pushed to a network. API calls made on this thread inside the block are attributed to the
+        item, the caller sets 'outcome' (and 'error') on the yielded dictionary if the push fails.
+        :param org_id: Organization ID
+        :param net_id: Network ID
+        :param net_name: Network name
+        :param setting: Template section name (ex: mx_l3_outbound_firewall)
+        """
+        stats = {'run_id': self.run_id, 'org_id': org_id, 'net_id': net_id, 'net_name': net_name, 'setting': setting,
+                 'started_at': db.utc_timestamp(), 'api_calls': 0, 'api_latency_ms': 0.0, 'rate_limit_waits': 0,
+                 'rate_limit_wait_seconds': 0.0, 'bytes_sent': 0, 'outcome': 'Success', 'error': None}
+
+        previous = getattr(_local, 'stats', None)
+        _local.stats = stats
+        start = time.perf_counter()
+
+        try:
+            yield stats
+        except Exception as e:
+            stats['outcome'] = 'Failure'
+            stats['error'] = str(e)
+            raise
+        finally:
+            _local.stats = previous
+
+            stats['ended_at'] = db.utc_timestamp()
+            stats['duration_ms'] = round((time.perf_counter() - start) * 1000, 1)
+            stats['api_latency_ms'] = round(stats['api_latency_ms'], 1)
+            stats['retries'] = max(stats['api_calls'] - 1, 0)
+
+            with self.lock:
+                self.items.append(stats)
+
+    def finish(self):
+        """
+        Write the run's items and end time, pruning old run history
+        """
+        with self.lock:
+            items = list(self.items)
+
+        failures = sum(1 for item in items if item['outcome'] != 'Success')
+        status = 'Success' if failures == 0 else f'{failures} failure(s)'
+        keep_since = (datetime.now(timezone.utc) - timedelta(days=RUN_HISTORY_DAYS)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        conn = db.get_connection(self.db_file)
+        db.finish_run(conn, self.run_id, db.utc_timestamp(), status, items, keep_since)
+
+        logger.info(f"Run {self.run_id} ({self.source}) finished: {len(items)} setting(s) pushed, {status} "
+                    f"(API call limit {setting_handlers.api_calls.budget})")
+
+
+def percentile(values, pct):
+    """
+    Return a percentile of a list of values (nearest rank)
+    :param values: Sorted list of numbers
+    :param pct: Percentile (0 - 100)
+    """
+    if not values:
+        return None
+
+    rank = max(math.ceil(pct / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def parse_timestamp(timestamp):
+    """
+    Convert a UTC timestamp (see db.utc_timestamp()) to a datetime
+    :param timestamp: UTC timestamp string
+    """
+    return datetime.strptime(timestamp, '%Y-%m-%dT%H:%M:%SZ').replace(tzinfo=timezone.utc)
+
+
+def summarize(items):
+    """
+    Aggregate run items: throughput (settings and networks pushed per minute of activity) and tail latency
+    :param items: List of run item tuples (see db.query_run_items())
+    """
+    durations = sorted(item[6] for item in items)
+    first_start = min(parse_timestamp(item[4]) for item in items)
+    last_end = max(parse_timestamp(item[5]) for item in items)
+    active_minutes = max((last_end - first_start).total_seconds(), 1) / 60
+
+    return {
+        'settings': len(items),
+        'networks': len({item[2] for item in items}),
+        'failures': sum(1 for item in items if item[12] != 'Success'),
+        'settings_per_minute': round(len(items) / active_minutes, 2),
+        'networks_per_minute': round(len({item[2] for item in items}) / active_minutes, 2),
+        'latency_ms': {'p50': percentile(durations, 50), 'p95': percentile(durations, 95),
+                       'p99': percentile(durations, 99), 'max': durations[-1]},
+        'api_latency_ms': round(sum(item[7] for item in items) / len(items), 1),
+        'retries': sum(item[8] for item in items),
+        'rate_limit_waits': sum(item[9] for item in items),
+        'rate_limit_wait_seconds': round(sum(item[10] for item in items), 1),
+        'bytes_sent': sum(item[11] for item in items)
+    }
+
+
+def run_statistics(conn, hours=24, bucket_seconds=3600):
+    """
+    Aggregate the run history per organization over time, used to size upload workers and schedules
+    :param conn: DB connection object
+    :param hours: How far back to look
+    :param bucket_seconds: Width of each time bucket
+    :return: Dictionary of recent runs and per org totals and time buckets
+    """
+    since = (datetime.now(timezone.utc) - timedelta(hours=hours)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+    # Group items by org, then by time bucket
+    orgs = {}
+    for item in db.query_run_items(conn, since):
+        org = orgs.setdefault(item[0], {'org_name': item[1], 'items': [], 'buckets': {}})
+        org['items'].append(item)
+
+        bucket = int(parse_timestamp(item[4]).timestamp() // bucket_seconds * bucket_seconds)
+        org['buckets'].setdefault(bucket, []).append(item)
+
+    organizations = []
+    for org_id, org in orgs.items():
+        buckets = [dict(summarize(items), start=datetime.fromtimestamp(bucket, timezone.utc).isoformat())
+                   for bucket, items in sorted(org['buckets'].items())]
+        organizations.append({'org_id': org_id, 'org_name': org['org_name'], 'total': summarize(org['items']),
+                              'buckets': buckets})
+
+    runs = [{'run_id': run[0], 'source': run[1], 'started_at': run[2], 'ended_at': run[3], 'status': run[4]}
+            for run in db.query_runs(conn, since)]
+
+    return {'since': since, 'bucket_seconds': bucket_seconds, 'runs': runs, 'organizations': organizations}
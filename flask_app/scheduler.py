@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import heapq
+import json
+import random
+import signal
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import config
+import dashboard_client
+import periodic_enforcement
+import setting_handlers
+from periodic_enforcement import logger
+
+# Scheduler settings (see config.py, defaults match the weekly crontab.txt entry)
+DEFAULT_INTERVAL = getattr(config, 'enforcement_interval_seconds', 7 * 24 * 60 * 60)
+JITTER = getattr(config, 'enforcement_jitter_seconds', 60 * 60)
+ORG_INTERVALS = getattr(config, 'org_enforcement_intervals', {})
+ORG_REFRESH_INTERVAL = getattr(config, 'scheduler_org_refresh_seconds', 60 * 60)
+MAX_CONCURRENT_ORGS = getattr(config, 'scheduler_max_concurrent_orgs', 2)
+HEALTH_PORT = getattr(config, 'scheduler_health_port', 8081)
+
+# Health check fails if the scheduling loop hasn't ticked within this many seconds
+HEARTBEAT_TIMEOUT = 120
+
+
+class EnforcementScheduler:
+    """
+    Resident scheduler which enforces each organization on its own interval (with jitter to spread API load), reusing
+    the same process, Dashboard sessions and HTTP connection pools for every run.
+    """
+
+    def __init__(self):
+        self.started_at = datetime.now()
+        self.last_tick = time.monotonic()
+        self.last_org_refresh = None
+        self.orgs = {}
+        self.org_status = {}
+        self.running = set()
+        self.next_runs = {}
+        self.queue = []
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_ORGS)
+
+    def org_interval(self, org_id):
+        """
+        Return the enforcement interval (seconds) for an organization (per org override, or the default interval)
+        :param org_id: Organization ID
+        """
+        return ORG_INTERVALS.get(org_id, DEFAULT_INTERVAL)
+
+    def next_run_time(self, org_id, first_run=False):
+        """
+        Calculate the next (monotonic) run time for an organization, applying random jitter
+        :param org_id: Organization ID
+        :param first_run: Spread the first run of each org over the jitter window instead of a full interval
+        """
+        if first_run:
+            return time.monotonic() + random.uniform(0, JITTER)
+
+        return time.monotonic() + self.org_interval(org_id) + random.uniform(-JITTER, JITTER)
+
+    def schedule(self, org_id, first_run=False):
+        """
+        Push the next run of an organization onto the queue (caller must hold the lock)
+        :param org_id: Organization ID
+        :param first_run: See next_run_time()
+        """
+        run_at = self.next_run_time(org_id, first_run)
+        self.next_runs[org_id] = run_at
+        heapq.heappush(self.queue, (run_at, org_id))
+
+    def refresh_orgs(self):
+        """
+        Refresh the list of organizations, scheduling newly discovered orgs and dropping removed ones
+        """
+        try:
+            orgs = dashboard_client.get_dashboard().organizations.getOrganizations()
+        except Exception as e:
+            logger.error(f"Error retrieving organizations: {e}")
+            return
+
+        with self.lock:
+            current_ids = {org['id'] for org in orgs}
+
+            for org in orgs:
+                if org['id'] not in self.orgs:
+                    self.schedule(org['id'], first_run=True)
+                    self.org_status[org['id']] = {'name': org['name'], 'last_run': None, 'last_status': None,
+                                                  'last_duration': None}
+                self.orgs[org['id']] = org
+
+            # Removed orgs are discarded lazily when popped from the queue
+            for org_id in list(self.orgs):
+                if org_id not in current_ids:
+                    del self.orgs[org_id]
+                    self.org_status.pop(org_id, None)
+                    self.next_runs.pop(org_id, None)
+
+        self.last_org_refresh = time.monotonic()
+        logger.info(f"Scheduler tracking {len(self.orgs)} organization(s)")
+
+    def run_org(self, org_id):
+        """
+        Enforce a single organization (executed in the worker pool), then reschedule it
+        :param org_id: Organization ID
+        """
+        org = self.orgs.get(org_id)
+        start = time.monotonic()
+        status = 'Success'
+
+        try:
+            if org:
+                periodic_enforcement.enforce_organization(org)
+        except Exception as e:
+            logger.error(f"Scheduled sync failed for organization ID {org_id}: {e}")
+            status = f'Failure: {e}'
+
+        with self.lock:
+            self.running.discard(org_id)
+
+            if org_id in self.org_status:
+                self.org_status[org_id].update({'last_run': datetime.now().isoformat(timespec='seconds'),
+                                                'last_status': status,
+                                                'last_duration': round(time.monotonic() - start, 1)})
+
+            if org_id in self.orgs:
+                self.schedule(org_id)
+
+    def tick(self):
+        """
+        Dispatch every organization whose next run time has passed
+        """
+        now = time.monotonic()
+        self.last_tick = now
+
+        if self.last_org_refresh is None or now - self.last_org_refresh >= ORG_REFRESH_INTERVAL:
+            self.refresh_orgs()
+
+        with self.lock:
+            while self.queue and self.queue[0][0] <= now:
+                run_at, org_id = heapq.heappop(self.queue)
+
+                # Stale entry (org removed or rescheduled since), or a previous run is still in progress
+                if self.next_runs.get(org_id) != run_at or org_id in self.running:
+                    continue
+
+                self.running.add(org_id)
+                self.executor.submit(self.run_org, org_id)
+
+    def run_forever(self):
+        """
+        Main scheduling loop (runs until stop() is called)
+        """
+        logger.info(f"Starting enforcement scheduler (default interval: {DEFAULT_INTERVAL}s, jitter: {JITTER}s)")
+
+        while not self.stop_event.is_set():
+            self.tick()
+
+            # Sleep until the next org is due (bounded, so the heartbeat and org refresh stay current)
+            with self.lock:
+                wait = self.queue[0][0] - time.monotonic() if self.queue else HEARTBEAT_TIMEOUT / 4
+            self.stop_event.wait(min(max(wait, 1), HEARTBEAT_TIMEOUT / 4))
+
+        logger.info("Stopping enforcement scheduler, waiting for running syncs to finish")
+        self.executor.shutdown(wait=True)
+
+        # Hand the network job queue over to another process (ex: the web app)
+        periodic_enforcement.job_runner.stop()
+
+    def stop(self, *args):
+        """
+        Stop the scheduling loop (also used as the SIGTERM/SIGINT handler)
+        """
+        self.stop_event.set()
+
+    def health(self):
+        """
+        Return a tuple of (healthy, status dictionary) describing the scheduler state
+        """
+        now = time.monotonic()
+        healthy = now - self.last_tick < HEARTBEAT_TIMEOUT
+        job_queue_stats = periodic_enforcement.job_runner.stats()
+
+        with self.lock:
+            upcoming = {org_id: round(run_at - now) for org_id, run_at in self.next_runs.items()}
+            status = {
+                'status': 'ok' if healthy else 'stalled',
+                'started_at': self.started_at.isoformat(timespec='seconds'),
+                'seconds_since_tick': round(now - self.last_tick, 1),
+                'running': sorted(self.running),
+                'api_concurrency': setting_handlers.api_calls.stats(),
+                'job_queue': job_queue_stats,
+                'organizations': {org_id: dict(org_status, next_run_in=upcoming.get(org_id))
+                                  for org_id, org_status in self.org_status.items()}
+            }
+
+        return healthy, status
+
+
+def start_health_server(scheduler, port):
+    """
+    Serve the scheduler health status as JSON (GET /health) on a background thread
+    :param scheduler: EnforcementScheduler instance
+    :param port: Port to listen on
+    """
+
+    class HealthHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.rstrip('/') != '/health':
+                self.send_error(404)
+                return
+
+            healthy, status = scheduler.health()
+            body = json.dumps(status).encode('utf-8')
+
+            self.send_response(200 if healthy else 503)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            # Health probes are frequent, don't flood cron/scheduler logs
+            pass
+
+    server = ThreadingHTTPServer(('0.0.0.0', port), HealthHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    logger.info(f"Scheduler health endpoint listening on port {port} (GET /health)")
+
+    return server
+
+
+def main():
+    """
+    Start the resident enforcement scheduler and its health endpoint
+    """
+    periodic_enforcement.setup_logging()
+
+    scheduler = EnforcementScheduler()
+    signal.signal(signal.SIGTERM, scheduler.stop)
+    signal.signal(signal.SIGINT, scheduler.stop)
+
+    server = start_health_server(scheduler, HEALTH_PORT)
+    scheduler.run_forever()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+
+logger = logging.getLogger('my_logger')
+
+# Dashboard API calls in flight at the same time (fetches and pushes of every network, weighted by the handlers' rate
+# cost), adjusted while running: the limit starts at api_call_budget, grows by one for each limit's worth of calls
+# completed without throttling (additive increase), and is multiplied by api_call_budget_decrease when the Dashboard
+# answers 429 or when call latency rises above api_call_latency_factor x its baseline (multiplicative decrease)
+API_CALL_BUDGET = getattr(config, 'api_call_budget', 10)
+API_CALL_BUDGET_MIN = getattr(config, 'api_call_budget_min', 1)
+API_CALL_BUDGET_MAX = getattr(config, 'api_call_budget_max', 50)
+API_CALL_BUDGET_DECREASE = getattr(config, 'api_call_budget_decrease', 0.5)
+API_CALL_LATENCY_FACTOR = getattr(config, 'api_call_latency_factor', 3)
+
+# Threads running the settings of a network concurrently (shared by every network)
+SETTING_WORKERS = getattr(config, 'setting_workers', 32)
+
+
+class SettingHandler:
+    """
+    One security setting (template section): how to read it from a network, reduce it to comparable fields, build the
+    update payload from a template and push it (fetch takes fresh=True to skip the read cache, see dashboard_cache.py).
+    rate_cost is the number of Dashboard API calls a fetch or a push makes, change_log_keywords match the org change log
+    entries (page or label) a push of the setting creates.
+    """
+
+    def __init__(self, name, label, fetch, build_payload, push, normalize=None, rate_cost=1,
+                 change_log_keywords=('firewall',)):
+        self.name = name
+        self.label = label
+        self.fetch = fetch
+        self.build_payload = build_payload
+        self.push = push
+        self.normalize = normalize or normalize_rules
+        self.rate_cost = rate_cost
+        self.change_log_keywords = change_log_keywords
+
+    def enabled(self):
+        """
+        Check if the setting is tracked (config.tracked_settings)
+        """
+        return bool(config.tracked_settings.get(self.name))
+
+
+class CostLimiter:
+    """
+    Counting limiter of in-flight API calls: a handler waits until its whole rate cost is available (taken at once, so
+    two handlers can't each hold part of the budget and wait on each other)
+    """
+
+    def __init__(self, budget):
+        self.budget = budget
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, cost):
+        """
+        Wait until a rate cost is available and take it
+        :param cost: Number of API calls
+        :return: Cost taken (pass it to release())
+        """
+        with self.condition:
+            # The budget may change while waiting (see AdaptiveLimiter)
+            while self.in_flight + min(cost, self.budget) > self.budget:
+                self.condition.wait()
+            cost = min(cost, self.budget)
+            self.in_flight += cost
+            self.acquired(cost)
+        return cost
+
+    def release(self, cost):
+        """
+        Return a rate cost taken by acquire()
+        :param cost: Cost taken
+        """
+        with self.condition:
+            self.released(cost)
+            self.in_flight -= cost
+            self.condition.notify_all()
+
+    def acquired(self, cost):
+        """
+        Called with the condition held once a cost is taken
+        """
+
+    def released(self, cost):
+        """
+        Called with the condition held before a cost is returned
+        """
+
+
+class AdaptiveLimiter(CostLimiter):
+    """
+    CostLimiter whose budget adjusts itself with additive increase / multiplicative decrease (AIMD), so throughput
+    stays near the Dashboard's rate limit without tuning: 429 responses (see record_response()) and rising latency
+    shrink the budget, calls completed at the limit without throttling grow it. Fetches and pushes acquire and release
+    on the same thread, so each call's latency and 429s are attributed to it.
+    """
+
+    def __init__(self, budget, minimum, maximum, decrease, latency_factor):
+        super().__init__(max(minimum, min(budget, maximum)))
+        self.limit = float(self.budget)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+
+        # Smoothed call latency and its baseline (lowest smoothed latency seen, slowly following increases)
+        self.latency = None
+        self.baseline = None
+
+        self.rate_limited = 0
+        self.decreases = 0
+        self.last_decrease = 0
+        self.local = threading.local()
+
+    def acquired(self, cost):
+        self.local.started = time.monotonic()
+        self.local.throttled = False
+        self.local.at_limit = self.in_flight >= self.budget
+
+    def released(self, cost):
+        elapsed = (time.monotonic() - self.local.started) / cost
+        if self.local.throttled:
+            # Already decreased when the 429 was received, and the latency includes the Retry-After wait
+            return
+
+        self.latency = elapsed if self.latency is None else self.latency * 0.9 + elapsed * 0.1
+        if self.baseline is None or self.latency < self.baseline:
+            self.baseline = self.latency
+        else:
+            self.baseline += (self.latency - self.baseline) * 0.01
+
+        if self.latency > self.baseline * self.latency_factor:
+            self.reduce('latency above baseline')
+        elif self.local.at_limit:
+            # Only grow when the limit was actually reached (an idle limit says nothing about the Dashboard)
+            self.resize(min(self.limit + cost / self.limit, self.maximum), 'no throttling')
+
+    def throttled(self):
+        """
+        Record a 429 response received on the current thread
+        """
+        with self.condition:
+            self.rate_limited += 1
+            self.local.throttled = True
+            self.reduce('rate limited (429)')
+
+    def reduce(self, reason):
+        """
+        Multiplicative decrease, at most once per smoothed call latency (a burst of 429s from calls already in flight
+        counts once)
+        """
+        now = time.monotonic()
+        if now - self.last_decrease < max(self.latency or 0, 1):
+            return
+
+        self.last_decrease = now
+        self.decreases += 1
+        self.resize(max(self.limit * self.decrease, self.minimum), reason)
+
+    def resize(self, limit, reason):
+        """
+        Set the limit (condition held), logging changes of the whole number of calls allowed (decreases at info level,
+        the steady increases in between at debug level)
+        """
+        previous = self.budget
+        self.limit = limit
+        self.budget = int(limit)
+
+        if self.budget != previous:
+            logger.log(logging.INFO if self.budget < previous else logging.DEBUG,
+                       f"API call concurrency limit {previous} -> {self.budget} ({reason})")
+            self.condition.notify_all()
+
+    def stats(self):
+        """
+        Current limit and the signals driving it (see /api/run_stats and the scheduler health endpoint)
+        """
+        with self.condition:
+            return {'limit': self.budget, 'in_flight': self.in_flight, 'minimum': self.minimum,
+                    'maximum': self.maximum, 'rate_limited': self.rate_limited, 'decreases': self.decreases,
+                    'latency_ms': round(self.latency * 1000, 1) if self.latency is not None else None,
+                    'baseline_latency_ms': round(self.baseline * 1000, 1) if self.baseline is not None else None}
+
+
+# Shared by every fetch and push in this process (threads are started on first use)
+api_calls = AdaptiveLimiter(API_CALL_BUDGET, API_CALL_BUDGET_MIN, API_CALL_BUDGET_MAX, API_CALL_BUDGET_DECREASE,
+                            API_CALL_LATENCY_FACTOR)
+_executor = ThreadPoolExecutor(max_workers=SETTING_WORKERS, thread_name_prefix='setting')
+
+
+def record_response(response, *args, **kwargs):
+    """
+    requests response hook (see dashboard_client.py), lowers the API call limit when the Dashboard rate limits a call
+    :param response: requests Response
+    """
+    if response.status_code == 429:
+        api_calls.throttled()
+
+
+# Template section name -> handler, in registration order (the order settings are shown and downloaded)
+HANDLERS = {}
+
+
+def register(handler):
+    """
+    Add a setting handler to the registry
+    :param handler: SettingHandler
+    """
+    HANDLERS[handler.name] = handler
+    return handler
+
+
+def enabled_handlers():
+    """
+    Return the handlers of every tracked setting, in registration order
+    """
+    return [handler for handler in HANDLERS.values() if handler.enabled()]
+
+
+def run_concurrently(function, handlers):
+    """
+    Call a function for each handler at the same time (the first one on the calling thread), so a network's latency
+    is that of its slowest setting rather than the sum of every setting
+    :param function: Callable taking a handler
+    :param handlers: List of handlers
+    :return: List of results, in handler order
+    """
+    if not handlers:
+        return []
+
+    futures = [_executor.submit(function, handler) for handler in handlers[1:]]
+    results = [function(handlers[0])]
+
+    return results + [future.result() for future in futures]
+
+
+def dump_items(fields):
+    """
+    Convert each field's items to json strings (order is kept, rule order matters)
+    :param fields: Dictionary of field -> list of items
+    """
+    return {field: [json.dumps(item, sort_keys=True) for item in items] for field, items in fields.items()}
+
+
+def normalize_rules(setting_config):
+    """
+    Reduce a rule list setting to the rules upload() sends, as comparable json strings
+    :param setting_config: Setting config (from a template or from the Meraki API)
+    """
+    return dump_items({'rules': setting_config.get('rules') or []})
+
+
+def without_default_rule(response):
+    """
+    Remove the default (any any any) rule the Dashboard appends to firewall rule lists
+    :param response: Meraki API response
+    """
+    return {'rules': [rule for rule in response['rules'] if rule.get('comment') != "Default rule"]}
+
+
+def rules_payload(setting_config):
+    """
+    Build the update payload of a rule list setting
+    :param setting_config: Setting config from a template
+    """
+    return {'rules': setting_config['rules']}
+
+
+# L3 Outbound Rules
+register(SettingHandler(
+    'mx_l3_outbound_firewall', 'L3 Outbound Rules',
+    fetch=lambda dashboard, net_id, fresh=False: without_default_rule(
+        dashboard.appliance.getNetworkApplianceFirewallL3FirewallRules(net_id, fresh=fresh)),
+    build_payload=rules_payload,
+    push=lambda dashboard, net_id, payload: dashboard.appliance.updateNetworkApplianceFirewallL3FirewallRules(
+        net_id, **payload)))
+
+# L7 Rules
+register(SettingHandler(
+    'mx_l7_firewall', 'L7 Rules',
+    fetch=lambda dashboard, net_id, fresh=False: dashboard.appliance.getNetworkApplianceFirewallL7FirewallRules(
+        net_id, fresh=fresh),
+    build_payload=rules_payload,
+    push=lambda dashboard, net_id, payload: dashboard.appliance.updateNetworkApplianceFirewallL7FirewallRules(
+        net_id, **payload),
+    change_log_keywords=('firewall', 'layer 7')))
+
+
+def content_rules_payload(setting_config):
+    """
+    Build the content filtering update payload (the API takes category ids, templates hold category objects)
+    :param setting_config: Setting config from a template
+    """
+    return {'allowedUrlPatterns': setting_config['allowedUrlPatterns'],
+            'blockedUrlPatterns': setting_config['blockedUrlPatterns'],
+            'blockedUrlCategories': [category['id'] for category in setting_config['blockedUrlCategories']]}
+
+
+def normalize_content_rules(setting_config):
+    """
+    Reduce content filtering to the fields upload() sends (category ids only), as comparable json strings
+    :param setting_config: Setting config (from a template or from the Meraki API)
+    """
+    return dump_items({'allowedUrlPatterns': setting_config.get('allowedUrlPatterns') or [],
+                       'blockedUrlPatterns': setting_config.get('blockedUrlPatterns') or [],
+                       'blockedUrlCategories': [item['id'] if isinstance(item, dict) else item for item in
+                                                setting_config.get('blockedUrlCategories') or []]})
+
+
+# Content Filtering Rules (URL, Category)
+register(SettingHandler(
+    'mx_content_rules', 'Content Rules',
+    fetch=lambda dashboard, net_id, fresh=False: dashboard.appliance.getNetworkApplianceContentFiltering(
+        net_id, fresh=fresh),
+    build_payload=content_rules_payload,
+    push=lambda dashboard, net_id, payload: dashboard.appliance.updateNetworkApplianceContentFiltering(
+        net_id, **payload),
+    normalize=normalize_content_rules,
+    change_log_keywords=('content filtering',)))
+
+# L3 Inbound Rules (not tracked unless enabled in config.tracked_settings)
+register(SettingHandler(
+    'mx_l3_inbound_firewall', 'L3 Inbound Rules',
+    fetch=lambda dashboard, net_id, fresh=False: without_default_rule(
+        dashboard.appliance.getNetworkApplianceFirewallInboundFirewallRules(net_id, fresh=fresh)),
+    build_payload=rules_payload,
+    push=lambda dashboard, net_id, payload: dashboard.appliance.updateNetworkApplianceFirewallInboundFirewallRules(
+        net_id, **payload)))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import config
+from mx_config import build_template, folder_path, template_version
+
+logger = logging.getLogger('my_logger')
+
+# Number of template files read and validated at the same time
+VALIDATION_WORKERS = getattr(config, 'validation_workers', 4)
+
+# Expected structure of each template section (the fields upload() sends to the Meraki API). A dict is an object with
+# required keys, a single item list is a list of that item, a set is an allowed value, a type (or tuple of types) is
+# the expected type. Keys are only required in the config a network receives (baseline and exception combined): an
+# exception template may hold only the keys it adds to the baseline.
+SETTING_SCHEMAS = {
+    'mx_l3_outbound_firewall': {
+        'rules': [{'policy': {'allow', 'deny'}, 'protocol': str, 'destCidr': str}]
+    },
+    'mx_l7_firewall': {
+        'rules': [{'policy': {'deny'}, 'type': str, 'value': (str, dict)}]
+    },
+    'mx_content_rules': {
+        'allowedUrlPatterns': [str],
+        'blockedUrlPatterns': [str],
+        'blockedUrlCategories': [{'id': str}]
+    },
+    'mx_l3_inbound_firewall': {
+        'rules': [{'policy': {'allow', 'deny'}, 'protocol': str, 'destCidr': str}]
+    }
+}
+
+# Validation results by file content hash (sha256 -> list of errors), a file is only re-validated when it changes,
+# and by assignment pair and file versions (combined configs)
+_results = {}
+_pair_results = {}
+_lock = threading.Lock()
+
+
+def check(value, schema, path, errors, required=True):
+    """
+    Recursively check a value against a schema (see SETTING_SCHEMAS), appending any problems to errors
+    :param value: Value from the template
+    :param schema: Expected structure
+    :param path: Location of the value in the template (used in error messages)
+    :param errors: List of error messages
+    :param required: Report missing keys (False: only check the structure and types of the keys present)
+    """
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            errors.append(f"{path}: expected an object")
+            return
+        for key, key_schema in schema.items():
+            if key in value:
+                check(value[key], key_schema, f"{path}.{key}", errors, required)
+            elif required:
+                errors.append(f"{path}: missing '{key}'")
+    elif isinstance(schema, list):
+        # Lists are tuples in shared (frozen) templates, see mx_config.freeze()
+        if not isinstance(value, (list, tuple)):
+            errors.append(f"{path}: expected a list")
+            return
+        for index, item in enumerate(value):
+            check(item, schema[0], f"{path}[{index}]", errors, required)
+    elif isinstance(schema, set):
+        if value not in schema:
+            errors.append(f"{path}: expected one of {sorted(schema)}, found {value!r}")
+    elif not isinstance(value, schema):
+        errors.append(f"{path}: unexpected type {type(value).__name__}")
+
+
+def validate_config(template, required=True):
+    """
+    Validate a template config, only the sections tracked in config.tracked_settings are checked
+    :param template: Template config (parsed json)
+    :param required: Report missing keys (False for a single template file, see validate_pair())
+    :return: List of errors (empty if the template is valid)
+    """
+    if not isinstance(template, dict):
+        return ["template must be a json object"]
+
+    errors = []
+    for setting, setting_config in template.items():
+        if config.tracked_settings.get(setting) and setting in SETTING_SCHEMAS:
+            check(setting_config, SETTING_SCHEMAS[setting], setting, errors, required)
+
+    return errors
+
+
+def validate_file(file_name):
+    """
+    Validate the structure and types of a template file in mx_configs, keys are optional (results are cached by file
+    content)
+    :param file_name: Template filename
+    :return: List of errors (empty if the template is valid)
+    """
+    try:
+        with open(os.path.join(folder_path, file_name), 'rb') as fp:
+            content = fp.read()
+    except OSError as e:
+        return [str(e)]
+
+    digest = hashlib.sha256(content).hexdigest()
+    with _lock:
+        if digest in _results:
+            return _results[digest]
+
+    try:
+        errors = validate_config(json.loads(content), required=False)
+    except ValueError as e:
+        errors = [f"invalid json: {e}"]
+
+    with _lock:
+        _results[digest] = errors
+
+    return errors
+
+
+def validate_files(file_names):
+    """
+    Validate several template files in parallel (run once before any network is scheduled, so a malformed template
+    is reported once instead of failing every network it's assigned to)
+    :param file_names: Template filenames ("None" and duplicates are ignored)
+    :return: Dictionary of invalid file name -> list of errors
+    """
+    file_names = sorted({name for name in file_names if name and name != "None"})
+
+    with ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as executor:
+        results = dict(zip(file_names, executor.map(validate_file, file_names)))
+
+    invalid_files = {name: errors for name, errors in results.items() if errors}
+    for name, errors in invalid_files.items():
+        logger.error(f"Template {name} is invalid, networks using it will be skipped: {'; '.join(errors[:5])}")
+
+    return invalid_files
+
+
+def validate_pair(baseline_file_name, exception_file_name):
+    """
+    Check the config a network receives (its baseline and exception templates combined, see
+    mx_config.build_template()) has every required key (results are cached by file versions)
+    :param baseline_file_name: Base template file name (or "None")
+    :param exception_file_name: Exception Template file name (or "None")
+    :return: List of errors (empty if the combined config is valid)
+    """
+    try:
+        key = tuple((name, template_version(name) if name != "None" else None)
+                    for name in (baseline_file_name, exception_file_name))
+    except OSError as e:
+        return [str(e)]
+
+    with _lock:
+        if key in _pair_results:
+            return _pair_results[key]
+
+    template = build_template(baseline_file_name, exception_file_name)
+    errors = [template] if isinstance(template, str) else validate_config(template)
+
+    with _lock:
+        _pair_results[key] = errors
+
+    return errors
+
+
+def validate_pairs(pairs, skip_files=()):
+    """
+    Validate the combined config of several assignment pairs in parallel (run once before any network is scheduled,
+    like validate_files())
+    :param pairs: (baseline file name, exception file name) tuples (None or "None" if unassigned, duplicates and pairs
+    without any template are ignored)
+    :param skip_files: Template files already reported (invalid or missing), pairs using them are ignored
+    :return: Dictionary of invalid (baseline file name, exception file name) -> list of errors
+    """
+    pairs = sorted({(baseline or "None", exception or "None") for baseline, exception in pairs})
+    pairs = [pair for pair in pairs if pair != ("None", "None") and not set(pair) & set(skip_files)]
+
+    with ThreadPoolExecutor(max_workers=VALIDATION_WORKERS) as executor:
+        results = dict(zip(pairs, executor.map(lambda pair: validate_pair(*pair), pairs)))
+
+    invalid_pairs = {pair: errors for pair, errors in results.items() if errors}
+    for (baseline, exception), errors in invalid_pairs.items():
+        logger.error(f"Templates {baseline} + {exception} are incomplete once combined, networks using them will be "
+                     f"skipped: {'; '.join(errors[:5])}")
+
+    return invalid_pairs
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import hashlib
+import hmac
+import json
+from datetime import datetime, timedelta, timezone
+
+import db
+import job_queue
+
+
+def verify_shared_secret(payload, shared_secret):
+    """
+    Check the shared secret included in a Meraki webhook payload (constant time comparison)
+    :param payload: Webhook JSON payload
+    :param shared_secret: Expected shared secret (webhooks are rejected if no secret is configured)
+    :return: True if the secret matches
+    """
+    if not shared_secret:
+        return False
+
+    received = payload.get('sharedSecret') or ''
+    return hmac.compare_digest(str(received).encode('utf-8'), shared_secret.encode('utf-8'))
+
+
+def alert_key(payload):
+    """
+    Return a key uniquely identifying a webhook alert (Meraki retries deliveries, so the same alert can arrive twice)
+    :param payload: Webhook JSON payload
+    """
+    if payload.get('alertId'):
+        return payload['alertId']
+
+    # No alert ID, fall back to a hash of the fields that identify the event
+    fields = [payload.get('networkId'), payload.get('alertTypeId'), payload.get('occurredAt'),
+              json.dumps(payload.get('alertData'), sort_keys=True)]
+    return hashlib.sha256(json.dumps(fields).encode('utf-8')).hexdigest()
+
+
+class AlertDeduplicator:
+    """
+    Remember recently seen webhook alerts in the DB for a limited time, so duplicate deliveries are ignored (whichever
+    web worker receives them)
+    """
+
+    def __init__(self, db_file, ttl):
+        self.db_file = db_file
+        self.ttl = ttl
+
+    def is_duplicate(self, key):
+        """
+        Record an alert key, returning True if it was already seen within the TTL
+        :param key: Alert key (see alert_key())
+        """
+        now = datetime.now(timezone.utc)
+        keep_since = (now - timedelta(seconds=self.ttl)).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+        return not db.add_webhook_alert(db.get_connection(self.db_file), key, now.strftime('%Y-%m-%dT%H:%M:%SZ'),
+                                        keep_since)
+
+
+class WebhookEnforcer:
+    """
+    Queue networks for re-enforcement after a configuration change alert. Networks go through the shared network job
+    queue (see job_queue.py), ahead of routine enforcement, so a webhook upload never races a deploy or an enforcement
+    run on the same network.
+    """
+
+    def __init__(self, jobs, logger, cooldown):
+        self.jobs = jobs
+        self.logger = logger
+        # Networks uploaded within the cooldown are ignored (our own upload triggers a settings change alert too).
+        # Upload times are read from the DB, so uploads by any path (deploys, enforcement, webhooks, the CLI) and any
+        # process count.
+        self.cooldown = cooldown
+
+    def enqueue(self, org_id, net_id):
+        """
+        Queue a network for enforcement, ignoring networks being uploaded or uploaded within the cooldown (a network
+        already waiting in the job queue isn't queued twice)
+        :param org_id: Organization ID
+        :param net_id: Network ID
+        :return: True if the network was queued
+        """
+        since = (datetime.now(timezone.utc) - timedelta(seconds=self.cooldown)).strftime('%Y-%m-%dT%H:%M:%SZ')
+        if db.network_recently_uploaded(db.get_connection(self.jobs.db_file), net_id, since):
+            self.logger.info(f"Ignoring webhook for network {net_id}, enforced within the last {self.cooldown}s")
+            return False
+
+        # The network name is read when the job runs
+        self.jobs.enqueue([(org_id, net_id, None)], job_queue.PRIORITY_DRIFT, 'webhook')
+        return True
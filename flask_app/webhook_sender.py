@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import argparse
+import os
+import uuid
+from datetime import datetime, timezone
+
+import requests
+from dotenv import load_dotenv
+
+# Load in Environment Variables
+load_dotenv()
+
+
+def build_payload(shared_secret, org_id, net_id, alert_id):
+    """
+    Build a sample Meraki 'Settings changed' webhook payload
+    :param shared_secret: Webhook shared secret
+    :param org_id: Organization ID
+    :param net_id: Network ID
+    :param alert_id: Alert ID (reuse the same ID to test duplicate handling)
+    """
+    now = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+    return {
+        'version': '0.1',
+        'sharedSecret': shared_secret,
+        'sentAt': now,
+        'organizationId': org_id,
+        'organizationName': 'Test Organization',
+        'networkId': net_id,
+        'networkName': 'Test Network',
+        'alertId': alert_id,
+        'alertType': 'Settings changed',
+        'alertTypeId': 'settings_changed',
+        'alertLevel': 'informational',
+        'occurredAt': now,
+        'alertData': {'name': 'Security & SD-WAN', 'changes': {}}
+    }
+
+
+def main():
+    """
+    Send a sample configuration change webhook to a locally running app (python webhook_sender.py -h for options)
+    """
+    parser = argparse.ArgumentParser(description='Send a test Meraki configuration change webhook')
+    parser.add_argument('--url', default='http://127.0.0.1:5000/webhook', help='Webhook receiver URL')
+    parser.add_argument('--secret', default=os.getenv('MERAKI_WEBHOOK_SECRET', ''), help='Shared secret')
+    parser.add_argument('--org', required=True, help='Organization ID')
+    parser.add_argument('--network', required=True, help='Network ID')
+    parser.add_argument('--alert-id', default=None, help='Alert ID (default: random)')
+    parser.add_argument('--count', type=int, default=1, help='Number of times to send the same alert')
+    args = parser.parse_args()
+
+    payload = build_payload(args.secret, args.org, args.network, args.alert_id or uuid.uuid4().hex)
+
+    for _ in range(args.count):
+        response = requests.post(args.url, json=payload)
+        print(f"{response.status_code}: {response.text.strip()}")
+
+
+if __name__ == "__main__":
+    main()
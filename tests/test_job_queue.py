@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""
+Copyright (c) 2023 Cisco and/or its affiliates.
+This software is licensed to you under the terms of the Cisco Sample
+Code License, Version 1.1 (the "License"). You may obtain a copy of the
+License at
+https://developer.cisco.com/docs/licenses
+All use of the material herein must be in accordance with the terms of
+the License. All rights not expressly granted by the License are
+reserved. Unless required by applicable law or agreed to separately in
+writing, software distributed under the License is distributed on an "AS
+IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express
+or implied.
+"""
+
+__author__ = "Trevor Maco <tmaco@cisco.com>"
+__copyright__ = "Copyright (c) 2023 Cisco and/or its affiliates."
+__license__ = "Cisco Sample Code License, Version 1.1"
+
+import os
+import sys
+
+import pytest
+
+# The app modules are flat in flask_app/ (run as scripts)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'flask_app'))
+
+import db  # noqa: E402
+
+# Priorities (see job_queue.PRIORITY_*, not imported: job_queue reads config.py)
+MANUAL, DRIFT, ROUTINE = 0, 1, 2
+
+NOW = '2023-01-01T00:00:00Z'
+
+
+@pytest.fixture
+def conn(tmp_path):
+    """
+    Connection to an empty DB in a temporary SQLite file
+    """
+    connection = db.create_connection(str(tmp_path / 'sqlite.db'))
+    db.create_tables(connection)
+    yield connection
+    connection.close()
+
+
+def jobs(conn):
+    """
+    Return every job as (net_id, source, priority, status, owner) rows, in job ID order
+    """
+    return conn.execute("SELECT net_id, source, priority, status, owner FROM network_jobs ORDER BY job_id").fetchall()
+
+
+def test_enqueue_keeps_one_queued_job_with_the_best_priority(conn):
+    db.enqueue_jobs(conn, 'periodic-run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+    db.enqueue_jobs(conn, 'deploy', 'web', [('N1', 'O1', 'net1', MANUAL, 0)], NOW)
+    db.enqueue_jobs(conn, 'scheduled-run', 'scheduler', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+
+    assert jobs(conn) == [('N1', 'web', MANUAL, 'queued', None)]
+
+    # Every batch waits on the single job
+    job_ids = {batch_id: [job.job_id for job in db.query_batch_jobs(conn, batch_id)]
+               for batch_id in ('periodic-run', 'deploy', 'scheduled-run')}
+    assert len(set(sum(job_ids.values(), []))) == 1
+    assert all(len(ids) == 1 for ids in job_ids.values())
+
+
+def test_enqueue_without_batch(conn):
+    db.enqueue_jobs(conn, None, 'webhook', [('N1', 'O1', None, DRIFT, 0)], NOW)
+
+    assert jobs(conn) == [('N1', 'webhook', DRIFT, 'queued', None)]
+    assert conn.execute("SELECT count(*) FROM network_job_batches").fetchone()[0] == 0
+
+
+def test_claim_order(conn):
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0), ('N2', 'O1', 'net2', ROUTINE, 1),
+                                              ('N3', 'O2', 'net3', ROUTINE, 0)], NOW)
+    db.enqueue_jobs(conn, 'deploy', 'web', [('N4', 'O1', 'net4', MANUAL, 0)], NOW)
+
+    claimed = [db.claim_job(conn, f"p/{index}", NOW).net_id for index in range(4)]
+
+    # Priority first, then round-robin turn, then enqueue order
+    assert claimed == ['N4', 'N1', 'N3', 'N2']
+    assert db.claim_job(conn, 'p/4', NOW) is None
+
+
+def test_claim_skips_network_already_running(conn):
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+    running = db.claim_job(conn, 'p/0', NOW)
+    assert running.net_id == 'N1'
+
+    # Queued again while running: a second job, never run alongside the first one
+    db.enqueue_jobs(conn, 'deploy', 'web', [('N1', 'O1', 'net1', MANUAL, 0)], NOW)
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N2', 'O1', 'net2', ROUTINE, 0)], NOW)
+
+    assert db.claim_job(conn, 'p/1', NOW).net_id == 'N2'
+    assert db.claim_job(conn, 'p/2', NOW) is None
+
+    assert jobs(conn)[0] == ('N1', 'periodic', ROUTINE, 'running', 'p/0')
+
+    assert db.finish_job(conn, running.job_id, 'p/0', NOW, [], 0)
+    job = db.claim_job(conn, 'p/2', NOW)
+    assert (job.net_id, job.source, job.priority) == ('N1', 'web', MANUAL)
+
+
+def test_requeue_orphaned_jobs(conn):
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+    db.enqueue_jobs(conn, 'deploy', 'web', [('N2', 'O1', 'net2', MANUAL, 0)], NOW)
+    assert db.claim_job(conn, 'old/0', NOW).net_id == 'N2'
+    assert db.claim_job(conn, 'old/1', NOW).net_id == 'N1'
+    assert db.claim_job(conn, 'new/0', NOW) is None
+
+    # N2 queued again (routine) while its orphaned manual job was running
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N2', 'O1', 'net2', ROUTINE, 0)], NOW)
+
+    assert db.requeue_orphaned_jobs(conn, 'new') == 1
+
+    # N1's orphan is queued again, N2's is dropped for the queued job, which takes the orphan's better priority
+    assert sorted((net_id, priority, status, owner) for net_id, _, priority, status, owner in jobs(conn)) == [
+        ('N1', ROUTINE, 'queued', None), ('N2', MANUAL, 'queued', None)]
+
+    # The deploy now waits on N2's queued job, the run waits on both networks
+    assert [job.status for job in db.query_batch_jobs(conn, 'deploy')] == ['queued']
+    assert sorted(job.net_id for job in db.query_batch_jobs(conn, 'run')) == ['N1', 'N2']
+
+
+def test_stale_finish_is_dropped(conn):
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+    orphan = db.claim_job(conn, 'old/0', NOW)
+
+    # The lease changed hands during the upload: the new holder queues the job again and claims it
+    db.requeue_orphaned_jobs(conn, 'new')
+    assert db.claim_job(conn, 'new/0', NOW).job_id == orphan.job_id
+
+    # The previous worker's late finish doesn't overwrite the new run
+    assert not db.finish_job(conn, orphan.job_id, 'old/0', NOW, ['stale'], 0)
+    assert jobs(conn) == [('N1', 'periodic', ROUTINE, 'running', 'new/0')]
+    assert conn.execute("SELECT count(*) FROM network_uploads").fetchone()[0] == 0
+
+    assert db.finish_job(conn, orphan.job_id, 'new/0', NOW, [], 0)
+    assert jobs(conn) == [('N1', 'periodic', ROUTINE, 'done', 'new/0')]
+
+
+def test_requeue_keeps_lease_holder_jobs(conn):
+    db.enqueue_jobs(conn, 'run', 'periodic', [('N1', 'O1', 'net1', ROUTINE, 0)], NOW)
+    db.claim_job(conn, 'new/0', NOW)
+
+    assert db.requeue_orphaned_jobs(conn, 'new') == 0
+    assert jobs(conn) == [('N1', 'periodic', ROUTINE, 'running', 'new/0')]
+
+
+def test_lease_takeover(conn):
+    assert db.acquire_lease(conn, 'network_jobs', 'p1', 100, 30)
+    assert not db.acquire_lease(conn, 'network_jobs', 'p2', 110, 30)
+
+    # Renewed before expiring
+    assert db.acquire_lease(conn, 'network_jobs', 'p1', 120, 30)
+    assert not db.acquire_lease(conn, 'network_jobs', 'p2', 149, 30)
+
+    # Not renewed: taken over once expired, the previous holder can't renew it anymore
+    assert db.acquire_lease(conn, 'network_jobs', 'p2', 151, 30)
+    assert not db.acquire_lease(conn, 'network_jobs', 'p1', 152, 30)
+
+    # Only the holder releases it, then it's free right away
+    db.release_lease(conn, 'network_jobs', 'p1')
+    assert not db.acquire_lease(conn, 'network_jobs', 'p1', 153, 30)
+    db.release_lease(conn, 'network_jobs', 'p2')
+    assert db.acquire_lease(conn, 'network_jobs', 'p1', 154, 30)
+
+    # Read only check of the holder and expiry
+    assert db.holds_lease(conn, 'network_jobs', 'p1', 184)
+    assert not db.holds_lease(conn, 'network_jobs', 'p2', 184)
+    assert not db.holds_lease(conn, 'network_jobs', 'p1', 185)
+
+    # Leases are independent of each other
+    assert db.acquire_lease(conn, 'drift_scan', 'p2', 154, 30)